@@ -0,0 +1,264 @@
+"""
+Benchmark suite of the route model
+
+Every benchmark case times one phase of a scenario on a graph, for every routing backend.
+The cases run on the Rotterdam graph and on synthetic graphs with a multiple of its number of edges, the results
+are appended to a JSON lines file and compared with the previous run of the same case, so regressions can be tracked.
+
+    $ python benchmarks.py --synthetic 1 10 100 --backends compiled
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import route_model
+import synthetic_graph
+
+default_results_file_path = "results/benchmarks/benchmarks.jsonl"
+# sizes of the synthetic graphs as multiples of the number of edges of the Rotterdam graph
+default_synthetic_sizes = [1, 10]
+default_repeats = 3
+
+# backend name with the init arguments of the route model
+backends = {
+    "osmnx": {"routing_backend": "osmnx"},
+    "compiled": {"routing_backend": "compiled"},
+    "compiled_trees": {"routing_backend": "compiled", "shortest_path_trees": True},
+    "compiled_astar": {"routing_backend": "compiled", "goal_directed": True},
+    "compiled_contracted": {"routing_backend": "compiled", "contract_chains": True}
+}
+
+# number of origin-destination pairs in the calculate_routes cases
+num_of_route_pairs = 10
+
+benchmark_seed = 2222
+
+
+def time_case(function, repeats, setup=None):
+    """
+    Function that times a benchmark case
+    @param function: function that runs the case once
+    @param repeats: number of timed runs
+    @param setup: optional function that is called before every run and is not timed
+    @return: list with the duration of every run in seconds
+    """
+    durations = []
+    for repeat in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def reset_routing_caches(model):
+    """
+    Function that removes the cached shortest path trees, so every run of a routing case starts cold
+    @param model: the route model
+    """
+    for compiled in [model.compiled_graph_OW_False, model.compiled_graph_OW_True] + \
+            list(model.contracted_graphs.values()):
+        if compiled is not None:
+            for weight, arc_values in compiled.weights.items():
+                compiled.set_arc_weights(weight, arc_values)
+
+
+def scenario_weights(repeat):
+    """
+    Function that returns scenario factors that differ in every factor from the previous repeat,
+    so the weights are calculated completely and not taken from the cache
+    @param repeat: number of the repeat
+    @return: dictionary with the scenario factors
+    """
+    factor = 1.5 + repeat
+    return {"CA": factor, "OA": factor, "LP": 1 / factor, "RP": 1 / factor, "OW": factor, "HS": 1 / factor,
+            "TA": factor, "TA1": 2, "TA2": 1.7, "TA3": 1.3}
+
+
+def benchmark_graph(graph_file_path, backend, repeats, neighbourhood_map_file_path=None):
+    """
+    Function that runs all benchmark cases of a graph with a routing backend
+    @param graph_file_path: path of the GraphML file
+    @param neighbourhood_map_file_path: path of the GeoJSON neighbourhood map, None uses the Rotterdam map
+    @param backend: name of the routing backend in backends
+    @param repeats: number of timed runs per case
+    @return: dictionary with the durations of every case, the number of edges of the graph and a dictionary with
+    the mean number of settled nodes per run of the routing cases, which is empty for the osmnx backend
+    """
+    settings = dict(backends[backend], graph_file_path=graph_file_path)
+    if neighbourhood_map_file_path is not None:
+        settings["neighbourhood_map_file_path"] = neighbourhood_map_file_path
+    results = {}
+
+    # graph load from the GraphML file and from the snapshot in a temporary cache, this is the startup time of
+    # the model. The compiled backend only maps the snapshot arrays, the osmnx backend also builds the lean graphs
+    # from them, so its startup grows with the number of edges.
+    results["graph_load"] = time_case(lambda: route_model.route_model(cache_dir=None, **settings), repeats)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        route_model.route_model(cache_dir=cache_dir, **settings)
+        results["graph_load_snapshot"] = time_case(
+            lambda: route_model.route_model(cache_dir=cache_dir, **settings), repeats)
+
+    # the other cases use a model without cache, so generate_points calculates the path costs
+    model = route_model.route_model(cache_dir=None, weight_cache_bytes=0, **settings)
+    num_of_edges = model.weight_engine_OW_False.num_of_edges
+
+    # the settled nodes are counted around every routing case, the counter only grows
+    settled_nodes = {}
+
+    def time_routing_case(case, function, setup=None):
+        settled_before = model.count_expansions()
+        results[case] = time_case(function, repeats, setup)
+        if model.routing_backend == "compiled":
+            settled_nodes[case] = (model.count_expansions() - settled_before) / repeats
+
+    repeat_counter = iter(range(10 ** 6))
+    results["calculate_weights"] = time_case(
+        lambda: model.calculate_weights(**scenario_weights(next(repeat_counter)), variant="OW_False"), repeats)
+
+    def generate_points():
+        model.seed = None
+        model.generate_points(benchmark_seed)
+    time_routing_case("generate_points", generate_points)
+
+    pairs = [(source, sink) for source in model.points for sink in model.points if source != sink]
+    pairs = pairs[:num_of_route_pairs]
+
+    def calculate_routes(rational):
+        for source, sink in pairs:
+            list(model.calculate_routes(source, sink, rational, strategy_change_percentage=0.5))
+
+    model.start_variant = "OW_False"
+    model.end_variant = "OW_False"
+    model.calculate_weights(*route_model.strategies[1][:-1], model.start_variant)
+    time_routing_case("calculate_routes_rational", lambda: calculate_routes(True),
+                      setup=lambda: reset_routing_caches(model))
+
+    model.calculate_weights(*route_model.strategies[2][:-1], model.end_variant)
+    time_routing_case("calculate_routes_bounded_rational", lambda: calculate_routes(False),
+                      setup=lambda: reset_routing_caches(model))
+
+    def setup_route_network():
+        model.reset_scenario_statistics()
+        reset_routing_caches(model)
+    time_routing_case("generate_route_network", lambda: model.generate_route_network(rational=True),
+                      setup=setup_route_network)
+
+    results["calculate_scenario_statistics"] = time_case(model.calculate_scenario_statistics, repeats)
+    return results, num_of_edges, settled_nodes
+
+
+def git_commit():
+    """
+    Function that returns the current git commit of the repository
+    @return: the commit hash, or None if it is not available
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(results_file_path):
+    """
+    Function that loads the stored benchmark results
+    @param results_file_path: path of the JSON lines file
+    @return: list with the stored records
+    """
+    if not os.path.exists(results_file_path):
+        return []
+    with open(results_file_path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def save_results(results_file_path, records):
+    """
+    Function that appends benchmark records to the JSON lines file
+    @param results_file_path: path of the JSON lines file
+    @param records: list with the records to store
+    """
+    os.makedirs(os.path.dirname(results_file_path) or ".", exist_ok=True)
+    with open(results_file_path, "a") as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+
+def compare_with_previous(records, previous_records):
+    """
+    Function that prints every record with the change of its median duration since the previous run of the case
+    and the number of settled nodes of the routing cases
+    @param records: list with the records of this run
+    @param previous_records: list with the stored records of earlier runs
+    """
+    previous = {}
+    for record in previous_records:
+        previous[(record["graph"], record["num_of_edges"], record["backend"], record["case"])] = record
+
+    for record in records:
+        line = f"{record['graph']:<28} {record['num_of_edges']:>8} {record['backend']:<19} {record['case']:<35} " \
+               f"{record['median']:>10.4f}s"
+        earlier = previous.get((record["graph"], record["num_of_edges"], record["backend"], record["case"]))
+        if earlier is not None and earlier["median"] > 0:
+            line += f"  {record['median'] / earlier['median']:>6.2f}x of {earlier['commit']}"
+        if record.get("settled_nodes") is not None:
+            line += f"  {record['settled_nodes']:>12.0f} settled"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the phases of the route model")
+    parser.add_argument("--graphs", nargs="*", default=None,
+                        help="GraphML files to benchmark, by default the Rotterdam graph if it is available")
+    parser.add_argument("--synthetic", nargs="*", type=float, default=default_synthetic_sizes,
+                        help="sizes of the synthetic graphs as multiples of the edges of the Rotterdam graph")
+    parser.add_argument("--backends", nargs="*", default=list(backends), choices=list(backends))
+    parser.add_argument("--repeats", type=int, default=default_repeats)
+    parser.add_argument("--results", default=default_results_file_path, help="JSON lines file with the results")
+    arguments = parser.parse_args()
+
+    # GraphML file with the neighbourhood map of every graph
+    graph_file_paths = arguments.graphs
+    if graph_file_paths is None:
+        graph_file_paths = [path for path in [route_model.default_graph_file_path] if os.path.exists(path)]
+    graph_files = [(path, None) for path in graph_file_paths]
+
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        for size in arguments.synthetic:
+            file_path = os.path.join(synthetic_dir, f"synthetic_{size:g}x.graphml")
+            neighbourhood_map_file_path = os.path.join(synthetic_dir, f"synthetic_{size:g}x.geojson")
+            synthetic_graph.write_synthetic_graph(file_path, neighbourhood_map_file_path,
+                                                  int(size * synthetic_graph.base_case_num_of_edges))
+            graph_files.append((file_path, neighbourhood_map_file_path))
+
+        run_information = {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.node(),
+            "processor": platform.processor() or platform.machine()
+        }
+
+        records = []
+        for graph_file_path, neighbourhood_map_file_path in graph_files:
+            for backend in arguments.backends:
+                durations, num_of_edges, settled_nodes = benchmark_graph(graph_file_path, backend, arguments.repeats,
+                                                                         neighbourhood_map_file_path)
+                for case, case_durations in durations.items():
+                    records.append(dict(run_information, graph=os.path.basename(graph_file_path),
+                                        num_of_edges=num_of_edges, backend=backend, case=case,
+                                        repeats=arguments.repeats, min=min(case_durations),
+                                        median=statistics.median(case_durations),
+                                        mean=statistics.mean(case_durations),
+                                        settled_nodes=settled_nodes.get(case)))
+
+    compare_with_previous(records, load_results(arguments.results))
+    save_results(arguments.results, records)
@@ -0,0 +1,611 @@
+import heapq
+import math
+from itertools import count, islice
+
+import networkx as nx
+import numpy as np
+
+
+# arrays that describe a compiled graph completely
+compiled_array_names = ["node_id_array", "node_x", "node_y", "arc_starts", "arc_edges", "arc_origins", "targets",
+                        "offsets", "reverse_arcs", "reverse_offsets"]
+
+# mean radius of the earth in meters, the same radius osmnx uses for the edge lengths
+earth_radius = 6371009
+
+# relative margin on the lower bound factor, so rounding errors in the distances never make it too large
+lower_bound_margin = 1e-9
+
+
+def great_circle_distances(x1, y1, x2, y2):
+    """
+    Function that calculates the great circle distances between points with the haversine formula
+    @param x1: array with the longitudes of the first points
+    @param y1: array with the latitudes of the first points
+    @param x2: array or value with the longitudes of the second points
+    @param y2: array or value with the latitudes of the second points
+    @return: array with the distances in meters
+    """
+    x1, y1, x2, y2 = np.radians(x1), np.radians(y1), np.radians(x2), np.radians(y2)
+    h = np.sin((y2 - y1) / 2) ** 2 + np.cos(y1) * np.cos(y2) * np.sin((x2 - x1) / 2) ** 2
+    return 2 * earth_radius * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+class path_buffer:
+    """
+            Class that holds the candidate paths of Yen's algorithm ordered by cost.
+            Equal costs are popped in insertion order, the same as the networkx PathBuffer.
+    """
+
+    def __init__(self):
+        self.paths = set()
+        self.sorted_paths = []
+        self.counter = count()
+
+    def __len__(self):
+        return len(self.sorted_paths)
+
+    def push(self, cost, path):
+        hashable_path = tuple(path)
+        if hashable_path not in self.paths:
+            heapq.heappush(self.sorted_paths, (cost, next(self.counter), path))
+            self.paths.add(hashable_path)
+
+    def pop(self):
+        (cost, num, path) = heapq.heappop(self.sorted_paths)
+        self.paths.remove(tuple(path))
+        return path
+
+
+class node_index_map:
+    """
+            Class that maps original node ids to node indexes with a binary search in the sorted node ids, so no
+            dictionary with an entry per node is built in every process that loads the compiled graph.
+
+            Attributes
+            ----------
+            order: array[int]
+                node index of every sorted node id
+            sorted_ids: array[int]
+                the sorted node ids
+    """
+
+    def __init__(self, node_id_array):
+        """
+            Init method that sorts the node ids.
+            @param node_id_array: array with the original node id of every node index
+        """
+        self.order = np.argsort(node_id_array, kind="stable")
+        self.sorted_ids = np.asarray(node_id_array)[self.order]
+
+    def find(self, node):
+        """
+        Function that returns the position of a node id in the sorted node ids
+        @param node: original node id
+        @return: the position, or None if the node id is not in the graph
+        """
+        position = int(np.searchsorted(self.sorted_ids, node))
+        if position < len(self.sorted_ids) and self.sorted_ids[position] == node:
+            return position
+        return None
+
+    def __contains__(self, node):
+        return self.find(node) is not None
+
+    def __getitem__(self, node):
+        position = self.find(node)
+        if position is None:
+            raise KeyError(node)
+        return int(self.order[position])
+
+
+class compiled_graph:
+    """
+            Class that contains a compiled representation of a road graph for routing.
+            Nodes are numbered with integers and the arcs are stored in CSR form, parallel edges are
+            collapsed to the minimum weight, the same as osmnx does before calling networkx.
+
+            Attributes
+            ----------
+            node_ids: memoryview
+                original node id of every node index
+            node_index: object
+                node index of every original node id
+            offsets: array[int]
+                start of the outgoing arcs of every node in targets
+            targets: array[int]
+                destination node index of every arc
+            weights: dict
+                array with the weight of every arc per weight name
+            reverse_offsets: array[int]
+                start of the incoming arcs of every node in reverse_arcs
+            reverse_arcs: array[int]
+                arc index of every incoming arc, grouped by destination node
+            node_x: array[float]
+                longitude of every node index
+            node_y: array[float]
+                latitude of every node index
+            expansions: int
+                number of nodes settled by all Dijkstra searches on the graph
+            weight_versions: dict
+                number of times the weights were set per weight name
+    """
+
+    def __init__(self, graph=None, edge_keys=None, arrays=None):
+        """
+            Init method that compiles the graph into CSR arrays.
+            Undirected graphs get an arc in both directions for every edge.
+            If the arrays of an earlier compilation are given, for example attached from shared memory,
+            the graph is not needed.
+            @param graph: the networkx graph to compile
+            @param edge_keys: (origin, destination, key) of every edge, in the order of the edge value arrays
+            @param arrays: dictionary with the arrays of an earlier compilation, see to_arrays
+        """
+        if arrays is None:
+            self.compile(graph, edge_keys)
+        else:
+            for name in compiled_array_names:
+                setattr(self, name, arrays[name])
+
+        # memoryviews give python numbers for the element wise access in the search loops, almost as fast as
+        # lists and without a copy, so memory mapped and shared arrays stay shared between the processes
+        self.node_ids = memoryview(self.node_id_array)
+        self.node_index = node_index_map(self.node_id_array)
+        self.num_of_nodes = len(self.node_ids)
+        self.num_of_arcs = len(self.targets)
+
+        self._offsets = memoryview(self.offsets)
+        self._targets = memoryview(self.targets)
+        self._reverse_offsets = memoryview(self.reverse_offsets)
+        self._reverse_arcs = memoryview(self.reverse_arcs)
+        self._reverse_sources = memoryview(self.arc_origins[self.reverse_arcs])
+
+        self.weights = {}
+        self._weights = {}
+        self.weight_versions = {}
+
+        # shortest path trees per weight name, keyed by (root, reverse)
+        self.trees = {}
+
+        # counted once per search, so the search loops are not slowed down
+        self.expansions = 0
+
+        # straight line lower bound factor per weight name and the great circle length of every arc
+        self.lower_bound_factors = {}
+        self.arc_distances = None
+
+    def compile(self, graph, edge_keys):
+        """
+        Function that compiles the nodes and edges of a networkx graph into the CSR arrays
+        @param graph: the networkx graph to compile
+        @param edge_keys: (origin, destination, key) of every edge, in the order of the edge value arrays
+        """
+        edge_keys = np.asarray(edge_keys, dtype=np.int64).reshape(-1, 3).tolist()
+        node_ids = list(graph.nodes())
+        node_index = {node: index for index, node in enumerate(node_ids)}
+        num_of_nodes = len(node_ids)
+        self.node_id_array = np.array(node_ids, dtype=np.int64)
+        self.node_x = np.array([graph.nodes[node]["x"] for node in node_ids], dtype=np.float64)
+        self.node_y = np.array([graph.nodes[node]["y"] for node in node_ids], dtype=np.float64)
+
+        origins = np.array([node_index[u] for u, v, k in edge_keys], dtype=np.int64)
+        destinations = np.array([node_index[v] for u, v, k in edge_keys], dtype=np.int64)
+        edges = np.arange(len(edge_keys), dtype=np.int64)
+
+        if not graph.is_directed():
+            origins, destinations = np.concatenate([origins, destinations]), np.concatenate([destinations, origins])
+            edges = np.concatenate([edges, edges])
+
+        order = np.lexsort((destinations, origins))
+        origins, destinations = origins[order], destinations[order]
+
+        # every group of parallel arcs is collapsed to a single arc
+        new_arc = np.ones(len(order), dtype=bool)
+        new_arc[1:] = (origins[1:] != origins[:-1]) | (destinations[1:] != destinations[:-1])
+        self.arc_starts = np.flatnonzero(new_arc)
+        self.arc_edges = edges[order]
+
+        self.arc_origins = origins[self.arc_starts]
+        self.targets = destinations[self.arc_starts]
+        self.offsets = np.zeros(num_of_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.arc_origins, minlength=num_of_nodes), out=self.offsets[1:])
+
+        # incoming arcs for the searches towards a sink
+        self.reverse_arcs = np.argsort(self.targets, kind="stable")
+        self.reverse_offsets = np.zeros(num_of_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.targets, minlength=num_of_nodes), out=self.reverse_offsets[1:])
+
+    def to_arrays(self):
+        """
+        Function that returns the compiled arrays, so they can be shared and passed back to the init method
+        @return: dictionary with the name and array of every compiled attribute
+        """
+        return {name: getattr(self, name) for name in compiled_array_names}
+
+    def set_weights(self, weight, edge_values, changed_edges=None):
+        """
+        Function that sets the arc weights from an array with a value for every edge.
+        Parallel edges are collapsed to the minimum value.
+        @param weight: name of the weight
+        @param edge_values: array with a value for every edge, in the order of edge_keys
+        @param changed_edges: optional array with the indexes of the only edges that changed since the weights
+        were set the last time, the cached trees that these edges can not change are then kept
+        """
+        arc_values = np.minimum.reduceat(np.asarray(edge_values, dtype=np.float64)[self.arc_edges],
+                                         self.arc_starts)
+        if changed_edges is None or weight not in self.weights:
+            self.set_arc_weights(weight, arc_values)
+            return
+
+        # the arcs of which one of the collapsed edges changed
+        arc_sizes = np.diff(np.append(self.arc_starts, len(self.arc_edges)))
+        arc_of_edge_position = np.repeat(np.arange(self.num_of_arcs), arc_sizes)
+        changed_arcs = np.unique(arc_of_edge_position[np.isin(self.arc_edges, changed_edges)])
+        self.update_arc_weights(weight, arc_values, changed_arcs)
+
+    def set_arc_weights(self, weight, arc_values):
+        """
+        Function that sets the arc weights directly and clears the cached trees of the weight
+        @param weight: name of the weight
+        @param arc_values: array with a value for every arc
+        """
+        arc_values = np.ascontiguousarray(arc_values, dtype=np.float64)
+        self.weights[weight] = arc_values
+        self._weights[weight] = memoryview(arc_values)
+        self.trees[weight] = {}
+        self.lower_bound_factors.pop(weight, None)
+        self.weight_versions[weight] = self.weight_versions.get(weight, 0) + 1
+
+    def update_arc_weights(self, weight, arc_values, changed_arcs):
+        """
+        Function that sets new arc weights when only some arcs changed.
+        A cached tree is kept if no changed arc could give a node of the tree an equal or shorter distance,
+        neither with the old nor with the new weight. Dijkstra then sets the same distances and parents,
+        so the tree is the same as when it would be calculated again.
+        @param weight: name of the weight
+        @param arc_values: array with a value for every arc
+        @param changed_arcs: array with the indexes of the arcs that can have a different value
+        """
+        arc_values = np.ascontiguousarray(arc_values, dtype=np.float64)
+        old_values = self.weights[weight]
+        changed_arcs = changed_arcs[arc_values[changed_arcs] != old_values[changed_arcs]]
+
+        self.weights[weight] = arc_values
+        self._weights[weight] = memoryview(arc_values)
+        self.lower_bound_factors.pop(weight, None)
+        self.weight_versions[weight] += 1
+
+        origins = self.arc_origins[changed_arcs]
+        destinations = self.targets[changed_arcs]
+        old_weights = old_values[changed_arcs]
+        new_weights = arc_values[changed_arcs]
+
+        kept_trees = {}
+        for (root, reverse), tree in self.trees[weight].items():
+            distances = np.array(tree[0])
+            # a reverse tree relaxes the arcs from their destination to their origin
+            start, end = (destinations, origins) if reverse else (origins, destinations)
+            start_distances = distances[start]
+            end_distances = distances[end]
+            unaffected = np.isinf(start_distances) | ((start_distances + old_weights > end_distances) &
+                                                      (start_distances + new_weights > end_distances))
+            if unaffected.all():
+                kept_trees[(root, reverse)] = tree
+        self.trees[weight] = kept_trees
+
+    def arc_between(self, u, v):
+        """
+        Function that returns the arc between two node indexes, found among the few outgoing arcs of the origin
+        @param u: node index of the origin
+        @param v: node index of the destination
+        @return: the arc index
+        """
+        targets = self._targets
+        for arc in range(self._offsets[u], self._offsets[u + 1]):
+            if targets[arc] == v:
+                return arc
+        raise KeyError((u, v))
+
+    def arc_weight(self, u, v, weight):
+        """
+        Function that returns the weight of the arc between two node indexes
+        @param u: node index of the origin
+        @param v: node index of the destination
+        @param weight: name of the weight
+        @return: the weight of the arc
+        """
+        return self._weights[weight][self.arc_between(u, v)]
+
+    def lower_bound_factor(self, weight):
+        """
+        Function that returns the largest factor with which the straight line distance between the end nodes of
+        every arc is at most its weight. For the used weight, the length divided by the speed and multiplied by
+        the scenario factors, this is at least one over the maximum speed times the smallest product of factors,
+        as an edge is never shorter than the straight line. Because the bound holds for every arc it is also
+        consistent, so an A* search with it settles every node at its shortest distance.
+        The factor is calculated once per weight until the weights are set again.
+        @param weight: name of the weight
+        @return: the lower bound factor, 0 if the weights give no bound
+        """
+        if weight not in self.lower_bound_factors:
+            if self.arc_distances is None:
+                origins = self.arc_origins
+                self.arc_distances = great_circle_distances(self.node_x[origins], self.node_y[origins],
+                                                            self.node_x[self.targets], self.node_y[self.targets])
+            positive = self.arc_distances > 0
+            factor = 0.0
+            if positive.any():
+                factor = float(np.min(self.weights[weight][positive] / self.arc_distances[positive]))
+            self.lower_bound_factors[weight] = max(factor * (1 - lower_bound_margin), 0.0)
+        return self.lower_bound_factors[weight]
+
+    def straight_line_potentials(self, target, weight):
+        """
+        Function that returns the straight line lower bound of the distance of every node to a target
+        @param target: node index of the destination
+        @param weight: name of the weight
+        @return: list with a lower bound of the distance of every node to the target
+        """
+        distances = great_circle_distances(self.node_x, self.node_y, self.node_x[target], self.node_y[target])
+        return (distances * self.lower_bound_factor(weight)).tolist()
+
+    def shortest_path(self, source, target, weight, ignore_nodes=None, ignore_edges=None, potentials=None):
+        """
+        Function that calculates the shortest path between two node indexes with Dijkstra's algorithm.
+        If potentials are given, the search is an A* search with the potentials as lower bounds.
+        @param source: node index of the origin
+        @param target: node index of the destination
+        @param weight: name of the weight
+        @param ignore_nodes: set of node indexes that can not be used
+        @param ignore_edges: set of (origin, destination) node index pairs that can not be used
+        @param potentials: list with a lower bound of the distance of every node to the target
+        @return: the length of the path and the path as list of node indexes
+        """
+        if ignore_nodes is None:
+            ignore_nodes = set()
+        if ignore_edges is None:
+            ignore_edges = set()
+
+        if source in ignore_nodes or target in ignore_nodes:
+            raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+
+        offsets = self._offsets
+        targets = self._targets
+        weights = self._weights[weight]
+
+        distances = {source: 0.0}
+        predecessors = {source: None}
+        settled = set()
+        heap = [(0.0 if potentials is None else potentials[source], source)]
+
+        while heap:
+            key, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            distance = distances[node]
+            if node == target:
+                self.expansions += len(settled) + 1
+                path = [node]
+                while predecessors[node] is not None:
+                    node = predecessors[node]
+                    path.append(node)
+                return distance, path[::-1]
+            settled.add(node)
+
+            for arc in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[arc]
+                if neighbour in settled or neighbour in ignore_nodes:
+                    continue
+                if ignore_edges and (node, neighbour) in ignore_edges:
+                    continue
+                new_distance = distance + weights[arc]
+                if neighbour not in distances or new_distance < distances[neighbour]:
+                    distances[neighbour] = new_distance
+                    predecessors[neighbour] = node
+                    if potentials is None:
+                        heapq.heappush(heap, (new_distance, neighbour))
+                    elif potentials[neighbour] < math.inf:
+                        heapq.heappush(heap, (new_distance + potentials[neighbour], neighbour))
+
+        self.expansions += len(settled)
+        raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+
+    def shortest_path_tree(self, root, weight, reverse=False):
+        """
+        Function that calculates the shortest path tree of a node with Dijkstra's algorithm.
+        The trees are cached until the weights are set again.
+        @param root: node index of the root
+        @param weight: name of the weight
+        @param reverse: if True, the tree of the shortest paths towards the root is calculated
+        @return: list with the distance of every node to or from the root and list with the parent of every
+        node in the tree, which is the next node towards the root
+        """
+        trees = self.trees[weight]
+        if (root, reverse) in trees:
+            return trees[(root, reverse)]
+
+        weights = self._weights[weight]
+        if reverse:
+            offsets = self._reverse_offsets
+            neighbours = self._reverse_sources
+            arcs = self._reverse_arcs
+        else:
+            offsets = self._offsets
+            neighbours = self._targets
+            arcs = range(self.num_of_arcs)
+
+        distances = [math.inf] * self.num_of_nodes
+        parents = [-1] * self.num_of_nodes
+        settled = [False] * self.num_of_nodes
+        distances[root] = 0.0
+        heap = [(0.0, root)]
+
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if settled[node]:
+                continue
+            settled[node] = True
+
+            for index in range(offsets[node], offsets[node + 1]):
+                neighbour = neighbours[index]
+                if settled[neighbour]:
+                    continue
+                new_distance = distance + weights[arcs[index]]
+                if new_distance < distances[neighbour]:
+                    distances[neighbour] = new_distance
+                    parents[neighbour] = node
+                    heapq.heappush(heap, (new_distance, neighbour))
+
+        self.expansions += sum(settled)
+        trees[(root, reverse)] = (distances, parents)
+        return distances, parents
+
+    def tree_path(self, source, target, weight):
+        """
+        Function that extracts the shortest path between two node indexes from the tree of the source
+        @param source: node index of the origin
+        @param target: node index of the destination
+        @param weight: name of the weight
+        @return: the length of the path and the path as list of node indexes
+        """
+        distances, parents = self.shortest_path_tree(source, weight)
+        if distances[target] == math.inf:
+            raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+
+        path = [target]
+        while path[-1] != source:
+            path.append(parents[path[-1]])
+        return distances[target], path[::-1]
+
+    def reverse_tree_path(self, source, target, weight):
+        """
+        Function that extracts the shortest path between two node indexes from the reverse tree of the target
+        @param source: node index of the origin
+        @param target: node index of the destination
+        @param weight: name of the weight
+        @return: the length of the path and the path as list of node indexes
+        """
+        distances, parents = self.shortest_path_tree(target, weight, reverse=True)
+        if distances[source] == math.inf:
+            raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+
+        path = [source]
+        while path[-1] != target:
+            path.append(parents[path[-1]])
+        return distances[source], path
+
+    def tree_spur_path(self, spur_node, target, weight, ignore_nodes, ignore_edges):
+        """
+        Function that calculates a spur path of Yen's algorithm with the reverse tree of the target.
+        If the tree path from the spur node uses no ignored node or edge, it is the shortest spur path,
+        otherwise an A* search is done with the tree distances as lower bounds. Removing nodes and edges
+        can only make paths longer, so these bounds are exact where the tree is untouched.
+        @param spur_node: node index of the spur node
+        @param target: node index of the destination
+        @param weight: name of the weight
+        @param ignore_nodes: set of node indexes that can not be used
+        @param ignore_edges: set of (origin, destination) node index pairs that can not be used
+        @return: the length of the path and the path as list of node indexes
+        """
+        distances, parents = self.shortest_path_tree(target, weight, reverse=True)
+        if distances[spur_node] == math.inf:
+            # removing nodes and edges can not create a new path
+            raise nx.NetworkXNoPath(f"No path between {spur_node} and {target}.")
+
+        path = [spur_node]
+        while path[-1] != target:
+            node = parents[path[-1]]
+            if node in ignore_nodes or (path[-1], node) in ignore_edges:
+                return self.shortest_path(spur_node, target, weight, ignore_nodes=ignore_nodes,
+                                          ignore_edges=ignore_edges, potentials=distances)
+            path.append(node)
+        return distances[spur_node], path
+
+    def shortest_simple_paths(self, source, target, weight, use_trees=False, goal_directed=False):
+        """
+        Generator of the loopless paths between two node indexes from short to long, using Yen's algorithm.
+        The roots, ignored nodes and edges and the order of the candidate paths follow
+        networkx.shortest_simple_paths, so the paths have the same lengths. networkx searches the first path and
+        the spur paths with a bidirectional Dijkstra and this function with a unidirectional one, so between
+        paths of equal cost another path can be chosen, after which the later paths can differ as well.
+        With use_trees the first path is taken from the shortest path tree of the source and the spur paths
+        are seeded from the reverse tree of the target. With goal_directed the first path and the spur paths
+        are A* searches with the straight line lower bound, which settle fewer nodes. In both cases the paths
+        have the same lengths, but equal cost paths can be chosen differently.
+        @param source: node index of the origin
+        @param target: node index of the destination
+        @param weight: name of the weight
+        @param use_trees: Boolean indicating if the cached shortest path trees are used
+        @param goal_directed: Boolean indicating if the searches are A* searches towards the target
+        """
+        # the bound of every node to the target is calculated once for all spur searches
+        potentials = None
+        if goal_directed and not use_trees:
+            potentials = self.straight_line_potentials(target, weight)
+
+        list_a = []
+        list_b = path_buffer()
+        prev_path = None
+        while True:
+            if not prev_path:
+                if use_trees:
+                    length, path = self.tree_path(source, target, weight)
+                else:
+                    length, path = self.shortest_path(source, target, weight, potentials=potentials)
+                list_b.push(length, path)
+            else:
+                ignore_nodes = set()
+                ignore_edges = set()
+                root_length = 0
+                for i in range(1, len(prev_path)):
+                    root = prev_path[:i]
+                    if i > 1:
+                        root_length += self.arc_weight(root[-2], root[-1], weight)
+                    for path in list_a:
+                        if path[:i] == root:
+                            ignore_edges.add((path[i - 1], path[i]))
+                    try:
+                        if use_trees:
+                            length, spur = self.tree_spur_path(root[-1], target, weight, ignore_nodes, ignore_edges)
+                        else:
+                            length, spur = self.shortest_path(root[-1], target, weight, ignore_nodes=ignore_nodes,
+                                                              ignore_edges=ignore_edges, potentials=potentials)
+                        path = root[:-1] + spur
+                        list_b.push(root_length + length, path)
+                    except nx.NetworkXNoPath:
+                        pass
+                    ignore_nodes.add(root[-1])
+
+            if list_b:
+                path = list_b.pop()
+                yield path
+                list_a.append(path)
+                prev_path = path
+            else:
+                break
+
+    def k_shortest_paths(self, orig, dest, k, weight="used_weight", use_trees=False, goal_directed=False):
+        """
+        Generator of the k shortest paths between two nodes, a replacement of ox.distance.k_shortest_paths
+        @param orig: node id of the origin
+        @param dest: node id of the destination
+        @param k: number of shortest paths to solve
+        @param weight: name of the weight
+        @param use_trees: Boolean indicating if the cached shortest path trees are used
+        @param goal_directed: Boolean indicating if the searches are A* searches towards the destination
+        """
+        paths = self.shortest_simple_paths(self.node_index[orig], self.node_index[dest], weight, use_trees,
+                                           goal_directed)
+        for path in islice(paths, 0, k):
+            yield [self.node_ids[node] for node in path]
+
+    def shortest_path_to(self, orig, dest, weight="used_weight"):
+        """
+        Function that returns the shortest path between two nodes from the cached reverse tree of the destination
+        @param orig: node id of the origin
+        @param dest: node id of the destination
+        @param weight: name of the weight
+        @return: the path as list of node ids
+        """
+        length, path = self.reverse_tree_path(self.node_index[orig], self.node_index[dest], weight)
+        return [self.node_ids[node] for node in path]
@@ -0,0 +1,162 @@
+"""
+Pipeline that integrates the camera and obstacle data of the data folder into the road graph
+
+It replaces the steps of notebooks/graph/data_integration.ipynb. All points of all layers are snapped in bulk with
+one KD-tree over the nodes and one STR-tree over the motorway and trunk edges, the flags are set on the graph in
+one pass and the graph is written once.
+
+    $ python data_integration.py --base graph/rotterdam_drive_basic.graphml --output graph/graph_base_case.graphml
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import osmnx as ox
+import pandas as pd
+
+from route_model import default_graph_file_path, default_map_bounds
+from spatial_index import node_spatial_index, edge_spatial_index
+
+default_data_dir = "data"
+default_base_graph_file_path = "graph/rotterdam_drive_basic.graphml"
+default_camera_file_path = "cameras/camer_data_fixed.xlsx"
+
+# cameras are placed on the closest edge of these road types
+camera_highways = ["motorway", "trunk"]
+
+# flag set on the closest node and its incoming edges, with the OpenStreetMap export of the layer in the data folder
+obstacle_layers = {
+    "traffic_light": "traffic_lights/export.json",
+    "bridge": "bridges/export.json",
+    "roundabout": "roundabouts/export.json",
+    "tunnel": "tunnels/export.json"
+}
+
+
+def load_cameras(file_path, bounds=default_map_bounds):
+    """
+    Function that loads the camera locations that lie within the bounds of the graph
+    @param file_path: Excel file or semicolon separated CSV file with Latitude and Longitude columns
+    @param bounds: (lon_min, lat_min, lon_max, lat_max) of the graph
+    @return: arrays with the latitude and longitude of the cameras
+    """
+    if file_path.endswith(".csv"):
+        cameras = pd.read_csv(file_path, sep=";", decimal=",")
+    else:
+        cameras = pd.read_excel(file_path)
+
+    latitude = cameras["Latitude"].to_numpy(dtype=np.float64)
+    longitude = cameras["Longitude"].to_numpy(dtype=np.float64)
+    lon_min, lat_min, lon_max, lat_max = bounds
+    inside = (latitude >= lat_min) & (latitude <= lat_max) & (longitude >= lon_min) & (longitude <= lon_max)
+    return latitude[inside], longitude[inside]
+
+
+def load_osm_nodes(file_path):
+    """
+    Function that loads the locations of the node elements of an OpenStreetMap export, ways are skipped
+    because osmnx already keeps their tags on the edges
+    @param file_path: JSON file with the elements of an Overpass query
+    @return: arrays with the latitude and longitude of the nodes
+    """
+    elements = pd.read_json(file_path, orient="records")
+    nodes = elements[elements["type"] == "node"]
+    return nodes["lat"].to_numpy(dtype=np.float64), nodes["lon"].to_numpy(dtype=np.float64)
+
+
+def integrate_data(graph, data_dir=default_data_dir, camera_file_path=None, bounds=default_map_bounds):
+    """
+    Function that sets the camera and obstacle flags on the nodes and edges of a graph.
+    A camera is placed on the closest motorway or trunk edge, both directions of the edge and both end nodes
+    get the camera flag. A traffic light, bridge, roundabout or tunnel is placed on the closest node, the node
+    and its incoming edges get the flag.
+    @param graph: the osmnx graph, changed in place
+    @param data_dir: folder with the data files
+    @param camera_file_path: file with the camera locations, None uses the fixed cameras in the data folder
+    @param bounds: (lon_min, lat_min, lon_max, lat_max) of the graph, cameras outside are skipped
+    @return: dictionary with the number of flagged nodes and edges per flag
+    """
+    if camera_file_path is None:
+        camera_file_path = os.path.join(data_dir, default_camera_file_path)
+
+    node_flags = {}
+    edge_flags = {}
+
+    # cameras, snapped in bulk to the closest motorway or trunk edge
+    latitude, longitude = load_cameras(camera_file_path, bounds)
+    if len(latitude) > 0:
+        edge_index = edge_spatial_index(graph, highways=camera_highways)
+        for u, v in edge_index.nearest_edges(longitude, latitude):
+            node_flags.setdefault("camera", set()).update([u, v])
+            edge_flags.setdefault("camera", set()).update([(u, v), (v, u)])
+
+    # obstacles, snapped in bulk to the closest node with one KD-tree for all layers
+    node_index = node_spatial_index(graph)
+    for flag, file_name in obstacle_layers.items():
+        latitude, longitude = load_osm_nodes(os.path.join(data_dir, file_name))
+        if len(latitude) == 0:
+            continue
+        nodes = set(node_index.nearest_nodes(longitude, latitude))
+        node_flags.setdefault(flag, set()).update(nodes)
+        edge_flags.setdefault(flag, set()).update((u, v) for node in nodes for u, v in graph.in_edges(node))
+
+    # the flags of all layers are set in one pass over the flagged nodes and edges
+    counts = {}
+    for flag, nodes in node_flags.items():
+        for node in nodes:
+            graph.nodes[node][flag] = True
+        counts[f"nodes_with_{flag}"] = len(nodes)
+
+    for flag, edges in edge_flags.items():
+        num_of_edges = 0
+        for u, v in edges:
+            if not graph.has_edge(u, v):
+                continue
+            for data in graph[u][v].values():
+                data[flag] = True
+                num_of_edges += 1
+        counts[f"edges_with_{flag}"] = num_of_edges
+    return counts
+
+
+def build_graph(base_graph_file_path=default_base_graph_file_path, output_file_path=default_graph_file_path,
+                data_dir=default_data_dir, camera_file_path=None, bounds=default_map_bounds):
+    """
+    Function that builds the enriched road graph from the base graph and the data folder and writes it once.
+    If the base graph file does not exist, the drive network within the bounds is downloaded with osmnx
+    and stored as base graph first.
+    @param base_graph_file_path: GraphML file of the road graph without data
+    @param output_file_path: GraphML file of the enriched graph
+    @param data_dir: folder with the data files
+    @param camera_file_path: file with the camera locations, None uses the fixed cameras in the data folder
+    @param bounds: (lon_min, lat_min, lon_max, lat_max) of the graph
+    @return: dictionary with the number of flagged nodes and edges per flag
+    """
+    if os.path.exists(base_graph_file_path):
+        graph = ox.load_graphml(base_graph_file_path)
+    else:
+        lon_min, lat_min, lon_max, lat_max = bounds
+        graph = ox.graph_from_bbox(lat_max, lat_min, lon_max, lon_min, network_type="drive")
+        ox.save_graphml(graph, filepath=base_graph_file_path)
+
+    counts = integrate_data(graph, data_dir, camera_file_path, bounds)
+    ox.save_graphml(graph, filepath=output_file_path)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Integrate the camera and obstacle data into the road graph")
+    parser.add_argument("--base", default=default_base_graph_file_path,
+                        help="GraphML file of the road graph without data, downloaded if it does not exist")
+    parser.add_argument("--output", default=default_graph_file_path, help="GraphML file of the enriched graph")
+    parser.add_argument("--data", default=default_data_dir, help="folder with the data files")
+    parser.add_argument("--cameras", default=None, help="Excel or CSV file with the camera locations")
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    integration_counts = build_graph(arguments.base, arguments.output, arguments.data, arguments.cameras)
+    for name, value in integration_counts.items():
+        print(f"{name}: {value}")
+    print(f"built {arguments.output} in {time.perf_counter() - start:.1f}s")
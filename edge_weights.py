@@ -0,0 +1,494 @@
+from collections import OrderedDict
+
+import numpy as np
+
+# if maximum speed is not specified, max speed of 30 km/h is assumed
+# the number of edges without maximum speed is 2402, from the total of 25348 edges (so 9.47%)
+default_maxspeed = 30.0
+high_speed_threshold = 50
+
+# the weight vectors of 25348 edges take 200 kB, so the default keeps a few hundred scenarios
+default_weight_cache_bytes = 64 * 1024 * 1024
+
+obstacle_flags = ["roundabout", "traffic_light", "bridge", "tunnel"]
+
+# arrays that are stored in a graph snapshot, next to one array per obstacle flag
+array_names = ["length", "maxspeed", "high_speed", "camera", "multi_lane", "residential", "oneway", "traffic_class",
+               "group_last", "base_case"]
+
+# scenario factors in the order of the arguments of compute_weights
+factor_names = ["CA", "OA", "LP", "RP", "OW", "HS", "TA", "TA1", "TA2", "TA3"]
+
+# above this share of changed edges all weights are calculated again instead of only the changed edges
+incremental_update_share = 0.5
+
+# traffic avoidance classes, the class number selects TA1, TA2 or TA3
+traffic_classes = {
+    1: ['motorway', 'motorway_link', 'trunk'],
+    2: ['primary', 'primary_link', 'secondary'],
+    3: ['tertiary']
+}
+
+
+def parse_maxspeed(data):
+    """
+    Function that parses the maximum speed of an edge in the same way as the original edge loop
+    @param data: edge attribute dictionary
+    @return: the maximum speed as float and a boolean indicating if the speed was specified
+    """
+    if isinstance(data.get('maxspeed'), list):
+        return float(data.get('maxspeed')[0]), True
+    elif isinstance(data.get('maxspeed'), str):
+        return float(data.get('maxspeed')), True
+    return default_maxspeed, False
+
+
+class edge_weight_engine:
+    """
+            Class that compiles the weight relevant edge attributes of a graph into numpy arrays.
+            The weights of a scenario are then calculated with masked multiplications and written
+            back to the graph in one pass. An engine loaded from arrays can also have no graph, its edge
+            attributes are then kept as arrays.
+
+            Attributes
+            ----------
+            graph: object
+                graph of which the edges are compiled, or None
+            edge_keys: array[int]
+                (origin, destination, key) of every edge, in the order of graph.edges
+            attributes: dict
+                array with the value of every edge per edge attribute, used when there is no graph
+            length: array[float]
+                length of every edge
+            maxspeed: array[float]
+                parsed maximum speed of every edge
+            speed: array[float]
+                travel speed of every edge, the maximum speed unless observed speeds are set
+            group_last: array[int]
+                index of the last edge with the same origin and destination
+            base_case: array[float]
+                travel time weight of every edge without scenario factors
+            used_weight: array[float]
+                weight of every edge in the last calculated scenario
+            used_factors: dict
+                scenario factors of used_weight
+    """
+
+    def __init__(self, graph, edge_keys=None, arrays=None, attributes=None):
+        """
+            Init method that walks the edges of the graph once and stores the attributes as arrays.
+            If arrays of an earlier compilation are given, the edges are not walked again.
+            @param graph: the graph to compile, can be None if arrays are given
+            @param edge_keys: (origin, destination, key) of every edge in the given arrays
+            @param arrays: dictionary with the arrays of an earlier compilation, see to_arrays
+            @param attributes: dictionary with an array of edge values per edge attribute, used without a graph
+        """
+        self.graph = graph
+        self.used_weight = None
+        self.used_factors = None
+        self.attributes = dict(attributes or {})
+
+        if arrays is not None:
+            self.edge_keys = np.asarray(edge_keys, dtype=np.int64).reshape(-1, 3)
+            self.edge_data = None
+            if graph is not None:
+                # the adjacency dictionaries are used directly, the graph views are too slow for every edge
+                adjacency = graph._adj
+                self.edge_data = [adjacency[origin_num][destination_num][key]
+                                  for origin_num, destination_num, key in self.edge_keys.tolist()]
+            self.num_of_edges = len(self.edge_keys)
+            for name in array_names:
+                setattr(self, name, arrays[name])
+            self.obstacles = {flag: arrays["obstacle_" + flag] for flag in obstacle_flags}
+            self.speed = self.maxspeed
+            return
+
+        self.edge_keys = []
+        self.edge_data = []
+
+        length = []
+        maxspeed = []
+        speed_known = []
+        camera = []
+        obstacles = {flag: [] for flag in obstacle_flags}
+        multi_lane = []
+        residential = []
+        oneway = []
+        traffic_class = []
+
+        for origin_num, destination_num, key, data in graph.edges(keys=True, data=True):
+            self.edge_keys.append((origin_num, destination_num, key))
+            self.edge_data.append(data)
+
+            speed, known = parse_maxspeed(data)
+            length.append(data.get('length'))
+            maxspeed.append(speed)
+            speed_known.append(known)
+
+            camera.append("camera" in data)
+            for flag in obstacle_flags:
+                obstacles[flag].append(flag in data)
+
+            multi_lane.append("lanes" in data and int(data["lanes"][0]) > 1)
+            residential.append(data["highway"] in ['residential'])
+            oneway.append(bool(data["oneway"]))
+
+            edge_class = 0
+            if 'highway' in data:
+                for class_num, highways in traffic_classes.items():
+                    if data["highway"] in highways:
+                        edge_class = class_num
+                        break
+            traffic_class.append(edge_class)
+
+        self.num_of_edges = len(self.edge_keys)
+
+        self.length = np.array(length, dtype=np.float64)
+        self.maxspeed = np.array(maxspeed, dtype=np.float64)
+        self.speed = self.maxspeed
+        self.high_speed = np.array(speed_known, dtype=bool) & (self.maxspeed > high_speed_threshold)
+        self.camera = np.array(camera, dtype=bool)
+        self.obstacles = {flag: np.array(values, dtype=bool) for flag, values in obstacles.items()}
+        self.multi_lane = np.array(multi_lane, dtype=bool)
+        self.residential = np.array(residential, dtype=bool)
+        self.oneway = np.array(oneway, dtype=bool)
+        self.traffic_class = np.array(traffic_class, dtype=np.int8)
+
+        # The original edge loop assigns the weight of an edge to the keys 0 and 1 of its origin-destination
+        # pair, so parallel edges all end up with the weight of the last edge of the pair.
+        group_last = {}
+        for index, (origin_num, destination_num, key) in enumerate(self.edge_keys):
+            group_last[(origin_num, destination_num)] = index
+        self.group_last = np.array([group_last[(origin_num, destination_num)]
+                                    for origin_num, destination_num, key in self.edge_keys], dtype=np.int64)
+
+        self.base_case = (self.length / self.maxspeed)[self.group_last]
+        self.edge_keys = np.array(self.edge_keys, dtype=np.int64).reshape(-1, 3)
+
+    def to_arrays(self):
+        """
+        Function that returns the compiled arrays, so they can be stored and passed back to the init method
+        @return: dictionary with the name and array of every compiled attribute
+        """
+        arrays = {name: getattr(self, name) for name in array_names}
+        for flag in obstacle_flags:
+            arrays["obstacle_" + flag] = self.obstacles[flag]
+        return arrays
+
+    def set_speeds(self, speeds):
+        """
+        Function that sets the travel speed of the edges, for example observed traffic speeds, and calculates the
+        base case weights again. Edges without a valid speed keep their maximum speed. The high speed preference
+        stays based on the maximum speed, as it describes the road and not the traffic.
+        @param speeds: array with the speed of every edge, nan where the maximum speed is used
+        """
+        speeds = np.asarray(speeds, dtype=np.float64)
+        self.speed = np.where(np.isfinite(speeds) & (speeds > 0), speeds, self.maxspeed)
+        self.base_case = (self.length / self.speed)[self.group_last]
+
+        # the weights of the previous scenario were calculated with the old speeds
+        self.used_weight = None
+        self.used_factors = None
+
+    def compute_weights(self, CA=1, OA=1, LP=1, RP=1, OW=1, HS=1, TA=1, TA1=2, TA2=1.7, TA3=1.3, edges=None):
+        """
+        Function that calculates the weights of all the edges based on the scenario variables.
+        The multiplications are done in the same order as the original edge loop so the results are identical.
+        @param CA: Multiplication factor for camera avoidance
+        @param OA: Multiplication factor for obstacle avoidance
+        @param LP: Multiplication factor for lane preference
+        @param RP: Multiplication factor for residential preference
+        @param OW: Multiplication factor for wrong way preference
+        @param HS: Multiplication factor for high speed preference
+        @param TA: Multiplication factor for traffic avoidance
+        @param TA1: Multiplication factor for traffic avoidance
+        @param TA2: Multiplication factor for traffic avoidance
+        @param TA3: Multiplication factor for traffic avoidance
+        @param edges: optional array with the indexes of the edges to calculate
+        @return: array with the weight of every edge, or of the given edges
+        """
+        # an edge gets the weight of the last edge of its origin-destination pair
+        index = slice(None) if edges is None else self.group_last[edges]
+
+        weights = self.length[index] / self.speed[index]
+        weights *= np.where(self.high_speed[index], HS, 1.0)
+
+        # cameras
+        weights *= np.where(self.camera[index], CA, 1.0)
+
+        # obstacle avoidance
+        for flag in obstacle_flags:
+            weights *= np.where(self.obstacles[flag][index], OA, 1.0)
+
+        # Lane preference
+        weights *= np.where(self.multi_lane[index], LP, 1.0)
+
+        # residential preference
+        weights *= np.where(self.residential[index], RP, 1.0)
+
+        # One way
+        weights *= np.where(self.oneway[index], OW, 1.0)
+
+        # Traffic avoidance
+        if TA > 1:
+            traffic_class = self.traffic_class[index]
+            for class_num, factor in zip(traffic_classes, [TA1, TA2, TA3]):
+                in_class = traffic_class == class_num
+                weights *= np.where(in_class, TA, 1.0)
+                weights *= np.where(in_class, factor, 1.0)
+
+        if edges is None:
+            return weights[self.group_last]
+        return weights
+
+    def compute_weight_matrix(self, factor_rows):
+        """
+        Function that calculates the weights of all the edges for many scenarios in one vectorised pass.
+        Every factor is applied to all scenarios at once, in the same order as compute_weights, so every row
+        is identical to the result of compute_weights with the factors of that row.
+        @param factor_rows: array with a row of factors per scenario, in the order of factor_names
+        @return: array with a row with the weight of every edge per scenario
+        """
+        factor_rows = np.asarray(factor_rows, dtype=np.float64).reshape(-1, len(factor_names))
+        CA, OA, LP, RP, OW, HS, TA, TA1, TA2, TA3 = np.hsplit(factor_rows, len(factor_names))
+
+        weights = np.tile(self.length / self.speed, (len(factor_rows), 1))
+        weights *= np.where(self.high_speed, HS, 1.0)
+
+        # cameras
+        weights *= np.where(self.camera, CA, 1.0)
+
+        # obstacle avoidance
+        for flag in obstacle_flags:
+            weights *= np.where(self.obstacles[flag], OA, 1.0)
+
+        # Lane preference
+        weights *= np.where(self.multi_lane, LP, 1.0)
+
+        # residential preference
+        weights *= np.where(self.residential, RP, 1.0)
+
+        # One way
+        weights *= np.where(self.oneway, OW, 1.0)
+
+        # Traffic avoidance, multiplying by 1 for the scenarios without it leaves their weights unchanged
+        traffic = TA > 1
+        for class_num, factor in zip(traffic_classes, [TA1, TA2, TA3]):
+            in_class = (self.traffic_class == class_num) & traffic
+            weights *= np.where(in_class, TA, 1.0)
+            weights *= np.where(in_class, factor, 1.0)
+
+        return weights[:, self.group_last]
+
+    def changed_edges(self, previous_factors, factors):
+        """
+        Function that determines the edges of which the weight depends on a scenario factor that changed
+        @param previous_factors: dictionary with the previous scenario factors
+        @param factors: dictionary with the new scenario factors
+        @return: sorted array with the indexes of the edges that can have a different weight
+        """
+        changed = {name for name in factor_names if previous_factors[name] != factors[name]}
+        affected = np.zeros(self.num_of_edges, dtype=bool)
+
+        for name, mask in [("HS", self.high_speed), ("CA", self.camera), ("LP", self.multi_lane),
+                           ("RP", self.residential), ("OW", self.oneway)]:
+            if name in changed:
+                affected |= mask
+        if "OA" in changed:
+            for flag in obstacle_flags:
+                affected |= self.obstacles[flag]
+
+        # the traffic factors are only used when TA is larger than 1
+        previous_traffic = previous_factors["TA"] > 1
+        traffic = factors["TA"] > 1
+        if previous_traffic != traffic or (traffic and "TA" in changed):
+            affected |= self.traffic_class > 0
+        elif traffic:
+            for class_num, name in zip(traffic_classes, ["TA1", "TA2", "TA3"]):
+                if name in changed:
+                    affected |= self.traffic_class == class_num
+
+        return np.flatnonzero(affected[self.group_last])
+
+    def update_weights(self, CA=1, OA=1, LP=1, RP=1, OW=1, HS=1, TA=1, TA1=2, TA2=1.7, TA3=1.3, weights=None):
+        """
+        Function that sets used_weight to the weights of a scenario. When only some factors changed since the
+        previous scenario, only the edges that depend on these factors are calculated again.
+        @param CA: Multiplication factor for camera avoidance
+        @param OA: Multiplication factor for obstacle avoidance
+        @param LP: Multiplication factor for lane preference
+        @param RP: Multiplication factor for residential preference
+        @param OW: Multiplication factor for wrong way preference
+        @param HS: Multiplication factor for high speed preference
+        @param TA: Multiplication factor for traffic avoidance
+        @param TA1: Multiplication factor for traffic avoidance
+        @param TA2: Multiplication factor for traffic avoidance
+        @param TA3: Multiplication factor for traffic avoidance
+        @param weights: optional weights of the scenario that were calculated before, for example cached
+        @return: the weights and the sorted array with the indexes of the edges that changed since the previous
+        scenario, None if there was no previous scenario
+        """
+        factors = dict(zip(factor_names, [CA, OA, LP, RP, OW, HS, TA, TA1, TA2, TA3]))
+
+        changed = None
+        if self.used_factors is not None:
+            changed = self.changed_edges(self.used_factors, factors)
+
+        if weights is None:
+            if changed is None or len(changed) > self.num_of_edges * incremental_update_share:
+                weights = self.compute_weights(**factors)
+            else:
+                weights = self.used_weight.copy()
+                weights[changed] = self.compute_weights(**factors, edges=changed)
+
+        self.used_weight = weights
+        self.used_factors = factors
+        return weights, changed
+
+    def write_attribute(self, name, values, edges=None):
+        """
+        Function that writes an array of edge values back to the graph as edge attribute
+        @param name: name of the edge attribute
+        @param values: array with a value for every edge
+        @param edges: optional array with the indexes of the only edges to write
+        """
+        if self.graph is None:
+            attribute = self.attributes.get(name)
+            if edges is None or attribute is None:
+                self.attributes[name] = np.array(values, dtype=np.float64)
+                return
+            # memory mapped attributes are read only, they are copied the first time they change
+            if not attribute.flags.writeable:
+                attribute = self.attributes[name] = np.array(attribute, dtype=np.float64)
+            attribute[edges] = values[edges]
+            return
+
+        if edges is None:
+            for data, value in zip(self.edge_data, values.tolist()):
+                data[name] = value
+            return
+
+        edge_data = self.edge_data
+        for index, value in zip(edges.tolist(), values[edges].tolist()):
+            edge_data[index][name] = value
+
+    def read_attribute(self, name):
+        """
+        Function that reads an edge attribute of the graph into an array
+        @param name: name of the edge attribute
+        @return: array with the value of every edge
+        """
+        if self.graph is None:
+            return np.array(self.attributes[name], dtype=np.float64)
+        return np.array([data[name] for data in self.edge_data], dtype=np.float64)
+
+
+class weight_cache:
+    """
+            Class that keeps the most recently used weight vectors, keyed by the graph variant and the full
+            tuple of scenario factors. The cache is bounded by the total size of the stored arrays, the least
+            recently used vectors are removed first.
+
+            Attributes
+            ----------
+            max_bytes: int
+                maximum total size of the stored arrays
+            num_of_bytes: int
+                total size of the stored arrays
+            hits: int
+                number of lookups that found a vector
+            misses: int
+                number of lookups that did not find a vector
+    """
+
+    def __init__(self, max_bytes):
+        """
+            Init method that creates an empty cache.
+            @param max_bytes: maximum total size of the stored arrays, 0 disables the cache
+        """
+        self.max_bytes = max_bytes
+        self.num_of_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.vectors = OrderedDict()
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def __contains__(self, key):
+        return key in self.vectors
+
+    def get(self, key):
+        """
+        Function that returns the vector of a key and marks it as most recently used
+        @param key: graph variant and scenario factors
+        @return: the read only weight vector, or None if the key is not cached
+        """
+        vector = self.vectors.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.vectors.move_to_end(key)
+        return vector
+
+    def put(self, key, vector):
+        """
+        Function that stores the vector of a key, removing the least recently used vectors when the cache is full
+        @param key: graph variant and scenario factors
+        @param vector: the weight vector, which is made read only
+        """
+        if vector.nbytes > self.max_bytes:
+            return
+
+        if key in self.vectors:
+            self.num_of_bytes -= self.vectors.pop(key).nbytes
+
+        vector.flags.writeable = False
+        self.vectors[key] = vector
+        self.num_of_bytes += vector.nbytes
+
+        while self.num_of_bytes > self.max_bytes:
+            key, removed = self.vectors.popitem(last=False)
+            self.num_of_bytes -= removed.nbytes
+
+    def statistics(self):
+        """
+        Function that returns the counters of the cache
+        @return: dictionary with the hits, misses, number of vectors and size in bytes
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "num_of_vectors": len(self.vectors),
+            "num_of_bytes": self.num_of_bytes
+        }
+
+
+def undirected_weight_engine(graph, edge_attributes):
+    """
+    Function that builds the undirected variant of a directed graph with its weight engine, without the deep copies
+    of graph.to_undirected(). The edges are added in the same order as to_undirected, so the two directions of a
+    road are merged into one edge with the attributes of both, the later direction overriding the earlier one.
+    The engine arrays are calculated from these merged attributes, after which the edges of the undirected graph
+    only keep the given attributes and the attribute values are shared with the directed graph.
+    @param graph: the directed graph
+    @param edge_attributes: names of the edge attributes that are kept in the undirected graph
+    @return: the weight engine of the undirected graph, the graph is available as weight_engine.graph
+    """
+    undirected = graph.to_undirected_class()(**graph.graph)
+    undirected.add_nodes_from((node, {"x": data["x"], "y": data["y"]}) for node, data in graph.nodes(data=True))
+
+    # adding an edge that already exists updates its attribute dictionary, the same as in to_undirected
+    undirected.add_edges_from((origin_num, destination_num, key, data)
+                              for origin_num, neighbours in graph._adj.items()
+                              for destination_num, key_data in neighbours.items()
+                              for key, data in key_data.items())
+
+    weight_engine = edge_weight_engine(undirected)
+    for data in weight_engine.edge_data:
+        kept = {attribute: data[attribute] for attribute in edge_attributes if attribute in data}
+        data.clear()
+        data.update(kept)
+    return weight_engine
@@ -0,0 +1,91 @@
+import route_model
+from graph_cache import default_cache_dir
+
+# route model of this process per settings, loaded at the first experiment
+worker_models = {}
+
+
+def get_route_model(settings):
+    """
+    Function that returns the route model of this process for the given settings, loading it the first time
+    @param settings: dictionary with the init arguments of the route model
+    @return: the route model
+    """
+    key = tuple(sorted(settings.items()))
+    if key not in worker_models:
+        worker_models[key] = route_model.route_model(**settings)
+    return worker_models[key]
+
+
+class shared_route_model:
+    """
+            Class that runs the route model in the worker processes of the EMA workbench.
+            Only the settings are pickled to the workers instead of a loaded route model with its graphs.
+            Every worker loads its route model once, from the graph snapshot and compiled graphs in the cache
+            folder. Their arrays are memory mapped, so the processes of a host share one copy in the page cache.
+            With the compiled routing backend the workers route on these arrays only and build no networkx graph,
+            with the default osmnx backend every worker builds the graph of the snapshot.
+
+            Attributes
+            ----------
+            settings: dict
+                init arguments of the route model
+    """
+
+    def __init__(self, graph_file_path=route_model.default_graph_file_path,
+                 routing_backend=route_model.default_routing_backend, shortest_path_trees=False, goal_directed=False,
+                 contract_chains=False, cache_dir=default_cache_dir,
+                 neighbourhood_map_file_path=route_model.default_neighbourhood_map_file_path, profile=False,
+                 speed_profile_file_path=None, speed_time_slot=None):
+        """
+            Init method that stores the settings of the route model.
+            @param graph_file_path: file path for loading graph
+            @param routing_backend: backend used for the k shortest paths, "osmnx" or "compiled"
+            @param shortest_path_trees: Boolean indicating if the compiled backend routes with shortest path trees
+            @param goal_directed: Boolean indicating if the compiled backend searches the paths with A*
+            @param contract_chains: Boolean indicating if the compiled backend routes on contracted graphs
+            @param cache_dir: folder for the graph snapshot and compiled graphs
+            @param neighbourhood_map_file_path: file path of the GeoJSON neighbourhood map the points are drawn in
+            @param profile: Boolean indicating if the phases are timed and counted, the results are added to the
+            outcomes of every experiment
+            @param speed_profile_file_path: file path of the observed speed profiles, None uses the maximum speeds
+            @param speed_time_slot: hour of the day of the observed speeds, None uses the mean over the whole day
+        """
+        if cache_dir is None:
+            raise ValueError("The shared route model needs a cache folder for the graph snapshot")
+
+        self.settings = {
+            "graph_file_path": graph_file_path,
+            "routing_backend": routing_backend,
+            "shortest_path_trees": shortest_path_trees,
+            "goal_directed": goal_directed,
+            "contract_chains": contract_chains,
+            "cache_dir": cache_dir,
+            "neighbourhood_map_file_path": neighbourhood_map_file_path,
+            "profile": profile,
+            "speed_profile_file_path": speed_profile_file_path,
+            "speed_time_slot": speed_time_slot
+        }
+
+    def prepare(self):
+        """
+        Function that writes the graph snapshot and compiled graphs to the cache folder once,
+        before the worker processes start, so the workers do not all parse the graph file
+        """
+        route_model.route_model(**self.settings)
+
+    def __call__(self, **kwargs):
+        """
+        Function that runs a model scenario with the route model of this process
+        @param kwargs: the scenario arguments of route_model.run_model
+        @return: Statistical values of run
+        """
+        return get_route_model(self.settings).run_model(**kwargs)
+
+    def run_models(self, scenarios):
+        """
+        Function that runs a batch of model scenarios with the route model of this process
+        @param scenarios: list of dictionaries with the scenario arguments of route_model.run_model
+        @return: list with the statistical values of every scenario
+        """
+        return get_route_model(self.settings).run_models(scenarios)
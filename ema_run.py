@@ -1,4 +1,4 @@
-import route_model
+import ema_model
 from ema_workbench import Model, RealParameter, ScalarOutcome, BooleanParameter
 from ema_workbench import MultiprocessingEvaluator, ema_logging
 
@@ -13,9 +13,14 @@ After the model is run, the output statistics are saved into a file.
 """
 if __name__ == "__main__":
 
-    route_model_instance = route_model.route_model()
+    # time and count the phases of every experiment, the results are stored as extra outcomes
+    profile = False
 
-    model = Model('routemodel', function=route_model_instance.run_model)
+    # the workers load the memory mapped graph snapshot instead of receiving a pickled route model
+    shared_model = ema_model.shared_route_model(profile=profile)
+    shared_model.prepare()
+
+    model = Model('routemodel', function=shared_model)
 
     # specify uncertainties
     model.uncertainties = [
@@ -25,7 +30,7 @@ if __name__ == "__main__":
     ]
 
     # specify outcomes
-    model.outcomes = [
+    outcomes = [
         ScalarOutcome("num_of_nodes"),
         ScalarOutcome("num_of_edges"),
         ScalarOutcome("continuity_mean"),
@@ -37,6 +42,15 @@ if __name__ == "__main__":
         ScalarOutcome('betweenness_centrality_mean'),
         ScalarOutcome('betweenness_centrality_var')
     ]
+    if profile:
+        # the Dijkstra expansions are only counted by the compiled routing backend
+        prefixes = ["time"]
+        if shared_model.settings["routing_backend"] == "compiled":
+            prefixes.append("expansions")
+        outcomes.extend(ScalarOutcome(f"{prefix}_{name}") for prefix in prefixes
+                        for name in ema_model.route_model.profile_phases)
+        outcomes.extend(ScalarOutcome(f"count_{name}") for name in ema_model.route_model.profile_counters)
+    model.outcomes = outcomes
 
     ema_logging.log_to_stderr(ema_logging.INFO)
 
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import networkx as nx
+import numpy as np
+
+from compiled_graph import compiled_graph
+from edge_weights import edge_weight_engine, array_names, obstacle_flags
+
+default_cache_dir = "cache"
+
+# increase when the layout of the graph snapshot changes, older snapshots are then rebuilt
+snapshot_version = 2
+
+# edge attributes that are kept in the graphs of a snapshot, which are only used by the weight engines for routing
+snapshot_edge_attributes = ["length", "base_case"]
+
+
+def file_hash(file_path):
+    """
+    Function that calculates the content hash of a file
+    @param file_path: path of the file
+    @return: sha256 hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(*parts):
+    """
+    Function that combines the parts that identify a cached result into a single key
+    @param parts: values that identify the result
+    @return: sha256 hex digest of the parts
+    """
+    return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def atomic_save(file_path, save_function):
+    """
+    Function that writes a file through a temporary file in the same folder, so parallel workers
+    never read a half written file
+    @param file_path: path of the final file
+    @param save_function: function that writes to the given file object
+    """
+    folder = os.path.dirname(file_path) or "."
+    os.makedirs(folder, exist_ok=True)
+    handle, temporary_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            save_function(file)
+        os.replace(temporary_path, file_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def path_costs_file_path(cache_dir, key):
+    """
+    Function that returns the path of the base case path costs cache file of a key
+    @param cache_dir: folder of the cache files
+    @param key: cache key of the result
+    @return: path of the cache file
+    """
+    return os.path.join(cache_dir, "path_costs_base_case_" + key + ".npz")
+
+
+def save_path_costs(file_path, points, path_costs):
+    """
+    Function that saves the generated points and their base case path costs
+    @param file_path: path of the cache file
+    @param points: list with the origin and destination nodes
+    @param path_costs: dictionary with the path cost of every (origin, destination) pair
+    """
+    pairs = list(path_costs.keys())
+    atomic_save(file_path, lambda file: np.savez_compressed(
+        file,
+        points=np.array(points, dtype=np.int64),
+        origins=np.array([origin for origin, destination in pairs], dtype=np.int64),
+        destinations=np.array([destination for origin, destination in pairs], dtype=np.int64),
+        costs=np.array([path_costs[pair] for pair in pairs], dtype=np.float64)))
+
+
+def load_path_costs(file_path):
+    """
+    Function that loads the generated points and their base case path costs
+    @param file_path: path of the cache file
+    @return: list with the origin and destination nodes and dictionary with the path cost of every pair,
+    or None if the file does not exist
+    """
+    if not os.path.exists(file_path):
+        return None
+
+    with np.load(file_path) as data:
+        points = data["points"].tolist()
+        path_costs = dict(zip(zip(data["origins"].tolist(), data["destinations"].tolist()),
+                              data["costs"].tolist()))
+    return points, path_costs
+
+
+def graph_snapshot_path(cache_dir, graph_file_hash):
+    """
+    Function that returns the folder of the snapshot of a graph file
+    @param cache_dir: folder of the cache files
+    @param graph_file_hash: content hash of the graph file
+    @return: path of the snapshot folder
+    """
+    return os.path.join(cache_dir, "graph_snapshot_" + graph_file_hash)
+
+
+def save_array_folder(folder, arrays, metadata):
+    """
+    Function that saves arrays as a folder of .npy files, which can be memory mapped, and a metadata.json sidecar.
+    The folder is written under a temporary name and renamed, so parallel workers never read a half written folder.
+    @param folder: path of the folder
+    @param arrays: dictionary with the name and array of every array
+    @param metadata: dictionary with the metadata, including the version and graph_file_hash
+    """
+    parent = os.path.dirname(folder) or "."
+    os.makedirs(parent, exist_ok=True)
+    temporary_folder = tempfile.mkdtemp(dir=parent, suffix=".tmp")
+
+    try:
+        for name, values in arrays.items():
+            np.save(os.path.join(temporary_folder, name + ".npy"), values)
+        with open(os.path.join(temporary_folder, "metadata.json"), "w") as file:
+            json.dump(metadata, file, default=str)
+
+        # a folder of an older snapshot version is removed, os.replace can not replace a folder with files
+        if os.path.isdir(folder) and load_array_folder(folder, metadata["graph_file_hash"]) is None:
+            shutil.rmtree(folder, ignore_errors=True)
+        os.replace(temporary_folder, folder)
+    except OSError:
+        shutil.rmtree(temporary_folder, ignore_errors=True)
+        # another process wrote the same folder first
+        if not os.path.isdir(folder):
+            raise
+
+
+def load_array_folder(folder, graph_file_hash):
+    """
+    Function that memory maps the arrays of a folder written by save_array_folder
+    @param folder: path of the folder
+    @param graph_file_hash: content hash of the graph file
+    @return: the metadata and a dictionary with the name and memory mapped array of every array,
+    or None if there is no valid folder
+    """
+    metadata_path = os.path.join(folder, "metadata.json")
+    if not os.path.exists(metadata_path):
+        return None
+
+    with open(metadata_path) as file:
+        metadata = json.load(file)
+    if metadata["version"] != snapshot_version or metadata["graph_file_hash"] != graph_file_hash:
+        return None
+
+    arrays = {file_name[:-len(".npy")]: np.load(os.path.join(folder, file_name), mmap_mode="r")
+              for file_name in os.listdir(folder) if file_name.endswith(".npy")}
+    return metadata, arrays
+
+
+def save_graph_snapshot(folder, graph_file_hash, weight_engines):
+    """
+    Function that saves the graphs and their compiled edge attributes as a folder of .npy files,
+    which can be memory mapped, and a metadata.json sidecar.
+    The snapshot keeps the node coordinates and the edge attributes the model uses, not the full OSM data.
+    @param folder: path of the snapshot folder
+    @param graph_file_hash: content hash of the graph file
+    @param weight_engines: dictionary with the weight engine of every graph variant
+    """
+    graph = weight_engines["OW_False"].graph
+    node_ids = list(graph.nodes())
+    arrays = {
+        "nodes": np.array(node_ids, dtype=np.int64),
+        "x": np.array([graph.nodes[node]["x"] for node in node_ids], dtype=np.float64),
+        "y": np.array([graph.nodes[node]["y"] for node in node_ids], dtype=np.float64)
+    }
+    for variant, weight_engine in weight_engines.items():
+        arrays[variant + "_edges"] = np.array(weight_engine.edge_keys, dtype=np.int64).reshape(-1, 3)
+        for name, values in weight_engine.to_arrays().items():
+            arrays[variant + "_" + name] = values
+        for attribute in snapshot_edge_attributes:
+            arrays[variant + "_attribute_" + attribute] = weight_engine.read_attribute(attribute)
+
+    save_array_folder(folder, arrays, {
+        "version": snapshot_version,
+        "graph_file_hash": graph_file_hash,
+        "graph_attributes": graph.graph,
+        "variants": list(weight_engines.keys())
+    })
+
+
+def load_graph_snapshot(folder, graph_file_hash, variants=None, build_graphs=True):
+    """
+    Function that loads the graphs and weight engines of a snapshot
+    @param folder: path of the snapshot folder
+    @param graph_file_hash: content hash of the graph file
+    @param variants: optional list with the graph variants to load, by default all variants are loaded
+    @param build_graphs: Boolean indicating if the graphs are built, without them the weight engines only hold
+    the memory mapped arrays, which is enough for the compiled routing backend
+    @return: dictionary with the weight engine of every graph variant, the graphs that are built are available as
+    weight_engine.graph, or None if there is no valid snapshot
+    """
+    snapshot = load_array_folder(folder, graph_file_hash)
+    if snapshot is None:
+        return None
+    metadata, arrays = snapshot
+
+    nodes = list(zip(arrays["nodes"].tolist(), arrays["x"].tolist(), arrays["y"].tolist())) if build_graphs else []
+    engine_array_names = array_names + ["obstacle_" + flag for flag in obstacle_flags]
+
+    weight_engines = {}
+    for variant in metadata["variants"]:
+        if variants is not None and variant not in variants:
+            continue
+        engine_arrays = {name: arrays[variant + "_" + name] for name in engine_array_names}
+        if not build_graphs:
+            attributes = {attribute: arrays[variant + "_attribute_" + attribute]
+                          for attribute in snapshot_edge_attributes}
+            weight_engines[variant] = edge_weight_engine(None, arrays[variant + "_edges"], engine_arrays, attributes)
+            continue
+
+        if variant == "OW_False":
+            graph = nx.MultiDiGraph(**metadata["graph_attributes"])
+        else:
+            graph = nx.MultiGraph(**metadata["graph_attributes"])
+        graph.add_nodes_from((node, {"x": x, "y": y}) for node, x, y in nodes)
+
+        edge_keys = [tuple(edge) for edge in arrays[variant + "_edges"].tolist()]
+        attributes = {attribute: arrays[variant + "_attribute_" + attribute].tolist()
+                      for attribute in snapshot_edge_attributes}
+        graph.add_edges_from((origin_num, destination_num, key,
+                              {attribute: attributes[attribute][index] for attribute in snapshot_edge_attributes})
+                             for index, (origin_num, destination_num, key) in enumerate(edge_keys))
+
+        weight_engines[variant] = edge_weight_engine(graph, edge_keys, engine_arrays)
+    return weight_engines
+
+
+def compiled_snapshot_path(cache_dir, graph_file_hash, variant):
+    """
+    Function that returns the folder of the compiled graph of a graph variant
+    @param cache_dir: folder of the cache files
+    @param graph_file_hash: content hash of the graph file
+    @param variant: graph variant, "OW_False" or "OW_True"
+    @return: path of the compiled graph folder
+    """
+    return os.path.join(cache_dir, "compiled_graph_" + graph_file_hash + "_" + variant)
+
+
+def save_compiled_graph(folder, graph_file_hash, graph):
+    """
+    Function that saves the CSR arrays of a compiled graph, so other processes can memory map them
+    instead of compiling the graph again
+    @param folder: path of the compiled graph folder
+    @param graph_file_hash: content hash of the graph file
+    @param graph: the compiled graph
+    """
+    save_array_folder(folder, graph.to_arrays(), {
+        "version": snapshot_version,
+        "graph_file_hash": graph_file_hash
+    })
+
+
+def load_compiled_graph(folder, graph_file_hash):
+    """
+    Function that loads a compiled graph from memory mapped CSR arrays
+    @param folder: path of the compiled graph folder
+    @param graph_file_hash: content hash of the graph file
+    @return: the compiled graph, or None if there is no valid folder
+    """
+    snapshot = load_array_folder(folder, graph_file_hash)
+    if snapshot is None:
+        return None
+    metadata, arrays = snapshot
+    return compiled_graph(arrays=arrays)
@@ -0,0 +1,243 @@
+import math
+from itertools import islice
+
+import networkx as nx
+import numpy as np
+
+from compiled_graph import compiled_graph
+
+
+class contracted_graph(compiled_graph):
+    """
+            Class that contains a compiled graph of which the chains of degree-2 nodes are contracted into single
+            arcs. A node is contracted if it is not protected and it only connects two other nodes, either as part
+            of a one way road from one to the other or of a road in both directions. The weight of a contracted arc
+            is the sum of the weights of the arcs of its chain, which are taken from the full compiled graph every
+            time its weights change, so calculate_weights and the weight engine work unchanged.
+
+            A node in a chain can only be passed from one end of the chain to the other, so every loopless path
+            between two remaining nodes of the full graph is a path of the contracted graph and Yen's algorithm finds
+            paths with the same costs. Parallel chains between the same two nodes and chains that return to their
+            first node keep their first node, so every pair of nodes has at most one arc.
+
+            Between paths of equal cost the contracted graph can choose another path than the full graph: the
+            searches settle other nodes in another order, and the weight of a chain is summed before it is added to
+            a path length, which can round differently. The routes and their statistics, such as continuity and
+            connectivity, are then only the same when the paths between the points have no equal costs.
+
+            Attributes
+            ----------
+            graph: object
+                the full compiled graph
+            protected_nodes: frozenset
+                node ids that are never contracted, the origin and destination points
+            chain_arcs: array[int]
+                arc indexes of the full graph of the chains of all arcs, in the order of the arcs
+            chain_starts: array[int]
+                start of the chain of every arc in chain_arcs
+            interior_node_ids: list[list]
+                node ids of the contracted nodes of every arc, in the order they are passed
+            synced_versions: dict
+                version of the weights of the full graph that is set per weight name
+    """
+
+    def __init__(self, graph, protected_nodes=()):
+        """
+            Init method that contracts the chains of the full compiled graph.
+            @param graph: the full compiled graph
+            @param protected_nodes: node ids that are never contracted
+        """
+        self.graph = graph
+        self.protected_nodes = frozenset(protected_nodes)
+
+        offsets = graph._offsets
+        targets = graph._targets
+        reverse_offsets = graph._reverse_offsets
+        reverse_sources = graph._reverse_sources
+
+        contractible = [False] * graph.num_of_nodes
+        for node in range(graph.num_of_nodes):
+            if graph.node_ids[node] in self.protected_nodes:
+                continue
+            out_neighbours = targets[offsets[node]:offsets[node + 1]]
+            in_neighbours = reverse_sources[reverse_offsets[node]:reverse_offsets[node + 1]]
+            if node in out_neighbours or node in in_neighbours:
+                continue
+            one_way = len(in_neighbours) == 1 and len(out_neighbours) == 1 and in_neighbours != out_neighbours
+            two_way = len(out_neighbours) == 2 and sorted(in_neighbours) == sorted(out_neighbours)
+            contractible[node] = one_way or two_way
+
+        # the first node of a parallel or returning chain is kept, until every pair of nodes has one chain
+        while True:
+            chains = self.find_chains(contractible)
+            kept_nodes = set()
+            pairs = {}
+            for chain in chains:
+                origin, destination, arcs, interior = chain
+                pairs.setdefault((origin, destination), []).append(chain)
+            for (origin, destination), pair_chains in pairs.items():
+                # a direct arc is kept as it is, it can not be split
+                pair_chains = sorted(pair_chains, key=lambda chain: len(chain[3]))
+                if origin != destination:
+                    pair_chains = pair_chains[1:]
+                kept_nodes.update(interior[0] for origin, destination, arcs, interior in pair_chains if interior)
+            if not kept_nodes:
+                break
+            for node in kept_nodes:
+                contractible[node] = False
+
+        nodes = [node for node in range(graph.num_of_nodes) if not contractible[node]]
+        node_index = {node: index for index, node in enumerate(nodes)}
+
+        origins = np.array([node_index[chain[0]] for chain in chains], dtype=np.int64)
+        destinations = np.array([node_index[chain[1]] for chain in chains], dtype=np.int64)
+        order = np.lexsort((destinations, origins))
+        origins, destinations = origins[order], destinations[order]
+        chains = [chains[index] for index in order.tolist()]
+
+        num_of_nodes = len(nodes)
+        num_of_arcs = len(chains)
+        node_array = np.array(nodes, dtype=np.int64)
+        arrays = {
+            "node_id_array": graph.node_id_array[node_array],
+            "node_x": graph.node_x[node_array],
+            "node_y": graph.node_y[node_array],
+            # every contracted arc is its own edge, the weights are set from the chains and not from edges
+            "arc_starts": np.arange(num_of_arcs, dtype=np.int64),
+            "arc_edges": np.arange(num_of_arcs, dtype=np.int64),
+            "arc_origins": origins,
+            "targets": destinations,
+            "offsets": np.zeros(num_of_nodes + 1, dtype=np.int64),
+            "reverse_arcs": np.argsort(destinations, kind="stable"),
+            "reverse_offsets": np.zeros(num_of_nodes + 1, dtype=np.int64)
+        }
+        np.cumsum(np.bincount(origins, minlength=num_of_nodes), out=arrays["offsets"][1:])
+        np.cumsum(np.bincount(destinations, minlength=num_of_nodes), out=arrays["reverse_offsets"][1:])
+        super().__init__(arrays=arrays)
+
+        chain_lengths = [len(chain[2]) for chain in chains]
+        self.chain_arcs = np.array([arc for chain in chains for arc in chain[2]], dtype=np.int64)
+        self.chain_starts = np.zeros(num_of_arcs, dtype=np.int64)
+        np.cumsum(chain_lengths[:-1], out=self.chain_starts[1:])
+        self.interior_node_ids = [[graph.node_ids[node] for node in chain[3]] for chain in chains]
+
+        # the arcs of the chains that pass a contracted node, with the position of the node in the chain
+        self.node_chains = {}
+        for arc, chain in enumerate(chains):
+            for position, node in enumerate(chain[3]):
+                self.node_chains.setdefault(graph.node_ids[node], []).append((arc, position))
+
+        self._chain_arcs = memoryview(self.chain_arcs)
+        self.synced_versions = {}
+
+    def find_chains(self, contractible):
+        """
+        Function that follows every arc of the full graph that leaves a node that is not contracted, through the
+        contracted nodes until the next node that is not contracted
+        @param contractible: list with a Boolean per node index of the full graph indicating if it is contracted
+        @return: list with the first node, last node, arc indexes and contracted node indexes of every chain
+        """
+        offsets = self.graph._offsets
+        targets = self.graph._targets
+
+        chains = []
+        for origin in range(self.graph.num_of_nodes):
+            if contractible[origin]:
+                continue
+            for arc in range(offsets[origin], offsets[origin + 1]):
+                arcs = [arc]
+                interior = []
+                previous, node = origin, targets[arc]
+                while contractible[node]:
+                    interior.append(node)
+                    # a contracted node has one arc that does not lead back
+                    arc = next(arc for arc in range(offsets[node], offsets[node + 1]) if targets[arc] != previous)
+                    arcs.append(arc)
+                    previous, node = node, targets[arc]
+                chains.append((origin, node, arcs, interior))
+        return chains
+
+    def sync_weights(self):
+        """
+        Function that sets the weights of the contracted arcs to the summed weights of their chains for every
+        weight of the full graph that changed. Only the arcs of which the sum changed are updated, so the cached
+        trees they can not change are kept.
+        """
+        for weight, arc_values in self.graph.weights.items():
+            version = self.graph.weight_versions[weight]
+            if self.synced_versions.get(weight) == version:
+                continue
+
+            values = np.add.reduceat(arc_values[self.chain_arcs], self.chain_starts)
+            if weight in self.weights:
+                self.update_arc_weights(weight, values, np.flatnonzero(values != self.weights[weight]))
+            else:
+                self.set_arc_weights(weight, values)
+            self.synced_versions[weight] = version
+
+    def expand_path(self, path):
+        """
+        Function that expands a path of node indexes of the contracted graph to the node ids of the full graph
+        @param path: list of node indexes
+        @return: list of node ids
+        """
+        nodes = [self.node_ids[path[0]]]
+        for origin, destination in zip(path, path[1:]):
+            nodes.extend(self.interior_node_ids[self.arc_between(origin, destination)])
+            nodes.append(self.node_ids[destination])
+        return nodes
+
+    def k_shortest_paths(self, orig, dest, k, weight="used_weight", use_trees=False, goal_directed=False):
+        """
+        Generator of the k shortest paths between two nodes that are not contracted, expanded to full node lists
+        @param orig: node id of the origin
+        @param dest: node id of the destination
+        @param k: number of shortest paths to solve
+        @param weight: name of the weight
+        @param use_trees: Boolean indicating if the cached shortest path trees are used
+        @param goal_directed: Boolean indicating if the searches are A* searches towards the destination
+        """
+        self.sync_weights()
+        paths = self.shortest_simple_paths(self.node_index[orig], self.node_index[dest], weight, use_trees,
+                                           goal_directed)
+        for path in islice(paths, 0, k):
+            yield self.expand_path(path)
+
+    def shortest_path_to(self, orig, dest, weight="used_weight"):
+        """
+        Function that returns the shortest path between two nodes from the cached reverse tree of the destination.
+        An origin in a chain first follows its chain to the end, in a road in both directions the end that gives
+        the shortest path. If both ends give the same length, the end of the first chain is taken, which need not
+        be the end the tree of the full graph passes.
+        @param orig: node id of the origin
+        @param dest: node id of the destination, which is not contracted
+        @param weight: name of the weight
+        @return: the path as list of node ids
+        """
+        self.sync_weights()
+        target = self.node_index[dest]
+        if orig in self.node_index:
+            length, path = self.reverse_tree_path(self.node_index[orig], target, weight)
+            return self.expand_path(path)
+
+        distances, parents = self.shortest_path_tree(target, weight, reverse=True)
+        arc_values = self.graph._weights[weight]
+        chain_arcs = self._chain_arcs
+
+        best = None
+        # a node on a cycle of contracted nodes without a remaining node is on no chain and has no path
+        for arc, position in self.node_chains.get(orig, ()):
+            start = self.chain_starts[arc] + position + 1
+            end = self.chain_starts[arc] + len(self.interior_node_ids[arc]) + 1
+            length = 0.0
+            for chain_arc in chain_arcs[start:end]:
+                length += arc_values[chain_arc]
+            length += distances[self._targets[arc]]
+            if length < math.inf and (best is None or length < best[0]):
+                best = (length, arc, position)
+
+        if best is None:
+            raise nx.NetworkXNoPath(f"No path between {orig} and {dest}.")
+        length, arc, position = best
+        length, path = self.reverse_tree_path(self._targets[arc], target, weight)
+        return self.interior_node_ids[arc][position:] + self.expand_path(path)
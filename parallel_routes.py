@@ -0,0 +1,282 @@
+import multiprocessing
+import weakref
+from multiprocessing import resource_tracker
+
+import numpy as np
+
+import route_model
+from compiled_graph import compiled_graph
+from shared_arrays import share_arrays, attach_arrays, release_blocks
+
+# state of a worker process, filled by init_worker
+worker_state = {}
+
+
+class worker_route_model(route_model.route_model):
+    """
+            Class that contains the route model of a worker process.
+            It routes on compiled graphs that are attached from shared memory instead of loading the graph file.
+
+            Attributes
+            ----------
+            compiled_graphs: dict
+                compiled graph of every graph variant
+            weight_versions: dict
+                version of the weights that is set on every compiled graph
+            profiler: object
+                timers and counters of the phases of the current source
+    """
+
+    def __init__(self, compiled_graphs):
+        """
+            Init method that sets the structure of the route model without loading the graphs and points.
+            @param compiled_graphs: compiled graph of every graph variant
+        """
+        self.init_routing_state(points=[], routing_backend="compiled")
+        self.compiled_graphs = compiled_graphs
+        self.weight_versions = {variant: None for variant in compiled_graphs}
+
+    def get_compiled_graph(self, variant):
+        return self.compiled_graphs[variant]
+
+    def count_expansions(self):
+        return sum(compiled.expansions for compiled in
+                   list(self.compiled_graphs.values()) + list(self.contracted_graphs.values()))
+
+
+def init_worker():
+    """
+    Function that sets the route model of a worker process, the compiled graphs are attached by the first task
+    that routes on them
+    """
+    worker_state["model"] = worker_route_model({})
+    worker_state["weights"] = {}
+    worker_state["blocks"] = []
+    worker_state["points_version"] = None
+    worker_state["point_blocks"] = []
+
+
+def attach_graph(variant, graph_descriptor, weight_descriptor):
+    """
+    Function that attaches a worker process to the shared compiled graph and weights of a graph variant
+    @param variant: graph variant, "OW_False" or "OW_True"
+    @param graph_descriptor: descriptor of the compiled graph arrays
+    @param weight_descriptor: descriptor of the shared weights
+    """
+    model = worker_state["model"]
+    arrays, graph_blocks = attach_arrays(graph_descriptor)
+    model.compiled_graphs[variant] = compiled_graph(arrays=arrays)
+    model.weight_versions[variant] = None
+    weight_arrays, weight_blocks = attach_arrays(weight_descriptor)
+    worker_state["weights"][variant] = weight_arrays["used_weight"]
+    worker_state["blocks"].extend(graph_blocks + weight_blocks)
+
+
+def attach_points(points_version, point_descriptor):
+    """
+    Function that attaches a worker process to the shared points and base case path costs of a seed, and closes
+    the blocks of the previous seed
+    @param points_version: number of the points
+    @param point_descriptor: descriptor of the shared points and path cost matrix
+    """
+    # the arrays on the blocks have to be released before the blocks can be closed
+    worker_state["path_costs"] = None
+    release_blocks(worker_state["point_blocks"])
+
+    arrays, blocks = attach_arrays(point_descriptor)
+    worker_state["points"] = arrays["points"].tolist()
+    worker_state["path_costs"] = arrays["path_costs"]
+    worker_state["point_blocks"] = blocks
+    worker_state["points_version"] = points_version
+
+
+def route_source(task):
+    """
+    Function that generates the routes and statistics of one source in a worker process
+    @param task: tuple with the index of the source in the points, the start and end graph variant, the descriptors
+    of their shared compiled graphs and weights, their weight versions, the points version, the descriptor of the shared
+    points and path costs, the number of paths, the shortest path trees setting, the goal directed setting, the chain
+    contraction setting, the rational setting, the strategy change percentage and the profile setting
+    @return: accumulators of the continuity, node frequency and connectivity values of the source and the
+    network of its routes, and the results of the profiler of the source or None if profiling is disabled
+    """
+    (source_index, start_variant, end_variant, graph_descriptors, weight_versions, points_version, point_descriptor,
+     num_of_paths, shortest_path_trees, goal_directed, contract_chains, rational, strategy_change_percentage,
+     profile) = task
+
+    if worker_state["points_version"] != points_version:
+        attach_points(points_version, point_descriptor)
+    points = worker_state["points"]
+    source = points[source_index]
+
+    model = worker_state["model"]
+    for variant in {start_variant, end_variant}:
+        if variant not in model.compiled_graphs:
+            attach_graph(variant, *graph_descriptors[variant])
+        if model.weight_versions[variant] != weight_versions[variant]:
+            compiled = model.compiled_graphs[variant]
+            arc_values = np.array(worker_state["weights"][variant])
+            # only the changed arcs are updated, so the cached trees they can not change are kept
+            if "used_weight" in compiled.weights:
+                compiled.update_arc_weights("used_weight", arc_values,
+                                            np.flatnonzero(arc_values != compiled.weights["used_weight"]))
+            else:
+                compiled.set_arc_weights("used_weight", arc_values)
+            model.weight_versions[variant] = weight_versions[variant]
+
+    model.points = points
+    # only the row of the source is read from the path cost matrix
+    model.path_costs_base_case = {(source, sink): cost for sink, cost in
+                                  zip(points, worker_state["path_costs"][source_index].tolist()) if sink != source}
+    model.num_of_paths = num_of_paths
+    model.shortest_path_trees = shortest_path_trees
+    model.goal_directed = goal_directed
+    model.contract_chains = contract_chains
+    model.start_variant = start_variant
+    model.end_variant = end_variant
+
+    model.profiler.enabled = profile
+    model.profiler.reset()
+
+    source_results = model.generate_source_routes(source, rational, strategy_change_percentage)
+    return source_results, model.profiler.results() if profile else None
+
+
+def close_pool(pool, shared_weights, blocks, point_blocks):
+    """
+    Function that stops the worker processes and removes the shared memory
+    @param pool: the process pool
+    @param shared_weights: dictionary with the shared weight arrays of the owning process
+    @param blocks: list of shared memory blocks of the graphs and weights of the owning process
+    @param point_blocks: list of shared memory blocks of the points of the owning process
+    """
+    pool.terminate()
+    pool.join()
+    # the arrays on the blocks have to be released before the blocks can be closed
+    shared_weights.clear()
+    release_blocks(blocks, unlink=True)
+    release_blocks(point_blocks, unlink=True)
+
+
+class parallel_route_network:
+    """
+            Class that generates the routes of the sources of a scenario in a pool of worker processes.
+            A compiled graph is copied into shared memory once, when the first scenario routes on its graph variant,
+            and the weights of every scenario are written to a shared array per graph variant. The points and the
+            matrix of their base case path costs are shared once per seed and a task only reads the row of its
+            source, so nothing large is pickled per task. The results are returned in the order of the sources, so
+            merging them gives the same lists as the serial loop.
+
+            Attributes
+            ----------
+            pool: object
+                the process pool
+            graph_descriptors: dict
+                descriptors of the shared compiled graph and weights of every shared graph variant
+            weight_versions: dict
+                version of the used_weight of the compiled graph that is in shared memory per graph variant
+            points: list
+                the points that are currently in shared memory
+            points_version: int
+                number of the points that are currently in shared memory
+    """
+
+    def __init__(self, n_processes):
+        """
+            Init method that starts the worker processes.
+            @param n_processes: number of worker processes
+        """
+        self.graph_descriptors = {}
+        self.shared_weights = {}
+        self.blocks = []
+
+        self.weight_versions = {}
+        self.points = None
+        self.points_version = 0
+        self.point_descriptor = None
+        self.point_blocks = []
+        # the graphs are shared after the workers start, the workers have to use the resource tracker of this
+        # process, a tracker of their own would remove the blocks they attached to when they stop
+        resource_tracker.ensure_running()
+        self.pool = multiprocessing.Pool(n_processes, initializer=init_worker)
+        self._finalizer = weakref.finalize(self, close_pool, self.pool, self.shared_weights, self.blocks,
+                                          self.point_blocks)
+
+    def share_graph(self, variant, graph):
+        """
+        Function that copies a compiled graph and a weight array of its arcs into shared memory, if its graph
+        variant is not shared yet
+        @param variant: graph variant, "OW_False" or "OW_True"
+        @param graph: the compiled graph
+        """
+        if variant in self.graph_descriptors:
+            return
+
+        graph_descriptor, shared, blocks = share_arrays(graph.to_arrays())
+        self.blocks.extend(blocks)
+
+        weight_descriptor, shared, blocks = share_arrays({"used_weight": np.zeros(graph.num_of_arcs)})
+        self.shared_weights[variant] = shared["used_weight"]
+        self.blocks.extend(blocks)
+        self.graph_descriptors[variant] = (graph_descriptor, weight_descriptor)
+
+    def share_points(self, points, path_costs_base_case):
+        """
+        Function that copies the points and the matrix of their base case path costs into shared memory, if the
+        points changed since the previous scenario. The blocks of the previous points are removed.
+        @param points: list with the origin and destination nodes
+        @param path_costs_base_case: dictionary with the path cost of every (origin, destination) pair
+        """
+        if points == self.points:
+            return
+
+        path_costs = np.full((len(points), len(points)), np.nan)
+        for row, source in enumerate(points):
+            for column, sink in enumerate(points):
+                if source != sink:
+                    path_costs[row, column] = path_costs_base_case[(source, sink)]
+
+        release_blocks(self.point_blocks, unlink=True)
+        self.point_blocks.clear()
+        self.point_descriptor, shared, blocks = share_arrays({"points": np.array(points, dtype=np.int64),
+                                                              "path_costs": path_costs})
+        self.point_blocks.extend(blocks)
+        self.points = list(points)
+        self.points_version += 1
+
+    def generate(self, model, start_variant, end_variant, rational, strategy_change_percentage):
+        """
+        Function that generates the routes of all sources of a model in the worker processes
+        @param model: the route model with the points, path costs and compiled graphs of the scenario
+        @param start_variant: graph variant of the starting strategy, "OW_False" or "OW_True"
+        @param end_variant: graph variant of the ending strategy, "OW_False" or "OW_True"
+        @param rational: Boolean indicating rational or bounded rational decision making
+        @param strategy_change_percentage: Float indicating at what time in the run, the strategy changes
+        @return: list with the accumulators of the continuity, node frequency and connectivity values and the
+        network of the routes of every source, paired with the results of the profiler of the source
+        """
+        variants = {start_variant, end_variant}
+        for variant in variants:
+            compiled = model.get_compiled_graph(variant)
+            self.share_graph(variant, compiled)
+            # the weights are only copied when they changed, the workers then keep their cached trees
+            version = compiled.weight_versions["used_weight"]
+            if self.weight_versions.get(variant) != version:
+                np.copyto(self.shared_weights[variant], compiled.weights["used_weight"])
+                self.weight_versions[variant] = version
+        graph_descriptors = {variant: self.graph_descriptors[variant] for variant in variants}
+        weight_versions = {variant: self.weight_versions[variant] for variant in variants}
+
+        self.share_points(model.points, model.path_costs_base_case)
+        tasks = [(source_index, start_variant, end_variant, graph_descriptors, weight_versions,
+                  self.points_version, self.point_descriptor, model.num_of_paths, model.shortest_path_trees,
+                  model.goal_directed, model.contract_chains, rational, strategy_change_percentage,
+                  model.profiler.enabled)
+                 for source_index in range(len(model.points))]
+        return self.pool.map(route_source, tasks, chunksize=1)
+
+    def close(self):
+        """
+        Function that stops the worker processes and removes the shared memory
+        """
+        self._finalizer()
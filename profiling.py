@@ -0,0 +1,121 @@
+import time
+from contextlib import nullcontext
+
+# context of a phase while profiling is disabled, shared so disabled phases do not allocate
+disabled_phase = nullcontext()
+
+
+class timed_phase:
+    """
+            Class that contains the context of a profiled phase, it adds the duration and the Dijkstra expansions
+            of the phase to the profiler when the phase ends.
+
+            Attributes
+            ----------
+            profiler: object
+                the phase profiler
+            name: str
+                name of the phase
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.expansions is not None:
+            self.expansions = self.profiler.expansions()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.timers[self.name] += time.perf_counter() - self.start
+        if self.profiler.expansions is not None:
+            self.profiler.expansion_counters[self.name] += self.profiler.expansions() - self.expansions
+        return False
+
+
+class phase_profiler:
+    """
+            Class that contains the timers and counters of the phases of a scenario.
+            It can be switched on and off at runtime, while it is disabled a phase is a shared empty context
+            and a count is a single check, so the instrumentation costs next to nothing.
+
+            Attributes
+            ----------
+            enabled: bool
+                Boolean indicating if the phases are timed and counted
+            timers: dict
+                summed monotonic duration in seconds per phase
+            counters: dict
+                count per counter name
+            expansion_counters: dict
+                number of nodes settled by Dijkstra searches per phase
+            expansions: function
+                function that returns the total number of nodes settled by the Dijkstra searches so far,
+                None if the routing backend does not count them
+    """
+
+    def __init__(self, phases, counters, enabled=False, expansions=None):
+        """
+            Init method that sets all timers and counters to zero.
+            @param phases: names of the timed phases
+            @param counters: names of the counters
+            @param enabled: Boolean indicating if the phases are timed and counted
+            @param expansions: function that returns the total number of settled nodes of the Dijkstra searches
+        """
+        self.phases = list(phases)
+        self.counter_names = list(counters)
+        self.enabled = enabled
+        self.expansions = expansions
+        self.reset()
+
+    def reset(self):
+        """
+        Function that sets all timers and counters to zero
+        """
+        self.timers = dict.fromkeys(self.phases, 0.0)
+        self.counters = dict.fromkeys(self.counter_names, 0)
+        self.expansion_counters = dict.fromkeys(self.phases, 0)
+
+    def phase(self, name):
+        """
+        Function that returns the context of a phase, which is timed if the profiler is enabled
+        @param name: name of the phase
+        @return: the context of the phase
+        """
+        if not self.enabled:
+            return disabled_phase
+        return timed_phase(self, name)
+
+    def count(self, name, value=1):
+        """
+        Function that adds a value to a counter if the profiler is enabled
+        @param name: name of the counter
+        @param value: value to add
+        """
+        if self.enabled:
+            self.counters[name] += value
+
+    def merge(self, results):
+        """
+        Function that adds the timers and counters of another profiler, for example of a worker process
+        @param results: the results of the other profiler, see results
+        """
+        for name in self.phases:
+            self.timers[name] += results.get(f"time_{name}", 0.0)
+            self.expansion_counters[name] += results.get(f"expansions_{name}", 0)
+        for name in self.counter_names:
+            self.counters[name] += results.get(f"count_{name}", 0)
+
+    def results(self):
+        """
+        Function that returns the timers and counters as flat outcomes
+        @return: dictionary with time_<phase>, count_<counter> and, if the expansions are counted,
+        expansions_<phase> values
+        """
+        results = {f"time_{name}": value for name, value in self.timers.items()}
+        results.update({f"count_{name}": value for name, value in self.counters.items()})
+        if self.expansions is not None:
+            results.update({f"expansions_{name}": value for name, value in self.expansion_counters.items()})
+        return results
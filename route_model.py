@@ -1,15 +1,43 @@
+import inspect
+
 import osmnx as ox
-import networkx as nx
 import geopandas as gpd
 import numpy as np
-import math
+import shapely
 from shapely.geometry import Point
 
+from compiled_graph import compiled_graph
+from graph_contraction import contracted_graph
+from edge_weights import edge_weight_engine, undirected_weight_engine, weight_cache, default_weight_cache_bytes, \
+    factor_names
+from graph_cache import default_cache_dir, file_hash, cache_key, path_costs_file_path, load_path_costs, \
+    save_path_costs, graph_snapshot_path, load_graph_snapshot, save_graph_snapshot, snapshot_edge_attributes, \
+    compiled_snapshot_path, load_compiled_graph, save_compiled_graph
+from profiling import phase_profiler
+from route_statistics import route_connectivity, route_position_frequency, running_statistic, route_network
+from spatial_index import node_spatial_index
+from traffic_speeds import load_speed_profiles, num_of_time_slots
+
 default_points = [44430463, 44465861]
 default_graph_file_path = "graph/graph_base_case.graphml"
 default_num_of_paths = 5
+# graph variant of the base case path costs of the points
+base_case_variant = "OW_False"
 default_neighbourhood_map_file_path = "graph/neighbourhood_map_suburb.geojson"
+# (lon_min, lat_min, lon_max, lat_max) of the Rotterdam area, the points are drawn within these bounds
+default_map_bounds = (4.427773, 51.863171, 4.580918, 51.970486)
 default_seed = 1000
+# number of pivot nodes for the sampled betweenness centrality of the route network, None is exact
+default_betweenness_pivots = 100
+
+# timed phases and counters of the profiler, the route_network phase includes the three phases before it
+profile_phases = ["generate_points", "calculate_weights", "k_shortest_paths", "suffix_routes", "source_statistics",
+                  "route_network", "scenario_statistics"]
+profile_counters = ["k_shortest_paths_calls", "suffix_searches", "routes", "route_nodes"]
+
+# "osmnx" routes with ox.distance.k_shortest_paths, "compiled" routes on the compiled CSR graph
+routing_backends = ["osmnx", "compiled"]
+default_routing_backend = "osmnx"
 
 strategies = {
     1: [1, 5,   1, 0.1, 5, 1, 1, 1, 1, 1, False],
@@ -18,13 +46,54 @@ strategies = {
 # CA=1, OA=1, LP=1, RP=1, OW=1, HS=1, TA=1, TA1=2, TA2=1.7, TA3=1.3
 
 
-def random_points_in_polygon(polygon, number):
+def get_graph_variant(one_way_possible):
+    """
+    Function that returns the graph variant of a scenario or strategy
+    @param one_way_possible: Boolean indicating possibility of driving into a road from the wrong way
+    @return: "OW_True" or "OW_False"
+    """
+    if one_way_possible:
+        return "OW_True"
+    return "OW_False"
+
+
+def random_points_in_polygon(polygon, number, bounds=None):
+    """
+    Function that draws random points in a polygon with rejection sampling.
+    The candidates are drawn in batches and tested vectorised, but the random stream is consumed exactly as
+    when drawing one x and one y per candidate, so the points under np.random.seed(seed) do not change.
+    @param polygon: polygon to draw the points in
+    @param number: number of points
+    @param bounds: optional (minx, miny, maxx, maxy) bounds the points must lie strictly within
+    @return: list with the points
+    """
     points = []
     minx, miny, maxx, maxy = polygon.bounds
+    shapely.prepare(polygon)
+
+    # the expected share of accepted candidates determines the batch size
+    acceptance = max(polygon.area / ((maxx - minx) * (maxy - miny)), 0.01)
+
     while len(points) < number:
-        pnt = Point(np.random.uniform(minx, maxx), np.random.uniform(miny, maxy))
-        if polygon.contains(pnt):
-            points.append(pnt)
+        shortfall = number - len(points)
+        batch = int(np.ceil(shortfall / acceptance * 1.5)) + 8
+
+        state = np.random.get_state()
+        samples = np.random.random_sample(2 * batch)
+        x = minx + (maxx - minx) * samples[0::2]
+        y = miny + (maxy - miny) * samples[1::2]
+
+        accepted = shapely.contains_xy(polygon, x, y)
+        if bounds is not None:
+            accepted &= (bounds[2] > x) & (x > bounds[0]) & (bounds[3] > y) & (y > bounds[1])
+        accepted_indexes = np.flatnonzero(accepted)[:shortfall]
+
+        # rewind the random stream so only the candidates up to the last accepted one are consumed
+        if len(accepted_indexes) == shortfall and accepted_indexes[-1] + 1 < batch:
+            np.random.set_state(state)
+            np.random.random_sample(2 * (accepted_indexes[-1] + 1))
+
+        points.extend(Point(x[index], y[index]) for index in accepted_indexes.tolist())
     return points
 
 
@@ -38,19 +107,215 @@ class route_model:
                 array with the origin and destination points
             graph_file_path:str
                 path to file to use for graph
-            graph: object
+            graph_OW_False: object
+                the directed graph with all attributes of the graph file and the base case weights, when the model
+                is loaded from the graph snapshot the graph file is parsed the first time it is used
+            graph_OW_True: object
+                the undirected variant of graph_OW_False, made the first time it is used
+            start_variant:str
+                graph variant of the starting strategy, "OW_False" or "OW_True"
+            end_variant:str
+                graph variant of the ending strategy, "OW_False" or "OW_True"
+            routing_backend:str
+                backend used for the k shortest paths, "osmnx" or "compiled"
+            shortest_path_trees:bool
+                Boolean indicating if the compiled backend routes with one shortest path tree per source and sink
+            goal_directed:bool
+                Boolean indicating if the compiled backend searches the paths with A* towards the sink
+            contract_chains:bool
+                Boolean indicating if the compiled backend routes on graphs of which the degree-2 chains are contracted
+            contracted_graphs: dict
+                contracted graph of every compiled graph, for the current points
+            cache_dir:str
+                folder for the graph snapshot and cached base case path costs, None disables the cache
+            n_processes:int
+                number of worker processes that generate the routes of the sources, 1 routes in this process
+            weight_cache: object
+                cache of the weight vectors per graph variant and scenario factors
+            betweenness_pivots:int
+                number of pivot nodes for the sampled betweenness centrality of the route network
+            neighbourhood_map_file_path:str
+                path to the GeoJSON neighbourhood map the origin and destination points are drawn in
+            map_bounds:tuple
+                (lon_min, lat_min, lon_max, lat_max) the origin and destination points are drawn within
+            profiler: object
+                timers and counters of the phases of the current scenario
+            speed_profiles: object
+                observed speeds of the edges per hour of the day, None uses the maximum speeds
+            speed_time_slot: int
+                hour of the day of the observed speeds, None uses the mean over the whole day
     """
 
-    def __init__(self, points=None, graph_file_path=default_graph_file_path):
+    def __init__(self, points=None, graph_file_path=default_graph_file_path,
+                 routing_backend=default_routing_backend, shortest_path_trees=False, cache_dir=default_cache_dir,
+                 n_processes=1, weight_cache_bytes=default_weight_cache_bytes,
+                 betweenness_pivots=default_betweenness_pivots,
+                 neighbourhood_map_file_path=default_neighbourhood_map_file_path, map_bounds=None, profile=False,
+                 speed_profile_file_path=None, speed_time_slot=None,
+                 goal_directed=False, contract_chains=False):
 
         """
             Init method that initializes all the structure of the model.
             This includes loading the graphs and setting the initial values of the necessary statistic variables.
             @param points: origin and destination points
             @param graph_file_path: file path for loading graph
+            @param routing_backend: backend used for the k shortest paths, "osmnx" or "compiled"
+            @param shortest_path_trees: Boolean indicating if the first path of every origin-destination pair is
+            taken from a shortest path tree per source and the other paths are seeded from a reverse tree per sink
+            @param cache_dir: folder for the graph snapshot and cached base case path costs, None disables the cache.
+            With the compiled routing backend a model starts from the snapshot in well under a second, as it only
+            maps the arrays. The osmnx backend also builds the lean graphs from the arrays, which takes longer on
+            large graphs, the graph_load_snapshot case of benchmarks.py measures both.
+            @param n_processes: number of worker processes that generate the routes of the sources, only available
+            with the compiled routing backend
+            @param weight_cache_bytes: maximum size of the cached weight vectors, 0 disables the cache
+            @param betweenness_pivots: number of pivot nodes for the sampled betweenness centrality of the route
+            network, None calculates the exact betweenness centrality
+            @param neighbourhood_map_file_path: file path of the GeoJSON neighbourhood map the points are drawn in
+            @param map_bounds: (lon_min, lat_min, lon_max, lat_max) the points are drawn within, None uses the
+            Rotterdam bounds for the default neighbourhood map and the bounds of the neighbourhood map otherwise
+            @param profile: Boolean indicating if the phases of every scenario are timed and counted, the results
+            are added to the scenario statistics
+            @param speed_profile_file_path: file path of the observed speed profiles built with traffic_speeds.py,
+            the base case and scenario weights then use the observed speeds instead of the maximum speeds where
+            an edge has them, None uses the maximum speeds
+            @param speed_time_slot: hour of the day of the observed speeds, None uses the mean over the whole day
+            @param goal_directed: Boolean indicating if the first path and the spur paths of every origin-destination
+            pair are A* searches with a straight line lower bound towards the sink, which settle fewer nodes
+            @param contract_chains: Boolean indicating if the compiled backend routes on graphs of which the chains
+            of degree-2 nodes are contracted, the routes are expanded to the full node lists. The paths have the same
+            costs, but between paths of equal cost other paths can be chosen
 
         """
+        if routing_backend not in routing_backends:
+            raise ValueError(f"Unknown routing backend {routing_backend}, choose from {routing_backends}")
+        if shortest_path_trees and routing_backend != "compiled":
+            raise ValueError("Shortest path trees are only available with the compiled routing backend")
+        if goal_directed and routing_backend != "compiled":
+            raise ValueError("Goal directed search is only available with the compiled routing backend")
+        if contract_chains and routing_backend != "compiled":
+            raise ValueError("Chain contraction is only available with the compiled routing backend")
+        if goal_directed and shortest_path_trees:
+            raise ValueError("Goal directed search can not be combined with shortest path trees, "
+                             "the trees already give exact lower bounds")
+        if n_processes < 1:
+            raise ValueError("The number of processes must be at least 1")
+        if n_processes > 1 and routing_backend != "compiled":
+            raise ValueError("Parallel route generation is only available with the compiled routing backend")
+        if speed_time_slot is not None and not 0 <= speed_time_slot < num_of_time_slots:
+            raise ValueError(f"The speed time slot must be an hour of the day between 0 and {num_of_time_slots - 1}")
+        self.init_routing_state(points, routing_backend, shortest_path_trees, goal_directed, contract_chains,
+                                n_processes, weight_cache_bytes, betweenness_pivots, profile)
+
+        self.neighbourhood_map_file_path = neighbourhood_map_file_path
+        self.neighbourhood_map = gpd.read_file(self.neighbourhood_map_file_path)
+        if map_bounds is None:
+            if self.neighbourhood_map_file_path == default_neighbourhood_map_file_path:
+                map_bounds = default_map_bounds
+            else:
+                map_bounds = tuple(float(bound) for bound in self.neighbourhood_map.total_bounds)
+        self.map_bounds = tuple(map_bounds)
+
+        self.graph_file_path = graph_file_path
+
+        # the cached results are keyed by the content of the input files
+        self.cache_dir = cache_dir
+        weight_engines = None
+        self.graph_file_hash = None
+        if self.cache_dir is not None or speed_profile_file_path is not None:
+            self.graph_file_hash = file_hash(self.graph_file_path)
+        if self.cache_dir is not None:
+            self.neighbourhood_map_hash = file_hash(self.neighbourhood_map_file_path)
+
+            # parsing the GraphML file is slow, so the graphs are loaded from a binary snapshot when possible
+            snapshot_path = graph_snapshot_path(self.cache_dir, self.graph_file_hash)
+            weight_engines = load_graph_snapshot(snapshot_path, self.graph_file_hash, variants=["OW_False"],
+                                                 build_graphs=self.routing_backend == "osmnx")
+
+        # the osmnx backend routes on the graphs of the weight engines, which only keep the edge attributes the model
+        # uses when they are loaded from the snapshot, the compiled backend only needs the arrays of the snapshot.
+        # The full graphs are only made when graph_OW_False or graph_OW_True is used
+        self._graph_OW_False = None
+        self._graph_OW_True = None
+
+        # the undirected graph variant is only loaded when a scenario needs it, see load_variant_OW_True
+        self.weight_engine_OW_True = None
+        self.compiled_graph_OW_True = None
+
+        if weight_engines is None:
+            self._graph_OW_False = ox.load_graphml(self.graph_file_path)
+
+            # compile the weight relevant edge attributes once, the base case weight is written back in one pass
+            self.weight_engine_OW_False = edge_weight_engine(self._graph_OW_False)
+            self.weight_engine_OW_False.write_attribute("base_case", self.weight_engine_OW_False.base_case)
+
+            if self.cache_dir is not None:
+                # the snapshot holds both variants, the undirected one is loaded from it when it is needed
+                weight_engine_OW_True = undirected_weight_engine(self._graph_OW_False, snapshot_edge_attributes)
+                save_graph_snapshot(snapshot_path, self.graph_file_hash, {"OW_False": self.weight_engine_OW_False,
+                                                                          "OW_True": weight_engine_OW_True})
+        else:
+            self.weight_engine_OW_False = weight_engines["OW_False"]
+
+        # the snapshot keeps the maximum speeds, the observed speeds are set on the loaded weight engines
+        self.speed_profiles = None
+        self.speed_profile_hash = None
+        self.speed_time_slot = speed_time_slot
+        if speed_profile_file_path is not None:
+            self.speed_profiles = load_speed_profiles(speed_profile_file_path)
+            if self.speed_profiles.graph_file_hash not in [None, self.graph_file_hash]:
+                raise ValueError(f"The speed profiles {speed_profile_file_path} were built for another graph")
+            self.speed_profile_hash = file_hash(speed_profile_file_path)
+            self.set_observed_speeds(self.weight_engine_OW_False)
+
+        self.compiled_graph_OW_False = None
+        if self.routing_backend == "compiled":
+            self.compiled_graph_OW_False = self.load_compiled_graph("OW_False")
+
+        # both graph variants have the same nodes, so one spatial index is used for snapping points
+        if self.compiled_graph_OW_False is not None:
+            self.node_spatial_index = node_spatial_index(node_ids=self.compiled_graph_OW_False.node_id_array,
+                                                         x=self.compiled_graph_OW_False.node_x,
+                                                         y=self.compiled_graph_OW_False.node_y)
+        else:
+            self.node_spatial_index = node_spatial_index(self.weight_engine_OW_False.graph)
+
+    def init_routing_state(self, points=None, routing_backend=default_routing_backend, shortest_path_trees=False,
+                           goal_directed=False, contract_chains=False, n_processes=1,
+                           weight_cache_bytes=default_weight_cache_bytes,
+                           betweenness_pivots=default_betweenness_pivots, profile=False):
+        """
+        Function that initializes the structure of the model that does not depend on the graphs: the routing
+        settings, the points, the weight cache, the profiler and the statistic variables. The worker processes of
+        the parallel route generation set up their models with it as well, so attributes that every model needs
+        belong here.
+        @param points: origin and destination points
+        @param routing_backend: backend used for the k shortest paths, "osmnx" or "compiled"
+        @param shortest_path_trees: Boolean indicating if the compiled backend routes with shortest path trees
+        @param goal_directed: Boolean indicating if the compiled backend searches the paths with A*
+        @param contract_chains: Boolean indicating if the compiled backend routes on contracted graphs
+        @param n_processes: number of worker processes that generate the routes of the sources
+        @param weight_cache_bytes: maximum size of the cached weight vectors, 0 disables the cache
+        @param betweenness_pivots: number of pivot nodes for the sampled betweenness centrality of the route network
+        @param profile: Boolean indicating if the phases of every scenario are timed and counted
+        """
+        self.routing_backend = routing_backend
+        self.shortest_path_trees = shortest_path_trees
+        self.goal_directed = goal_directed
+        self.contract_chains = contract_chains
+        # the points are never contracted, so the contracted graphs are built again when the points change
+        self.contracted_graphs = {}
+        self.n_processes = n_processes
+        self.betweenness_pivots = betweenness_pivots
+        # the worker processes are started at the first route network that needs them
+        self.parallel_route_network = None
+
+        # the Dijkstra expansions are only counted by the compiled graphs
+        self.profiler = phase_profiler(profile_phases, profile_counters, profile,
+                                       self.count_expansions if routing_backend == "compiled" else None)
+
         self.seed = default_seed
+        self.num_of_paths = default_num_of_paths
 
         # load the origin and destination points
         if points is None:
@@ -58,41 +323,18 @@ class route_model:
         else:
             self.points = points
 
-        self.neighbourhood_map = gpd.read_file(default_neighbourhood_map_file_path)
+        self.start_variant = "OW_False"
+        self.end_variant = "OW_False"
 
-        self.graph_file_path = graph_file_path
-        self.num_of_paths = default_num_of_paths
+        # weight vectors of earlier scenarios and the scenario factors that are currently set on every graph variant
+        self.weight_cache = weight_cache(weight_cache_bytes)
+        self.weight_keys = {}
 
-        self.graph_OW_False = ox.load_graphml(self.graph_file_path)
-
-        for road_id, (origin_num, destination_num, data) in enumerate(self.graph_OW_False.edges(data=True)):
-            # speed limits and length
-            if isinstance(data.get('maxspeed'), list):
-                base_case = data.get('length') / float(data.get('maxspeed')[0])
-            elif isinstance(data.get('maxspeed'), str):
-                base_case = data.get('length') / float(data.get('maxspeed'))
-            else:
-                # if maximum speed is not specified, max speed of 30 km/h is assumed
-                # the number of edges without maximum speed is 2402, from the total of 25348 edges (so 9.47%)
-                base_case = data.get('length') / 30.0
-
-            nx.set_edge_attributes(self.graph_OW_False,
-                                   {(origin_num, destination_num, 0): {
-                                       "base_case": base_case},
-                                       (origin_num, destination_num, 1): {
-                                           "base_case": base_case}})
-
-        self.graph_OW_True = self.graph_OW_False.to_undirected()
-
-        self.graph = self.graph_OW_False
-        self.graph_end_strategy = self.graph_OW_False
-
-        # statistic variables
-        self.continuity = []
-        self.connectivity = []
-        self.degree_centrality_means = []
-        self.degree_centrality_vars = []
-        self.node_frequency = []
+        # statistic variables, the values are accumulated instead of stored
+        self.continuity = running_statistic()
+        self.connectivity = running_statistic()
+        self.node_frequency = running_statistic()
+        self.route_network = route_network()
         self.path_costs_base_case = {}
 
     def generate_points(self, seed=default_seed, num_of_points_per_neighbourhood=1):
@@ -101,6 +343,8 @@ class route_model:
         These are random points based on the neighbourhoods in the map.
         The number of points per neighbourhood is specified which might be multiplied
         if it is one of the large neighbourhoods.
+        The base case path costs are calculated on the directed graph with the default number of paths, so the
+        points and path costs only depend on the seed and not on the scenarios that ran before.
         @param seed:
         @param num_of_points_per_neighbourhood:
         """
@@ -109,56 +353,56 @@ class route_model:
 
         self.seed = seed
 
+        # the base case weights never change, so the points and path costs of a seed are loaded from the cache
+        cache_file_path = None
+        if self.cache_dir is not None:
+            cache_file_path = path_costs_file_path(self.cache_dir, cache_key(
+                self.graph_file_hash, self.neighbourhood_map_hash, self.map_bounds, base_case_variant, seed,
+                num_of_points_per_neighbourhood, default_num_of_paths, *self.routing_key(), *self.speed_key()))
+            cached = load_path_costs(cache_file_path)
+            if cached is not None:
+                self.points, self.path_costs_base_case = cached
+                return
+
         np.random.seed(seed)
 
         points_from_map = []
 
         percentage_out_of_bound = 0.05
-        lat_min = 51.863171
-        lat_max = 51.970486
-        lon_min = 4.427773
-        lon_max = 4.580918
+        lon_min, lat_min, lon_max, lat_max = self.map_bounds
 
         ten_perc_lat = (lat_max - lat_min) * percentage_out_of_bound
         ten_perc_lon = (lon_max - lon_min) * percentage_out_of_bound
 
+        bounds = (lon_min + ten_perc_lon, lat_min + ten_perc_lat, lon_max - ten_perc_lon, lat_max - ten_perc_lat)
+
         num_of_points_per_neighbourhood = 1
         for index, row in self.neighbourhood_map.iterrows():
-            fit = True
-            while fit:
-                point = random_points_in_polygon(row["geometry"], num_of_points_per_neighbourhood)[0]
-                if (lat_max - ten_perc_lat > point.y > lat_min + ten_perc_lat) & (
-                        lon_max - ten_perc_lon > point.x > lon_min + ten_perc_lon):
-                    points_from_map.append(point)
-                    fit = False
-
-        self.points = []
-        for point in points_from_map:
-            closest_node = None
-            closest_distance = math.inf
-
-            for index1, node in self.graph.nodes(data=True):
-                distance = math.dist([point.x, point.y], [node.get("x"), node.get("y")])
-                if distance < closest_distance:
-                    closest_distance = distance
-                    closest_node = index1
-
-            self.points.append(closest_node)
+            points_from_map.extend(random_points_in_polygon(row["geometry"], num_of_points_per_neighbourhood, bounds))
+
+        # snap all points to their closest node in one query
+        self.points = self.node_spatial_index.nearest_nodes([point.x for point in points_from_map],
+                                                            [point.y for point in points_from_map])
 
+        path_costs_base_case = {}
         for origin_point in self.points:
             for destination_point in self.points:
                 if origin_point == destination_point:
                     continue
 
                 # bereken de base case waardes
-                routes = ox.distance.k_shortest_paths(self.graph, origin_point, destination_point, self.num_of_paths,
-                                                      weight="base_case")
+                routes = self.k_shortest_paths(base_case_variant, origin_point, destination_point,
+                                               default_num_of_paths, weight="base_case")
 
                 path_costs = []
                 for route in routes:
                     path_costs.append(len(route))
 
-                self.path_costs_base_case[(origin_point, destination_point)] = sum(path_costs) / len(path_costs)
+                path_costs_base_case[(origin_point, destination_point)] = sum(path_costs) / len(path_costs)
+
+        self.path_costs_base_case = path_costs_base_case
+        if cache_file_path is not None:
+            save_path_costs(cache_file_path, self.points, path_costs_base_case)
 
     def run_model(self, rational=True, CA=1, OA=1, LP=1, RP=1, OW=1, HS=1, TA=1, TA1=2, TA2=1.7, TA3=1.3,
                   num_of_paths=default_num_of_paths,
@@ -190,141 +434,267 @@ class route_model:
         self.reset_scenario_statistics()
 
         if seed != self.seed:
-            self.generate_points(seed, num_of_points_per_neighbourhood)
+            with self.profiler.phase("generate_points"):
+                self.generate_points(seed, num_of_points_per_neighbourhood)
 
         self.num_of_paths = num_of_paths
 
         if rational:
-            if one_way_possible:
-                self.graph = self.graph_OW_True
-            else:
-                self.graph = self.graph_OW_False
+            self.start_variant = get_graph_variant(one_way_possible)
 
-            self.calculate_weights(CA, OA, LP, RP, OW, HS, TA, TA1, TA2, TA3, self.graph)
+            self.calculate_weights(CA, OA, LP, RP, OW, HS, TA, TA1, TA2, TA3, self.start_variant)
             self.generate_route_network(rational=True)
 
         else:
-            if strategies[start_strategy][-1]:
-                self.graph = self.graph_OW_True
-            else:
-                self.graph = self.graph_OW_False
+            self.start_variant = get_graph_variant(strategies[start_strategy][-1])
+            self.end_variant = get_graph_variant(strategies[end_strategy][-1])
 
-            if strategies[end_strategy][-1]:
-                self.graph_end_strategy = self.graph_OW_True
-            else:
-                self.graph_end_strategy = self.graph_OW_False
-
-            self.calculate_weights(*strategies[start_strategy][: -1], self.graph)
-            self.calculate_weights(*strategies[end_strategy][: -1], self.graph_end_strategy)
+            self.calculate_weights(*strategies[start_strategy][: -1], self.start_variant)
+            self.calculate_weights(*strategies[end_strategy][: -1], self.end_variant)
 
             self.generate_route_network(rational=False, strategy_change_percentage=strategy_change_percentage)
 
         return self.calculate_scenario_statistics()
 
+    def run_models(self, scenarios):
+        """
+        Function that runs a batch of model scenarios.
+        The scenarios are grouped by seed, so the points and base case path costs of a seed are set once, and
+        ordered by their factors within a group, so consecutive scenarios share most weights and cached trees.
+        The weights of the rational scenarios are calculated per chunk in one vectorised pass into the weight
+        cache, after which every scenario is routed with run_model.
+        The points and base case path costs only depend on the seed, so the results equal running the scenarios
+        one by one, or every scenario on its own.
+        @param scenarios: list of dictionaries with the arguments of run_model
+        @return: list with the statistical values of every scenario, in the order of the scenarios
+        """
+        signature = inspect.signature(self.run_model)
+        arguments = []
+        for scenario in scenarios:
+            bound_arguments = signature.bind(**scenario)
+            bound_arguments.apply_defaults()
+            arguments.append(bound_arguments.arguments)
+
+        def scenario_order(index):
+            scenario_arguments = arguments[index]
+            return ((scenario_arguments["rational"], scenario_arguments["one_way_possible"],
+                     scenario_arguments["start_strategy"], scenario_arguments["end_strategy"]) +
+                    tuple(scenario_arguments[name] for name in factor_names) +
+                    (scenario_arguments["strategy_change_percentage"], scenario_arguments["num_of_paths"]))
+
+        # the group of the current seed goes first, so its points are not generated again
+        seed_groups = {self.seed: []}
+        for index, scenario_arguments in enumerate(arguments):
+            seed_groups.setdefault(scenario_arguments["seed"], []).append(index)
+        order = []
+        for indexes in seed_groups.values():
+            order.extend(sorted(indexes, key=scenario_order))
+
+        # a chunk holds as many weight vectors as fit in half of the weight cache
+        vector_bytes = max(self.weight_engine_OW_False.num_of_edges, 1) * 8
+        chunk_size = max(self.weight_cache.max_bytes // (2 * vector_bytes), 1)
+
+        results = [None] * len(scenarios)
+        for start in range(0, len(order), chunk_size):
+            chunk = order[start:start + chunk_size]
+            self.cache_scenario_weights([arguments[index] for index in chunk])
+            for index in chunk:
+                results[index] = self.run_model(**arguments[index])
+        return results
+
+    def cache_scenario_weights(self, scenario_arguments):
+        """
+        Function that calculates the weights of rational scenarios that are not cached yet in one vectorised pass
+        per graph variant and stores them in the weight cache
+        @param scenario_arguments: list of dictionaries with all arguments of run_model
+        """
+        if self.weight_cache.max_bytes == 0:
+            return
+
+        keys = {"OW_False": [], "OW_True": []}
+        for arguments in scenario_arguments:
+            if not arguments["rational"]:
+                # the weights of the strategies are cached after their first use
+                continue
+            variant = "OW_True" if arguments["one_way_possible"] else "OW_False"
+            key = (variant,) + tuple(arguments[name] for name in factor_names)
+            if key not in self.weight_cache and key not in keys[variant]:
+                keys[variant].append(key)
+
+        for variant, variant_keys in keys.items():
+            if not variant_keys:
+                continue
+            weight_engine = self.get_weight_engine(variant)
+            weight_matrix = weight_engine.compute_weight_matrix([key[1:] for key in variant_keys])
+            for key, weights in zip(variant_keys, weight_matrix):
+                self.weight_cache.put(key, weights.copy())
+
     def reset_scenario_statistics(self):
         """
         Function that resets the scenario statistics
         """
-        self.continuity = []
-        self.connectivity = []
-        self.node_frequency = []
+        self.continuity = running_statistic()
+        self.connectivity = running_statistic()
+        self.node_frequency = running_statistic()
+        self.route_network = route_network()
+        self.profiler.reset()
+
+    def set_profiling(self, enabled):
+        """
+        Function that switches the timing and counting of the phases of the scenarios on or off
+        @param enabled: Boolean indicating if the phases are timed and counted
+        """
+        self.profiler.enabled = enabled
+
+    def count_expansions(self):
+        """
+        Function that returns the number of nodes settled by the Dijkstra searches on the compiled graphs so far
+        @return: the number of settled nodes
+        """
+        compiled_graphs = [self.compiled_graph_OW_False, self.compiled_graph_OW_True]
+        return sum(compiled.expansions for compiled in compiled_graphs + list(self.contracted_graphs.values())
+                   if compiled is not None)
 
     def calculate_scenario_statistics(self):
         """
         Function that calculates the scenario statistics
         @return: the scenario statistics
         """
-        node_frequency_mean = sum(self.node_frequency) / len(self.node_frequency)
-        node_frequency_var = sum(
-            (i - node_frequency_mean) ** 2 for i in self.node_frequency) / len(
-            self.node_frequency)
+        node_frequency_mean = self.node_frequency.mean
+        node_frequency_var = self.node_frequency.variance()
+
+        continuity_mean = self.continuity.mean
+        continuity_vars = self.continuity.variance()
 
-        continuity_mean = sum(self.continuity) / len(self.continuity)
-        continuity_vars = sum(
-            (i - continuity_mean) ** 2 for i in self.continuity) / len(
-            self.continuity)
+        connectivity_mean = self.connectivity.mean
+        connectivity_vars = self.connectivity.variance()
 
-        connectivity_mean = sum(self.connectivity) / len(self.connectivity)
-        connectivity_vars = sum(
-            (i - connectivity_mean) ** 2 for i in self.connectivity) / len(
-            self.connectivity)
+        # the sample of pivot nodes follows the seed of the scenario, so the statistics are reproducible
+        with self.profiler.phase("scenario_statistics"):
+            statistics = self.route_network.statistics(self.betweenness_pivots, self.seed)
 
-        return {
+        statistics.update({
             "continuity_mean": continuity_mean,
             "continuity_vars": continuity_vars,
             "connectivity_mean": connectivity_mean,
             "connectivity_vars": connectivity_vars,
             'node_frequency_mean': node_frequency_mean,
             'node_frequency_var': node_frequency_var
-        }
+        })
+        if self.profiler.enabled:
+            statistics.update(self.profiler.results())
+        return statistics
 
     def generate_route_network(self, rational=True, strategy_change_percentage=0):
         """
         Function that runs the rational model
+        With shortest_path_trees the compiled graph keeps one shortest path tree per source and one reverse tree
+        per sink for the current weights, so every pair does not start with its own full Dijkstra search.
+        With more than one process the sources are divided over worker processes, the results are merged in the
+        order of the sources so the statistics are the same as when routing in this process.
+        The timers and counters of the workers are added to the profiler, so their phase durations are summed
+        over the processes.
         """
-        for source in self.points:
-            routes_in_graph = []
-            node_frequency = {}
-
-            for sink in self.points:
-                continuity_values = []
-                # if sink and source are equal, continue to next pair
-                if source == sink:
-                    continue
-                # Calculate top x number of paths between sink and source
-                routes = self.calculate_routes(source, sink, rational, strategy_change_percentage)
+        with self.profiler.phase("route_network"):
+            if self.n_processes > 1:
+                source_results = []
+                for result, profile in self.get_parallel_route_network().generate(
+                        self, self.start_variant, self.end_variant, rational, strategy_change_percentage):
+                    source_results.append(result)
+                    if profile is not None:
+                        self.profiler.merge(profile)
+            else:
+                source_results = (self.generate_source_routes(source, rational, strategy_change_percentage)
+                                  for source in self.points)
 
-                # For every route, add the nodes and edges to the route graph
-                for route in routes:
-                    routes_in_graph.append(route)
-                    for i in range(0, len(route) - 1):
+            for continuity, node_frequency, connectivity, network in source_results:
+                self.continuity.merge(continuity)
+                self.node_frequency.merge(node_frequency)
+                self.connectivity.merge(connectivity)
+                self.route_network.merge(network)
 
-                        if i in node_frequency:
-                            # incrementing the count
-                            node_frequency[i] += 1
-                        else:
-                            # initializing the count
-                            node_frequency[i] = 1
+    def generate_source_routes(self, source, rational=True, strategy_change_percentage=0):
+        """
+        Function that generates the routes from one source to all sinks and calculates their statistics
+        @param source: origin node
+        @param rational: Boolean indicating rational or bounded rational decision making
+        @param strategy_change_percentage: Float indicating at what time in the run, the strategy changes
+        @return: accumulators of the continuity, node frequency and connectivity values of the source and the
+        network of its routes
+        """
+        continuity = running_statistic()
+        routes_in_graph = []
+
+        for sink in self.points:
+            continuity_values = []
+            # if sink and source are equal, continue to next pair
+            if source == sink:
+                continue
+            # Calculate top x number of paths between sink and source
+            routes = self.calculate_routes(source, sink, rational, strategy_change_percentage)
+
+            # For every route, add the nodes and edges to the route graph
+            for route in routes:
+                routes_in_graph.append(route)
+                continuity_values.append(len(route))
+            self.profiler.count("routes", len(routes))
+            self.profiler.count("route_nodes", sum(continuity_values))
+
+            continuity_values_mean = sum(continuity_values) / len(continuity_values)
+            continuity.add(continuity_values_mean / self.path_costs_base_case[(source, sink)])
+
+        with self.profiler.phase("source_statistics"):
+            # calculate relative node frequency
+            node_frequency = running_statistic()
+            node_frequency.add_values(route_position_frequency(routes_in_graph) / self.num_of_paths)
 
-                    continuity_values.append(len(route))
+            # Calculate the connectivity of a route by determining the number of routes it intersects with,
+            # using the sparse route x node incidence matrix of all routes of this source
+            route_lengths = np.array([len(route) for route in routes_in_graph], dtype=np.float64)
+            connectivity = running_statistic()
+            connectivity.add_values((route_connectivity(routes_in_graph) / route_lengths) / self.num_of_paths)
 
-                continuity_values_mean = sum(continuity_values) / len(continuity_values)
-                self.continuity.append(continuity_values_mean / self.path_costs_base_case[(source, sink)])
+            network = route_network()
+            network.add_routes(routes_in_graph)
 
-            # calculate relative node frequency
-            for node_freq in node_frequency.values():
-                self.node_frequency.append(node_freq / self.num_of_paths)
-
-            # Calculate the connectivity of a route by determining the number of routes it intersects with
-            for route in routes_in_graph:
-                connectivity_route = 0
-                for route_it in routes_in_graph:
-                    if route == route_it:
-                        continue
-                    connectivity_route += len(list((value for value in list(route) if value in list(route_it))))
-                self.connectivity.append((connectivity_route / len(route)) / self.num_of_paths)
+        return continuity, node_frequency, connectivity, network
 
     def calculate_routes(self, source, sink, rational=True, strategy_change_percentage=0):
         # Calculate top x number of paths between sink and source
-        routes = ox.distance.k_shortest_paths(self.graph, source, sink, self.num_of_paths,
-                                              weight="used_weight")
+        with self.profiler.phase("k_shortest_paths"):
+            routes = list(self.k_shortest_paths(self.start_variant, source, sink, self.num_of_paths,
+                                                weight="used_weight"))
 
         if rational:
             return routes
 
         adjusted_routes = []
-        for route in routes:
-            index_to_change = int(len(route) * strategy_change_percentage)
-            routes_to_adjust = ox.distance.k_shortest_paths(self.graph_end_strategy, route[index_to_change],
-                                                            sink, 1,
-                                                            weight="used_weight")
+        with self.profiler.phase("suffix_routes"):
+            for route in routes:
+                index_to_change = int(len(route) * strategy_change_percentage)
+                routes_to_adjust = self.calculate_suffix_routes(route[index_to_change], sink)
 
-            for route_to_adjust in routes_to_adjust:
-                adjusted_routes.append(route[0:index_to_change] + route_to_adjust)
+                for route_to_adjust in routes_to_adjust:
+                    adjusted_routes.append(route[0:index_to_change] + route_to_adjust)
 
         return adjusted_routes
 
-    def calculate_weights(self, CA, OA, LP, RP, OW, HS, TA, TA1, TA2, TA3, graph):
+    def calculate_suffix_routes(self, switch_node, sink):
+        """
+        Function that calculates the route from the node where the strategy changes to the sink.
+        With the compiled backend the route is read from the reverse shortest path tree of the sink on the
+        graph of the ending strategy, which is calculated once per sink and kept until the weights change.
+        @param switch_node: node where the strategy changes
+        @param sink: destination node
+        @return: list with the shortest route from the switch node to the sink
+        """
+        self.profiler.count("suffix_searches")
+        if self.routing_backend == "compiled":
+            return [self.get_routing_graph(self.end_variant).shortest_path_to(switch_node, sink,
+                                                                              weight="used_weight")]
+        return self.k_shortest_paths(self.end_variant, switch_node, sink, 1, weight="used_weight")
+
+    def calculate_weights(self, CA, OA, LP, RP, OW, HS, TA, TA1, TA2, TA3, variant):
         """
         Function that calculates the weights of all the edges based on the scenario variables
         @param TA: Multiplication factor for traffic avoidance
@@ -337,63 +707,212 @@ class route_model:
         @param RP: Multiplication factor for residential preference
         @param OW: Multiplication factor for wrong way preference
         @param HS: Multiplication factor for high speed preference
-        @param graph: the graph that needs to be adapted
+        @param variant: variant of the graph that needs to be adapted, "OW_False" or "OW_True"
 
         """
-        for road_id, (origin_num, destination_num, data) in enumerate(graph.edges(data=True)):
-
-            # speed limits and length
-            if isinstance(data.get('maxspeed'), list):
-                weight_used = data.get('length') / float(data.get('maxspeed')[0])
-                if float(data.get('maxspeed')[0]) > 50:
-                    weight_used = weight_used * HS
-            elif isinstance(data.get('maxspeed'), str):
-                weight_used = data.get('length') / float(data.get('maxspeed'))
-                if float(data.get('maxspeed')) > 50:
-                    weight_used = weight_used * HS
+        with self.profiler.phase("calculate_weights"):
+            key = (variant, CA, OA, LP, RP, OW, HS, TA, TA1, TA2, TA3)
+            used_weight = self.weight_cache.get(key)
+
+            # the graph already has these weights, this also keeps the shortest path trees of the compiled graph
+            if used_weight is not None and self.weight_keys.get(key[0]) == key:
+                return
+
+            # only the edges that depend on the factors that changed since the previous scenario are updated
+            weight_engine = self.get_weight_engine(variant)
+            cached = used_weight is not None
+            used_weight, changed_edges = weight_engine.update_weights(CA, OA, LP, RP, OW, HS, TA, TA1, TA2, TA3,
+                                                                      weights=used_weight)
+            if not cached:
+                self.weight_cache.put(key, used_weight)
+
+            if self.routing_backend == "compiled":
+                self.get_compiled_graph(variant).set_weights("used_weight", used_weight, changed_edges)
             else:
-                # if maximum speed is not specified, max speed of 30 km/h is assumed
-                # the number of edges without maximum speed is 2402, from the total of 25348 edges (so 9.47%)
-                weight_used = data.get('length') / 30.0
-
-            # cameras
-            if "camera" in data:
-                weight_used = weight_used * CA
-
-            # obstacle avoidance
-            if "roundabout" in data:
-                weight_used = weight_used * OA
-            if "traffic_light" in data:
-                weight_used = weight_used * OA
-            if "bridge" in data:
-                weight_used = weight_used * OA
-            if "tunnel" in data:
-                weight_used = weight_used * OA
-
-            # Lane preference
-            if "lanes" in data and int(data["lanes"][0]) > 1:
-                weight_used = weight_used * LP
-
-            # residential preference
-            if data["highway"] in ['residential']:
-                weight_used = weight_used * RP
-
-            # One way
-            if data["oneway"]:
-                weight_used = weight_used * OW
-
-            # Traffic avoidance
-            if 'highway' in data:
-                if TA > 1:
-                    if data["highway"] in ['motorway', 'motorway_link', 'trunk']:
-                        weight_used = weight_used * TA * TA1
-                    elif data["highway"] in ['primary', 'primary_link', 'secondary']:
-                        weight_used = weight_used * TA * TA2
-                    elif data["highway"] in ['tertiary']:
-                        weight_used = weight_used * TA * TA3
-
-            nx.set_edge_attributes(graph,
-                                   {(origin_num, destination_num, 0): {
-                                       "used_weight": weight_used},
-                                       (origin_num, destination_num, 1): {
-                                           "used_weight": weight_used}})
+                weight_engine.write_attribute("used_weight", used_weight, changed_edges)
+            self.weight_keys[key[0]] = key
+
+    @property
+    def graph_OW_False(self):
+        """
+        The directed graph with all attributes of the graph file and the base case weights. When the model was
+        loaded from the graph snapshot, the graph file is parsed the first time it is used.
+        @return: graph_OW_False
+        """
+        if self._graph_OW_False is None:
+            graph = ox.load_graphml(self.graph_file_path)
+            for (origin_num, destination_num, key), value in zip(self.weight_engine_OW_False.edge_keys.tolist(),
+                                                                 self.weight_engine_OW_False.base_case.tolist()):
+                graph[origin_num][destination_num][key]["base_case"] = value
+            self._graph_OW_False = graph
+        return self._graph_OW_False
+
+    @property
+    def graph_OW_True(self):
+        """
+        The undirected graph, in which roads can be driven from the wrong way, with all attributes of
+        graph_OW_False. It is made the first time it is used.
+        @return: graph_OW_True
+        """
+        if self._graph_OW_True is None:
+            self._graph_OW_True = self.graph_OW_False.to_undirected()
+        return self._graph_OW_True
+
+    def load_variant_OW_True(self):
+        """
+        Function that loads the weight engine and compiled graph of the undirected graph variant.
+        They are loaded the first time a scenario needs them, from the graph snapshot or as lean undirected variant
+        of the directed graph, so scenarios without one_way_possible do not hold a second graph.
+        """
+        if self.weight_engine_OW_True is not None:
+            return
+
+        weight_engines = None
+        if self.cache_dir is not None:
+            weight_engines = load_graph_snapshot(graph_snapshot_path(self.cache_dir, self.graph_file_hash),
+                                                 self.graph_file_hash, variants=["OW_True"],
+                                                 build_graphs=self.routing_backend == "osmnx")
+
+        if weight_engines is None:
+            self.weight_engine_OW_True = undirected_weight_engine(self.graph_OW_False, snapshot_edge_attributes)
+        else:
+            self.weight_engine_OW_True = weight_engines["OW_True"]
+        if self.speed_profiles is not None:
+            self.set_observed_speeds(self.weight_engine_OW_True)
+
+        if self.routing_backend == "compiled":
+            self.compiled_graph_OW_True = self.load_compiled_graph("OW_True")
+
+    def set_observed_speeds(self, weight_engine):
+        """
+        Function that sets the observed speeds of the speed profiles on the edges of a weight engine and writes
+        the base case weights that follow from them back to its graph
+        @param weight_engine: the weight engine of a graph variant
+        """
+        weight_engine.set_speeds(self.speed_profiles.edge_speeds(weight_engine.edge_keys, self.speed_time_slot))
+        weight_engine.write_attribute("base_case", weight_engine.base_case)
+
+    def routing_key(self):
+        """
+        Function that returns the parts of the cache key that identify the routing backend and its options.
+        The backends can choose other paths between paths of equal cost, which gives other path costs.
+        @return: tuple with the routing backend, shortest_path_trees, goal_directed and contract_chains
+        """
+        return self.routing_backend, self.shortest_path_trees, self.goal_directed, self.contract_chains
+
+    def speed_key(self):
+        """
+        Function that returns the parts of the cache key that identify the observed speeds
+        @return: tuple with the hash of the speed profiles and the time slot, empty when the maximum speeds are used
+        """
+        if self.speed_profiles is None:
+            return ()
+        return self.speed_profile_hash, self.speed_time_slot
+
+    def load_compiled_graph(self, variant):
+        """
+        Function that returns the compiled graph of a graph variant with the base case weights set.
+        The CSR arrays are memory mapped from the cache when possible, so processes on one host share them.
+        @param variant: graph variant, "OW_False" or "OW_True"
+        @return: the compiled graph
+        """
+        weight_engine = self.get_weight_engine(variant)
+
+        compiled = None
+        if self.cache_dir is not None:
+            compiled_path = compiled_snapshot_path(self.cache_dir, self.graph_file_hash, variant)
+            compiled = load_compiled_graph(compiled_path, self.graph_file_hash)
+
+        if compiled is None:
+            graph = weight_engine.graph
+            if graph is None:
+                # without the graphs of the snapshot, the nodes and the direction of the variant are compiled from
+                # the full graph
+                graph = self.graph_OW_False
+                if variant == "OW_True":
+                    graph = graph.to_undirected(as_view=True)
+            compiled = compiled_graph(graph, weight_engine.edge_keys)
+            if self.cache_dir is not None:
+                save_compiled_graph(compiled_path, self.graph_file_hash, compiled)
+
+        compiled.set_weights("base_case", weight_engine.read_attribute("base_case"))
+        return compiled
+
+    def get_weight_engine(self, variant):
+        """
+        Function that returns the compiled edge attributes of a graph variant, the undirected variant is loaded
+        the first time it is used
+        @param variant: graph variant, "OW_False" or "OW_True"
+        @return: the weight engine of the graph variant
+        """
+        if variant == "OW_True":
+            self.load_variant_OW_True()
+            return self.weight_engine_OW_True
+        return self.weight_engine_OW_False
+
+    def get_parallel_route_network(self):
+        """
+        Function that returns the worker processes for parallel route generation, starting them the first time
+        @return: the parallel route network
+        """
+        if self.parallel_route_network is None:
+            # imported here, because the worker model in parallel_routes is a subclass of route_model
+            from parallel_routes import parallel_route_network
+            self.parallel_route_network = parallel_route_network(self.n_processes)
+        return self.parallel_route_network
+
+    def close(self):
+        """
+        Function that stops the worker processes of parallel route generation
+        """
+        if self.parallel_route_network is not None:
+            self.parallel_route_network.close()
+            self.parallel_route_network = None
+
+    def get_compiled_graph(self, variant):
+        """
+        Function that returns the compiled CSR graph of a graph variant
+        @param variant: graph variant, "OW_False" or "OW_True"
+        @return: the compiled graph
+        """
+        if variant == "OW_True":
+            self.load_variant_OW_True()
+            return self.compiled_graph_OW_True
+        return self.compiled_graph_OW_False
+
+    def get_routing_graph(self, variant):
+        """
+        Function that returns the graph the compiled backend routes on, the compiled graph or with contract_chains
+        its contracted graph in which the current points are not contracted
+        @param variant: graph variant, "OW_False" or "OW_True"
+        @return: the compiled or contracted graph
+        """
+        compiled = self.get_compiled_graph(variant)
+        if not self.contract_chains:
+            return compiled
+
+        contracted = self.contracted_graphs.get(compiled)
+        if contracted is None or contracted.protected_nodes != frozenset(self.points):
+            expansions = 0 if contracted is None else contracted.expansions
+            contracted = contracted_graph(compiled, self.points)
+            # the settled nodes are counted over the rebuilds
+            contracted.expansions = expansions
+            self.contracted_graphs[compiled] = contracted
+        return contracted
+
+    def k_shortest_paths(self, variant, source, sink, k, weight="used_weight"):
+        """
+        Function that calculates the k shortest paths between two nodes with the selected routing backend
+        @param variant: graph variant, "OW_False" or "OW_True"
+        @param source: origin node
+        @param sink: destination node
+        @param k: number of shortest paths
+        @param weight: edge attribute to minimize
+        @return: generator of the paths as lists of nodes
+        """
+        self.profiler.count("k_shortest_paths_calls")
+        if self.routing_backend == "compiled":
+            return self.get_routing_graph(variant).k_shortest_paths(source, sink, k, weight=weight,
+                                                                  use_trees=self.shortest_path_trees,
+                                                                  goal_directed=self.goal_directed)
+        return ox.distance.k_shortest_paths(self.get_weight_engine(variant).graph, source, sink, k, weight=weight)
@@ -1,10 +1,12 @@
 import osmnx as ox
-import networkx as nx
 import geopandas as gpd
 import numpy as np
-import math
+import shapely
 from shapely.geometry import Point
-import numpy
+
+from edge_weights import edge_weight_engine
+from route_renderer import base_layer, route_renderer, render_routes
+from spatial_index import node_spatial_index
 
 default_points = [6238824713,  44596978, 44471862, 44201093]
 #stadhuis 6238824713 -> 2351979103
@@ -12,6 +14,10 @@ default_points = [6238824713,  44596978, 44471862, 44201093]
 #node number highway north  44471862 -> 44459477
 #node number residential south 44201093
 destination_points = [44573645, 44459477, 44201093]
+# color and size of the nodes that are drawn on top of the routes, the start node is drawn in red
+highlight_nodes = {point: ("tab:blue", 20) for point in destination_points}
+highlight_nodes[2351979103] = ("red", 20)
+default_visualisation_folder = 'notebooks/case_study/visualisations/points_together/points_together'
 default_graph_file_path = "graph/graph_base_case.graphml"
 default_num_of_paths = 5
 default_neighbourhood_map_file_path = "graph/neighbourhood_map_suburb.geojson"
@@ -24,13 +30,43 @@ strategies = {
 # CA=1, OA=1, LP=1, RP=1, OW=1, HS=1, TA=1, TA1=2, TA2=1.7, TA3=1.3
 
 
-def random_points_in_polygon(polygon, number):
+def random_points_in_polygon(polygon, number, bounds=None):
+    """
+    Function that draws random points in a polygon with rejection sampling.
+    The candidates are drawn in batches and tested vectorised, but the random stream is consumed exactly as
+    when drawing one x and one y per candidate, so the points under np.random.seed(seed) do not change.
+    @param polygon: polygon to draw the points in
+    @param number: number of points
+    @param bounds: optional (minx, miny, maxx, maxy) bounds the points must lie strictly within
+    @return: list with the points
+    """
     points = []
     minx, miny, maxx, maxy = polygon.bounds
+    shapely.prepare(polygon)
+
+    # the expected share of accepted candidates determines the batch size
+    acceptance = max(polygon.area / ((maxx - minx) * (maxy - miny)), 0.01)
+
     while len(points) < number:
-        pnt = Point(np.random.uniform(minx, maxx), np.random.uniform(miny, maxy))
-        if polygon.contains(pnt):
-            points.append(pnt)
+        shortfall = number - len(points)
+        batch = int(np.ceil(shortfall / acceptance * 1.5)) + 8
+
+        state = np.random.get_state()
+        samples = np.random.random_sample(2 * batch)
+        x = minx + (maxx - minx) * samples[0::2]
+        y = miny + (maxy - miny) * samples[1::2]
+
+        accepted = shapely.contains_xy(polygon, x, y)
+        if bounds is not None:
+            accepted &= (bounds[2] > x) & (x > bounds[0]) & (bounds[3] > y) & (y > bounds[1])
+        accepted_indexes = np.flatnonzero(accepted)[:shortfall]
+
+        # rewind the random stream so only the candidates up to the last accepted one are consumed
+        if len(accepted_indexes) == shortfall and accepted_indexes[-1] + 1 < batch:
+            np.random.set_state(state)
+            np.random.random_sample(2 * (accepted_indexes[-1] + 1))
+
+        points.extend(Point(x[index], y[index]) for index in accepted_indexes.tolist())
     return points
 
 
@@ -45,6 +81,10 @@ class route_model:
             graph_file_path:str
                 path to file to use for graph
             graph: object
+            base_layer: dict
+                projected edges and nodes of graph_OW_False that the route maps are drawn on
+            render_jobs: list
+                maps of the scenarios of a batch that still have to be rendered, None renders every map directly
     """
 
     def __init__(self, points=None, graph_file_path=default_graph_file_path):
@@ -71,28 +111,24 @@ class route_model:
 
         self.graph_OW_False = ox.load_graphml(self.graph_file_path)
 
-        for road_id, (origin_num, destination_num, data) in enumerate(self.graph_OW_False.edges(data=True)):
-            # speed limits and length
-            if isinstance(data.get('maxspeed'), list):
-                base_case = data.get('length') / float(data.get('maxspeed')[0])
-            elif isinstance(data.get('maxspeed'), str):
-                base_case = data.get('length') / float(data.get('maxspeed'))
-            else:
-                # if maximum speed is not specified, max speed of 30 km/h is assumed
-                # the number of edges without maximum speed is 2402, from the total of 25348 edges (so 9.47%)
-                base_case = data.get('length') / 30.0
-
-            nx.set_edge_attributes(self.graph_OW_False,
-                                   {(origin_num, destination_num, 0): {
-                                       "base_case": base_case},
-                                       (origin_num, destination_num, 1): {
-                                           "base_case": base_case}})
+        # compile the weight relevant edge attributes once, the base case weight is written back in one pass
+        self.weight_engine_OW_False = edge_weight_engine(self.graph_OW_False)
+        self.weight_engine_OW_False.write_attribute("base_case", self.weight_engine_OW_False.base_case)
 
         self.graph_OW_True = self.graph_OW_False.to_undirected()
+        self.weight_engine_OW_True = edge_weight_engine(self.graph_OW_True)
 
         self.graph = self.graph_OW_False
         self.graph_end_strategy = self.graph_OW_False
 
+        # both graph variants have the same nodes, so one spatial index is used for snapping points
+        self.node_spatial_index = node_spatial_index(self.graph_OW_False)
+
+        # the network is projected once, the renderer draws it at the first map
+        self.base_layer = base_layer(self.graph_OW_False)
+        self.renderer = None
+        self.render_jobs = None
+
         # statistic variables
         self.continuity = []
         self.connectivity = []
@@ -140,28 +176,15 @@ class route_model:
         ten_perc_lat = (lat_max - lat_min) * percentage_out_of_bound
         ten_perc_lon = (lon_max - lon_min) * percentage_out_of_bound
 
+        bounds = (lon_min + ten_perc_lon, lat_min + ten_perc_lat, lon_max - ten_perc_lon, lat_max - ten_perc_lat)
+
         num_of_points_per_neighbourhood = 1
         for index, row in self.neighbourhood_map.iterrows():
-            fit = True
-            while fit:
-                point = random_points_in_polygon(row["geometry"], num_of_points_per_neighbourhood)[0]
-                if (lat_max - ten_perc_lat > point.y > lat_min + ten_perc_lat) & (
-                        lon_max - ten_perc_lon > point.x > lon_min + ten_perc_lon):
-                    points_from_map.append(point)
-                    fit = False
-
-        self.points = []
-        for point in points_from_map:
-            closest_node = None
-            closest_distance = math.inf
-
-            for index1, node in self.graph.nodes(data=True):
-                distance = math.dist([point.x, point.y], [node.get("x"), node.get("y")])
-                if distance < closest_distance:
-                    closest_distance = distance
-                    closest_node = index1
-
-            self.points.append(closest_node)
+            points_from_map.extend(random_points_in_polygon(row["geometry"], num_of_points_per_neighbourhood, bounds))
+
+        # snap all points to their closest node in one query
+        self.points = self.node_spatial_index.nearest_nodes([point.x for point in points_from_map],
+                                                            [point.y for point in points_from_map])
 
         for origin_point in self.points:
             for destination_point in self.points:
@@ -241,6 +264,23 @@ class route_model:
 
         return self.calculate_scenario_statistics()
 
+    def run_models(self, scenarios, n_processes=1):
+        """
+        Function that runs a batch of model scenarios and renders their route maps afterwards,
+        in worker processes that each draw the base layer once
+        @param scenarios: list of dictionaries with the arguments of run_model
+        @param n_processes: number of worker processes for rendering the maps
+        @return: list with the file paths of the maps
+        """
+        self.render_jobs = []
+        try:
+            for scenario in scenarios:
+                self.run_model(**scenario)
+            jobs = self.render_jobs
+        finally:
+            self.render_jobs = None
+        return render_routes(self.base_layer, jobs, n_processes)
+
     def reset_scenario_statistics(self):
         """
         Function that resets the scenario statistics
@@ -315,57 +355,25 @@ class route_model:
 
             # save routes
 
-            nodes_in_routes = []
-            edges_in_routes = []
+            nodes_in_routes = set()
+            edges_in_routes = set()
 
             for route in total_routes:
                 for i in range(0, len(route) - 2):
-                    nodes_in_routes.append(route[i])
-                    edges_in_routes.append((route[i], route[i + 1]))
-                nodes_in_routes.append(route[-1])
-
-            node_colors = []
-            node_size = []
-            edge_colors = []
-            edge_size = []
-            for index in self.graph_OW_False.nodes():
-                if index == 2351979103:
-                    node_size.append(20)
-                    node_colors.append('red')
-                elif index in destination_points:
-                    node_size.append(20)
-                    node_colors.append("tab:blue")
-                elif index in nodes_in_routes:
-                    node_size.append(1)
-                    node_colors.append('black')
-                else:
-                    node_colors.append('white')
-                    node_size.append(0)
-
-            for (u, v) in self.graph_OW_False.edges():
-                if (u, v) in edges_in_routes:
-                    edge_colors.append('black')
-                    edge_size.append(2)
-                elif (v, u) in edges_in_routes:
-                    edge_colors.append('black')
-                    edge_size.append(2)
-                else:
-                    edge_colors.append('white')
-                    edge_size.append(0.5)
-
+                    nodes_in_routes.add(route[i])
+                    edges_in_routes.add((route[i], route[i + 1]))
+                nodes_in_routes.add(route[-1])
 
             file_path_specific = 'OA' + str(OA) +  'LP' + str(LP) + 'RP' + str(RP) + 'OW' + str(OW) + 'HS' + str(HS) + 'TA' + str(TA) + '.png'
-            file_path = 'notebooks/case_study/visualisations/points_together/points_together' + file_path_specific
-
-            ox.plot.plot_graph(
-                self.graph_OW_False,
-                bgcolor=None,
-                node_color=node_colors,
-                node_size=node_size,
-                edge_linewidth=edge_size,
-                edge_color=edge_colors,
-                show=False, save=True, filepath=file_path
-            )
+            file_path = default_visualisation_folder + file_path_specific
+
+            job = (file_path, nodes_in_routes, edges_in_routes, highlight_nodes)
+            if self.render_jobs is not None:
+                self.render_jobs.append(job)
+            else:
+                if self.renderer is None:
+                    self.renderer = route_renderer(self.base_layer)
+                self.renderer.render(*job)
             return
 
             # calculate relative node frequency
@@ -417,60 +425,16 @@ class route_model:
         @param graph: the graph that needs to be adapted
 
         """
-        for road_id, (origin_num, destination_num, data) in enumerate(graph.edges(data=True)):
-
-            # speed limits and length
-            if isinstance(data.get('maxspeed'), list):
-                weight_used = data.get('length') / float(data.get('maxspeed')[0])
-                if float(data.get('maxspeed')[0]) > 50:
-                    weight_used = weight_used * HS
-            elif isinstance(data.get('maxspeed'), str):
-                weight_used = data.get('length') / float(data.get('maxspeed'))
-                if float(data.get('maxspeed')) > 50:
-                    weight_used = weight_used * HS
-            else:
-                # if maximum speed is not specified, max speed of 30 km/h is assumed
-                # the number of edges without maximum speed is 2402, from the total of 25348 edges (so 9.47%)
-                weight_used = data.get('length') / 30.0
-
-            # cameras
-            if "camera" in data:
-                weight_used = weight_used * CA
-
-            # obstacle avoidance
-            if "roundabout" in data:
-                weight_used = weight_used * OA
-            if "traffic_light" in data:
-                weight_used = weight_used * OA
-            if "bridge" in data:
-                weight_used = weight_used * OA
-            if "tunnel" in data:
-                weight_used = weight_used * OA
-
-            # Lane preference
-            if "lanes" in data and int(data["lanes"][0]) > 1:
-                weight_used = weight_used * LP
-
-            # residential preference
-            if data["highway"] in ['residential']:
-                weight_used = weight_used * RP
-
-            # One way
-            if data["oneway"]:
-                weight_used = weight_used * OW
-
-            # Traffic avoidance
-            if 'highway' in data:
-                if TA > 1:
-                    if data["highway"] in ['motorway', 'motorway_link', 'trunk']:
-                        weight_used = weight_used * TA * TA1
-                    elif data["highway"] in ['primary', 'primary_link', 'secondary']:
-                        weight_used = weight_used * TA * TA2
-                    elif data["highway"] in ['tertiary']:
-                        weight_used = weight_used * TA * TA3
-
-            nx.set_edge_attributes(graph,
-                                   {(origin_num, destination_num, 0): {
-                                       "used_weight": weight_used},
-                                       (origin_num, destination_num, 1): {
-                                           "used_weight": weight_used}})
+        weight_engine = self.get_weight_engine(graph)
+        weight_engine.used_weight = weight_engine.compute_weights(CA, OA, LP, RP, OW, HS, TA, TA1, TA2, TA3)
+        weight_engine.write_attribute("used_weight", weight_engine.used_weight)
+
+    def get_weight_engine(self, graph):
+        """
+        Function that returns the compiled edge attributes that belong to a graph
+        @param graph: graph_OW_False or graph_OW_True
+        @return: the weight engine of the graph
+        """
+        if graph is self.graph_OW_True:
+            return self.weight_engine_OW_True
+        return self.weight_engine_OW_False
@@ -0,0 +1,201 @@
+import multiprocessing
+
+import numpy as np
+from matplotlib import image
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+default_figure_size = 8
+default_dpi = 300
+# relative padding around the network, as ox.plot.plot_graph does, so the circles of peripheral nodes fit
+default_padding = 0.02
+
+# renderer of a worker process, filled by init_renderer
+worker_state = {}
+
+
+def base_layer(graph):
+    """
+    Function that projects the edges and nodes of a graph into the plain arrays of a base layer.
+    The edges keep their curved geometry if they have one. The base layer is small and picklable, so it can be
+    sent to worker processes instead of the graph.
+    @param graph: the osmnx graph
+    @return: dictionary with the segments and (origin, destination) of every edge, the node ids and coordinates,
+    and the extent (west, south, east, north) of the network
+    """
+    node_ids = list(graph.nodes())
+    node_xy = np.array([(data["x"], data["y"]) for node, data in graph.nodes(data=True)], dtype=np.float64)
+    node_index = {node: index for index, node in enumerate(node_ids)}
+
+    segments = []
+    edge_keys = []
+    for u, v, data in graph.edges(data=True):
+        if "geometry" in data:
+            segments.append(np.asarray(data["geometry"].coords, dtype=np.float64))
+        else:
+            segments.append(node_xy[[node_index[u], node_index[v]]])
+        edge_keys.append((u, v))
+
+    all_points = np.concatenate(segments) if segments else node_xy
+    west, south = all_points.min(axis=0)
+    east, north = all_points.max(axis=0)
+    return {"segments": segments, "edge_keys": edge_keys, "node_ids": node_ids, "node_xy": node_xy,
+            "extent": (float(west), float(south), float(east), float(north))}
+
+
+class route_renderer:
+    """
+            Class that renders route maps on top of a cached base layer.
+            The network is drawn once into an Agg canvas and its bitmap is kept, every map restores the bitmap
+            and only draws the route edges and nodes on top of it. The route edges are selected with a
+            dictionary from (origin, destination) to the edges, instead of testing every edge of the graph.
+
+            Attributes
+            ----------
+            segments: list
+                array with the coordinates of every edge
+            edge_index: dict
+                indexes of the edges per (origin, destination)
+            node_index: dict
+                index of every node id in node_xy
+            node_xy: array[float]
+                coordinates of every node
+            background: object
+                bitmap of the base layer
+    """
+
+    def __init__(self, layer, figure_size=default_figure_size, dpi=default_dpi, base_color="white",
+                 base_linewidth=0.5, bgcolor=None):
+        """
+            Init method that draws the base layer and keeps its bitmap.
+            @param layer: base layer of the graph, see base_layer
+            @param figure_size: size of the longest side of the map in inches
+            @param dpi: resolution of the map
+            @param base_color: color of the edges of the base layer
+            @param base_linewidth: width of the edges of the base layer
+            @param bgcolor: background color, None is transparent
+        """
+        self.segments = layer["segments"]
+        self.node_xy = layer["node_xy"]
+        self.node_index = {node: index for index, node in enumerate(layer["node_ids"])}
+        self.edge_index = {}
+        for index, edge in enumerate(layer["edge_keys"]):
+            self.edge_index.setdefault(edge, []).append(index)
+
+        # the limits and aspect ratio follow ox.plot.plot_graph, the figure has the shape of the map so the
+        # axes fill it, as the tight bounding box of plot_graph does
+        west, south, east, north = layer["extent"]
+        padding_ew = (east - west) * default_padding
+        padding_ns = (north - south) * default_padding
+        xlim = (west - padding_ew, east + padding_ew)
+        ylim = (south - padding_ns, north + padding_ns)
+        aspect = 1 / np.cos((south + north) / 2 / 180 * np.pi)
+        ratio = (xlim[1] - xlim[0]) / ((ylim[1] - ylim[0]) * aspect)
+        if ratio >= 1:
+            size = (figure_size, figure_size / ratio)
+        else:
+            size = (figure_size * ratio, figure_size)
+
+        self.figure = Figure(figsize=size, dpi=dpi, frameon=False)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_axes([0, 0, 1, 1])
+        self.ax.set_xlim(xlim)
+        self.ax.set_ylim(ylim)
+        self.ax.set_aspect("auto")
+        self.ax.set_axis_off()
+        self.ax.set_autoscale_on(False)
+        if bgcolor is None:
+            self.figure.patch.set_alpha(0)
+        else:
+            self.figure.patch.set_facecolor(bgcolor)
+
+        self.ax.add_collection(LineCollection(self.segments, colors=base_color, linewidths=base_linewidth,
+                                              zorder=1), autolim=False)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def render(self, file_path, route_nodes, route_edges, highlight_nodes=None, route_color="black",
+               route_linewidth=2, route_node_size=1):
+        """
+        Function that renders the routes of a scenario on the base layer and saves the map.
+        An edge is drawn as route edge if it is in route_edges in either direction.
+        @param file_path: file path of the image, the format follows the extension
+        @param route_nodes: set of the node ids in the routes
+        @param route_edges: set of the (origin, destination) pairs in the routes
+        @param highlight_nodes: dictionary with the (color, size) of nodes that are drawn on top of the routes
+        @param route_color: color of the route edges and nodes
+        @param route_linewidth: width of the route edges
+        @param route_node_size: size of the route nodes
+        """
+        if highlight_nodes is None:
+            highlight_nodes = {}
+
+        edge_indexes = set()
+        for u, v in route_edges:
+            edge_indexes.update(self.edge_index.get((u, v), ()))
+            edge_indexes.update(self.edge_index.get((v, u), ()))
+
+        nodes = [self.node_index[node] for node in route_nodes
+                 if node in self.node_index and node not in highlight_nodes]
+        highlights = [node for node in highlight_nodes if node in self.node_index]
+        highlight_xy = self.node_xy[[self.node_index[node] for node in highlights]].reshape(-1, 2)
+
+        self.canvas.restore_region(self.background)
+        artists = [
+            LineCollection([self.segments[index] for index in sorted(edge_indexes)], colors=route_color,
+                           linewidths=route_linewidth, zorder=1),
+            self.ax.scatter(self.node_xy[nodes, 0], self.node_xy[nodes, 1], s=route_node_size, c=route_color,
+                            linewidths=0, zorder=2),
+            self.ax.scatter(highlight_xy[:, 0], highlight_xy[:, 1],
+                            s=[highlight_nodes[node][1] for node in highlights],
+                            c=[highlight_nodes[node][0] for node in highlights] or route_color,
+                            linewidths=0, zorder=3)
+        ]
+        self.ax.add_collection(artists[0], autolim=False)
+        for artist in artists:
+            self.ax.draw_artist(artist)
+            artist.remove()
+
+        # the canvas is not drawn again, so the bitmap with the overlay is written directly
+        image.imsave(file_path, np.asarray(self.canvas.buffer_rgba()), pil_kwargs={"compress_level": 1})
+
+
+def init_renderer(layer, renderer_settings):
+    """
+    Function that creates the renderer of a worker process
+    @param layer: base layer of the graph, see base_layer
+    @param renderer_settings: dictionary with the init arguments of route_renderer
+    """
+    worker_state["renderer"] = route_renderer(layer, **renderer_settings)
+
+
+def render_job(job):
+    """
+    Function that renders one map in a worker process
+    @param job: tuple with the arguments of route_renderer.render
+    @return: the file path of the map
+    """
+    worker_state["renderer"].render(*job)
+    return job[0]
+
+
+def render_routes(layer, jobs, n_processes=1, **renderer_settings):
+    """
+    Function that renders a batch of maps, in worker processes if more than one process is used.
+    Every worker draws the base layer once.
+    @param layer: base layer of the graph, see base_layer
+    @param jobs: list with tuples of the arguments of route_renderer.render
+    @param n_processes: number of worker processes
+    @param renderer_settings: init arguments of route_renderer
+    @return: list with the file paths of the maps
+    """
+    if n_processes <= 1 or len(jobs) <= 1:
+        renderer = route_renderer(layer, **renderer_settings)
+        for job in jobs:
+            renderer.render(*job)
+        return [job[0] for job in jobs]
+
+    with multiprocessing.Pool(min(n_processes, len(jobs)), initializer=init_renderer,
+                              initargs=(layer, renderer_settings)) as pool:
+        return pool.map(render_job, jobs, chunksize=max(len(jobs) // (4 * n_processes), 1))
@@ -0,0 +1,237 @@
+from collections import Counter
+
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def route_incidence_matrix(routes):
+    """
+    Function that stores routes as a sparse route x node matrix with the number of times a route visits a node
+    @param routes: list of routes, every route a list of nodes
+    @return: the CSR count matrix and the node id of every column
+    """
+    lengths = np.array([len(route) for route in routes], dtype=np.int64)
+    nodes = np.fromiter((node for route in routes for node in route), dtype=np.int64, count=int(lengths.sum()))
+    node_ids, columns = np.unique(nodes, return_inverse=True)
+    rows = np.repeat(np.arange(len(routes), dtype=np.int64), lengths)
+
+    # duplicate (row, column) entries are summed, so a node visited twice by a route counts twice
+    counts = csr_matrix((np.ones(len(nodes), dtype=np.int64), (rows, columns)), shape=(len(routes), len(node_ids)))
+    counts.sum_duplicates()
+    return counts, node_ids
+
+
+def route_connectivity(routes):
+    """
+    Function that calculates for every route the number of its nodes that lie on the other routes.
+    This is the row sum of the pairwise overlap product counts x membership^T, minus the routes that are equal to
+    the route itself, which the original pairwise loop skips. The row sum is calculated as one sparse product
+    with the number of routes per node.
+    @param routes: list of routes, every route a list of nodes
+    @return: array with the connectivity count of every route
+    """
+    if len(routes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    counts, node_ids = route_incidence_matrix(routes)
+    routes_per_node = np.asarray((counts > 0).sum(axis=0)).ravel()
+    overlap = counts @ routes_per_node
+
+    # a route overlaps with every copy of itself (including itself) with its full length
+    copies = Counter(tuple(route) for route in routes)
+    equal_routes = np.array([copies[tuple(route)] * len(route) for route in routes], dtype=np.int64)
+    return overlap - equal_routes
+
+
+def route_position_frequency(routes):
+    """
+    Function that counts the routes per route position, as the node frequency loop in generate_route_network does.
+    That loop counts position i for i in range(len(route) - 1), so position i is counted by every route that is
+    longer than i + 1 nodes.
+    @param routes: list of routes, every route a list of nodes
+    @return: array with the count of every position, in increasing position order
+    """
+    lengths = np.array([len(route) - 1 for route in routes], dtype=np.int64)
+    if len(lengths) == 0 or lengths.max() <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    routes_per_length = np.bincount(lengths[lengths > 0])
+    return np.cumsum(routes_per_length[::-1])[::-1][1:]
+
+
+class running_statistic:
+    """
+            Class that accumulates the mean and variance of a stream of values with Welford's algorithm,
+            so the values themselves are not stored. Accumulators of parts of the values, for example of
+            different sources or worker processes, can be merged into the accumulator of all values.
+
+            Attributes
+            ----------
+            count: int
+                number of values
+            mean: float
+                mean of the values
+            m2: float
+                sum of the squared deviations from the mean
+    """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        """
+            Init method that creates an accumulator, empty by default.
+            @param count: number of values
+            @param mean: mean of the values
+            @param m2: sum of the squared deviations from the mean
+        """
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        """
+        Function that adds a single value
+        @param value: the value
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def add_values(self, values):
+        """
+        Function that adds an array of values at once
+        @param values: array with the values
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        mean = float(values.mean())
+        self.merge(running_statistic(len(values), mean, float(((values - mean) ** 2).sum())))
+
+    def merge(self, other):
+        """
+        Function that adds the values of another accumulator, with the parallel update of Chan et al.
+        @param other: the other accumulator
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    def variance(self):
+        """
+        Function that returns the population variance of the values
+        @return: the variance
+        """
+        return self.m2 / self.count
+
+
+class route_network:
+    """
+            Class that collects the union of the routes of a scenario as an undirected network of the nodes
+            and road segments that are used by at least one route. The edges are added per group of routes
+            as deduplicated arrays, and networks of different sources or worker processes can be merged.
+
+            Attributes
+            ----------
+            edge_arrays: list[array]
+                arrays with one row per edge, with the smallest node id first
+    """
+
+    # number of edge arrays after which they are deduplicated into one array
+    max_edge_arrays = 64
+
+    def __init__(self):
+        """
+            Init method that creates an empty network.
+        """
+        self.edge_arrays = []
+
+    def add_routes(self, routes):
+        """
+        Function that adds the edges between the consecutive nodes of routes
+        @param routes: list of routes, every route a list of nodes
+        """
+        routes = [route for route in routes if len(route) > 1]
+        if not routes:
+            return
+
+        origins = np.fromiter((node for route in routes for node in route[:-1]), dtype=np.int64)
+        destinations = np.fromiter((node for route in routes for node in route[1:]), dtype=np.int64)
+        edges = np.column_stack([np.minimum(origins, destinations), np.maximum(origins, destinations)])
+        self.add_edges(np.unique(edges, axis=0))
+
+    def add_edges(self, edges):
+        """
+        Function that adds an array of edges
+        @param edges: array with one row per edge, with the smallest node id first
+        """
+        self.edge_arrays.append(edges)
+        if len(self.edge_arrays) > self.max_edge_arrays:
+            self.edge_arrays = [self.edges()]
+
+    def merge(self, other):
+        """
+        Function that adds the edges of another network
+        @param other: the other network
+        """
+        for edges in other.edge_arrays:
+            self.add_edges(edges)
+
+    def edges(self):
+        """
+        Function that returns the edges of the network
+        @return: array with one row per edge, with the smallest node id first
+        """
+        if not self.edge_arrays:
+            return np.zeros((0, 2), dtype=np.int64)
+        return np.unique(np.concatenate(self.edge_arrays), axis=0)
+
+    def statistics(self, betweenness_pivots=None, seed=None):
+        """
+        Function that calculates the size and centrality statistics of the network.
+        The degree centrality is exact and calculated from the edge counts. The betweenness centrality is
+        estimated from shortest paths from a sample of pivot nodes, or exact if no pivot count is given.
+        Both centralities are normalised as in networkx. A network without routes has no nodes, its centrality
+        means and variances are 0.
+        @param betweenness_pivots: number of pivot nodes for the betweenness centrality, None for all nodes
+        @param seed: seed of the sample of pivot nodes
+        @return: dictionary with the number of nodes and edges and the mean and variance of the centralities
+        """
+        edges = self.edges()
+        if len(edges) == 0:
+            return {
+                "num_of_nodes": 0,
+                "num_of_edges": 0,
+                "degree_centrality_mean": 0.0,
+                "degree_centrality_var": 0.0,
+                "betweenness_centrality_mean": 0.0,
+                "betweenness_centrality_var": 0.0
+            }
+
+        node_ids, endpoints = np.unique(edges, return_inverse=True)
+        endpoints = endpoints.reshape(-1, 2)
+        num_of_nodes = len(node_ids)
+
+        degree = np.bincount(endpoints.ravel(), minlength=num_of_nodes)
+        degree_centrality = degree / max(num_of_nodes - 1, 1)
+
+        network = nx.Graph()
+        network.add_nodes_from(range(num_of_nodes))
+        network.add_edges_from(endpoints.tolist())
+        if betweenness_pivots is not None and betweenness_pivots >= num_of_nodes:
+            betweenness_pivots = None
+        betweenness = nx.betweenness_centrality(network, k=betweenness_pivots, seed=seed)
+        betweenness_centrality = np.fromiter(betweenness.values(), dtype=np.float64, count=num_of_nodes)
+
+        return {
+            "num_of_nodes": num_of_nodes,
+            "num_of_edges": len(edges),
+            "degree_centrality_mean": float(degree_centrality.mean()),
+            "degree_centrality_var": float(degree_centrality.var()),
+            "betweenness_centrality_mean": float(betweenness_centrality.mean()),
+            "betweenness_centrality_var": float(betweenness_centrality.var())
+        }
@@ -1,3 +1,5 @@
+import os
+
 import route_model_vis
 
 from ema_workbench import Model, RealParameter, ScalarOutcome, BooleanParameter, Samplers
@@ -18,13 +20,16 @@ if __name__ == "__main__":
 
     route_model_instance = route_model_vis.route_model()
 
+    # the routes are calculated one by one, the maps are rendered in parallel on the cached base layer
+    scenarios = []
     for OA in [1, 5]:
         for LP in [0.1, 1]:
             for RP in [0.1, 1]:
                 for OW in [1, 5]:
                     for HS in [0.1, 1]:
                         for TA in [1, 5]:
-                            route_model_instance.run_model(OA=OA, LP=LP, RP=RP, OW=OW, HS=HS, TA=TA)
+                            scenarios.append(dict(OA=OA, LP=LP, RP=RP, OW=OW, HS=HS, TA=TA))
+    route_model_instance.run_models(scenarios, n_processes=os.cpu_count())
 
     # print(route_model_instance.run_model(rational=False, seed=1000, strategy_change_percentage=0.1))
     #
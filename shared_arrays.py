@@ -0,0 +1,55 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def share_arrays(arrays):
+    """
+    Function that copies numpy arrays into shared memory blocks
+    @param arrays: dictionary with the name and array of every array to share
+    @return: the descriptor with the block name, shape and dtype of every array, which is cheap to pickle,
+    the arrays in shared memory and the shared memory blocks
+    """
+    descriptor = {}
+    shared = {}
+    blocks = []
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        shared[name] = np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)
+        shared[name][...] = values
+        descriptor[name] = (block.name, values.shape, values.dtype.str)
+        blocks.append(block)
+    return descriptor, shared, blocks
+
+
+def attach_arrays(descriptor):
+    """
+    Function that attaches to arrays that another process shared with share_arrays
+    @param descriptor: the descriptor returned by share_arrays
+    @return: dictionary with the name and array of every shared array and the shared memory blocks
+    """
+    arrays = {}
+    blocks = []
+    for name, (block_name, shape, dtype) in descriptor.items():
+        try:
+            block = shared_memory.SharedMemory(name=block_name, track=False)
+        except TypeError:
+            # before python 3.13 attaching registers the block again, child processes share the resource
+            # tracker of the owner, so the block is still removed only once
+            block = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        blocks.append(block)
+    return arrays, blocks
+
+
+def release_blocks(blocks, unlink=False):
+    """
+    Function that closes shared memory blocks, the arrays on the blocks can not be used afterwards
+    @param blocks: list of shared memory blocks
+    @param unlink: Boolean indicating if the blocks are removed, only done by the process that created them
+    """
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
@@ -0,0 +1,115 @@
+import numpy as np
+import shapely
+from scipy.spatial import cKDTree
+
+
+class node_spatial_index:
+    """
+            Class that contains a KD-tree over the coordinates of the nodes of a graph, to snap points to the
+            closest node. Distances are euclidean in the x and y coordinates of the graph, the same as
+            math.dist in the original snapping loop.
+
+            Attributes
+            ----------
+            node_ids: array
+                node id of every point in the tree
+            coordinates: array[float]
+                x and y coordinate of every node
+            tree: object
+                KD-tree over the coordinates
+    """
+
+    def __init__(self, graph=None, node_ids=None, x=None, y=None):
+        """
+            Init method that builds the KD-tree over the node coordinates, of the nodes of a graph or of the given
+            node arrays.
+            @param graph: graph with x and y attributes on the nodes
+            @param node_ids: array with the node ids, used without a graph
+            @param x: array with the x coordinate of every node, used without a graph
+            @param y: array with the y coordinate of every node, used without a graph
+        """
+        if graph is not None:
+            node_ids = []
+            coordinates = []
+            for node, data in graph.nodes(data=True):
+                node_ids.append(node)
+                coordinates.append((data.get("x"), data.get("y")))
+            self.coordinates = np.array(coordinates, dtype=np.float64).reshape(-1, 2)
+        else:
+            self.coordinates = np.column_stack([np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)])
+
+        self.node_ids = np.asarray(node_ids)
+        self.tree = cKDTree(self.coordinates)
+
+    def nearest_nodes(self, x, y):
+        """
+        Function that returns the closest node of every point
+        @param x: array with the x coordinates of the points
+        @param y: array with the y coordinates of the points
+        @return: list with the closest node id of every point
+        """
+        points = np.column_stack([np.atleast_1d(np.asarray(x, dtype=np.float64)),
+                                  np.atleast_1d(np.asarray(y, dtype=np.float64))])
+        distances, indexes = self.tree.query(points)
+        return self.node_ids[indexes].tolist()
+
+    def nearest_node(self, x, y):
+        """
+        Function that returns the closest node of a single point
+        @param x: x coordinate of the point
+        @param y: y coordinate of the point
+        @return: node id of the closest node
+        """
+        return self.nearest_nodes([x], [y])[0]
+
+
+class edge_spatial_index:
+    """
+            Class that contains an STR-tree over the straight segments between the end nodes of the edges of a
+            graph, to snap points to the closest edge. Every (origin, destination) pair is one segment, parallel
+            edges share it. Distances are euclidean in the x and y coordinates of the graph.
+
+            Attributes
+            ----------
+            edges: list[tuple]
+                (origin, destination) of every segment in the tree
+            tree: object
+                STR-tree over the segments
+    """
+
+    def __init__(self, graph, highways=None):
+        """
+            Init method that builds the STR-tree over the edge segments.
+            @param graph: graph with x and y attributes on the nodes
+            @param highways: optional list of road types, only edges of which the first parallel edge has one
+            of these types are indexed
+        """
+        self.edges = []
+        coordinates = []
+        for u, v in dict.fromkeys(graph.edges()):
+            parallel_edges = graph[u][v]
+            data = parallel_edges[0] if 0 in parallel_edges else next(iter(parallel_edges.values()))
+            if highways is not None and data.get("highway") not in highways:
+                continue
+            self.edges.append((u, v))
+            coordinates.append((graph.nodes[u]["x"], graph.nodes[u]["y"], graph.nodes[v]["x"], graph.nodes[v]["y"]))
+
+        segments = np.array(coordinates, dtype=np.float64).reshape(-1, 2, 2)
+        self.tree = shapely.STRtree(shapely.linestrings(segments))
+
+    def nearest_edges(self, x, y, max_distance=None):
+        """
+        Function that returns the closest edge of every point
+        @param x: array with the x coordinates of the points
+        @param y: array with the y coordinates of the points
+        @param max_distance: optional maximum distance in the coordinates of the graph, points without an edge
+        within this distance get None
+        @return: list with the (origin, destination) of the closest edge of every point
+        """
+        points = shapely.points(np.atleast_1d(np.asarray(x, dtype=np.float64)),
+                                np.atleast_1d(np.asarray(y, dtype=np.float64)))
+        point_indexes, edge_indexes = self.tree.query_nearest(points, max_distance=max_distance, all_matches=False)
+        nearest = [None] * len(points)
+        for point_index, edge_index in zip(point_indexes.tolist(), edge_indexes.tolist()):
+            nearest[point_index] = self.edges[edge_index]
+        return nearest
@@ -0,0 +1,263 @@
+"""
+Synthetic road graphs for scaling experiments
+
+The generator builds an osmnx compatible MultiDiGraph on a jittered grid of intersections, with a road hierarchy
+of motorways, trunks, primary and secondary roads on every few grid lines and local streets in between.
+The edge attributes follow the distributions of an urban OpenStreetMap graph, and a matching neighbourhood map
+is written as GeoJSON, so the route model can run on graphs of any size.
+
+    $ python synthetic_graph.py --edges 250000 --graph graph/synthetic.graphml \\
+        --neighbourhoods graph/synthetic_neighbourhoods.geojson
+"""
+
+import argparse
+import os
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import shapely
+
+# the number of edges of the Rotterdam graph, the sizes of the scaling experiments are multiples of it
+base_case_num_of_edges = 25348
+# centre of the synthetic graphs, the centre of Rotterdam
+default_center = (4.4777, 51.9225)
+# distance between neighbouring intersections in metres
+default_block_length = 150.0
+default_num_of_neighbourhoods = 10
+metres_per_degree = 111320.0
+# directed edges per grid node after removing segments and restricting to the strongly connected component
+edges_per_grid_node = 3.4
+
+# road class of a grid line by the largest spacing that divides its index, the other lines are local streets
+line_classes = [(32, "motorway"), (16, "trunk"), (8, "primary"), (4, "secondary")]
+local_classes = {"residential": 0.7, "tertiary": 0.12, "unclassified": 0.1, "living_street": 0.08}
+# share of the local street segments that is left out, so the blocks are not all of the same size
+removed_local_share = 0.1
+
+# maxspeed values per road class with their probability, and the share of edges without maxspeed
+maxspeeds = {
+    "motorway": {"100": 0.5, "80": 0.3, "130": 0.2},
+    "trunk": {"80": 0.6, "70": 0.2, "50": 0.2},
+    "primary": {"50": 0.8, "70": 0.2},
+    "secondary": {"50": 0.9, "30": 0.1},
+    "tertiary": {"50": 0.6, "30": 0.4},
+    "residential": {"30": 0.85, "50": 0.1, "15": 0.05},
+    "unclassified": {"30": 0.5, "50": 0.3, "60": 0.2},
+    "living_street": {"15": 1.0}
+}
+missing_maxspeed_share = {"motorway": 0.02, "trunk": 0.03, "primary": 0.03, "secondary": 0.05, "tertiary": 0.08,
+                          "residential": 0.11, "unclassified": 0.2, "living_street": 0.3}
+# lanes values per road class with their probability, the remaining share of edges has no lanes attribute
+lanes = {
+    "motorway": {"2": 0.5, "3": 0.4, "4": 0.1},
+    "trunk": {"2": 0.7, "3": 0.2},
+    "primary": {"2": 0.6, "1": 0.3},
+    "secondary": {"1": 0.5, "2": 0.4},
+    "tertiary": {"1": 0.6, "2": 0.1},
+    "residential": {"1": 0.15},
+    "unclassified": {"1": 0.2},
+    "living_street": {}
+}
+# share of the segments that is one way, motorways and trunks are always dual carriageways
+oneway_share = {"motorway": 1.0, "trunk": 1.0, "primary": 0.2, "secondary": 0.15, "tertiary": 0.1,
+                "residential": 0.15, "unclassified": 0.05, "living_street": 0.1}
+# share of the edges with an obstacle or camera flag per road class
+flag_shares = {
+    "camera": {"motorway": 0.03, "trunk": 0.03, "primary": 0.02, "secondary": 0.01},
+    "traffic_light": {"trunk": 0.05, "primary": 0.08, "secondary": 0.06, "tertiary": 0.03, "residential": 0.005},
+    "bridge": {"motorway": 0.04, "trunk": 0.03, "primary": 0.02, "secondary": 0.02, "tertiary": 0.01,
+               "residential": 0.01, "unclassified": 0.01},
+    "roundabout": {"primary": 0.01, "secondary": 0.02, "tertiary": 0.02, "residential": 0.005},
+    "tunnel": {"motorway": 0.02, "trunk": 0.01, "primary": 0.002}
+}
+
+
+def line_class(index):
+    """
+    Function that returns the road class of a grid line
+    @param index: index of the grid line
+    @return: the road class, or None for a line of local streets
+    """
+    for spacing, highway in line_classes:
+        if index % spacing == 0:
+            return highway
+    return None
+
+
+def draw_values(rng, distribution, number):
+    """
+    Function that draws values from a distribution, the probability that is missing is drawn as None
+    @param rng: numpy random generator
+    @param distribution: dictionary with the values and their probability
+    @param number: number of values
+    @return: list with the values
+    """
+    values = list(distribution) + [None]
+    probabilities = list(distribution.values())
+    probabilities.append(max(1.0 - sum(probabilities), 0.0))
+    indices = rng.choice(len(values), size=number, p=np.array(probabilities) / sum(probabilities))
+    return [values[index] for index in indices]
+
+
+def grid_size(num_of_edges):
+    """
+    Function that returns the number of grid nodes along each side for a graph of about the given number of edges
+    @param num_of_edges: the number of directed edges
+    @return: number of nodes along each side of the grid
+    """
+    return max(int(np.ceil(np.sqrt(num_of_edges / edges_per_grid_node))), 2)
+
+
+def synthetic_road_graph(num_of_edges=base_case_num_of_edges, center=default_center,
+                         block_length=default_block_length, seed=0):
+    """
+    Function that generates a synthetic road graph with the attributes of an osmnx graph.
+    Only the largest strongly connected component is kept, so a route exists between every pair of nodes.
+    @param num_of_edges: approximate number of directed edges
+    @param center: (longitude, latitude) of the centre of the graph
+    @param block_length: distance between neighbouring intersections in metres
+    @param seed: seed of the random layout and attributes
+    @return: the graph
+    """
+    rng = np.random.default_rng(seed)
+    size = grid_size(num_of_edges)
+
+    # grid positions in metres with some jitter, converted to degrees around the centre
+    metres_per_lon = metres_per_degree * np.cos(np.radians(center[1]))
+    rows, columns = np.divmod(np.arange(size * size), size)
+    jitter = rng.uniform(-0.25, 0.25, size=(2, size * size)) * block_length
+    x_metres = (columns - (size - 1) / 2) * block_length + jitter[0]
+    y_metres = (rows - (size - 1) / 2) * block_length + jitter[1]
+    lon = center[0] + x_metres / metres_per_lon
+    lat = center[1] + y_metres / metres_per_degree
+
+    graph = nx.MultiDiGraph(crs="epsg:4326", created_with="synthetic_graph")
+    graph.add_nodes_from((node + 1, {"x": float(lon[node]), "y": float(lat[node])}) for node in range(size * size))
+
+    # segments between horizontal and vertical neighbours, with the road class of their grid line
+    origins = []
+    destinations = []
+    highways = []
+    for line in range(size):
+        highway = line_class(line)
+        steps = np.arange(size - 1)
+        for start, step in [(line * size + steps, 1), (steps * size + line, size)]:
+            if highway is None:
+                kept = rng.random(size - 1) >= removed_local_share
+                start = start[kept]
+                highways.extend(draw_values(rng, local_classes, len(start)))
+            else:
+                highways.extend([highway] * len(start))
+            origins.append(start)
+            destinations.append(start + step)
+    origins = np.concatenate(origins)
+    destinations = np.concatenate(destinations)
+    highways = np.array(highways, dtype=object)
+    num_of_segments = len(origins)
+
+    # straight distance with a small detour for the curvature of the road
+    distances = np.hypot(x_metres[destinations] - x_metres[origins], y_metres[destinations] - y_metres[origins])
+    lengths = np.round(distances * rng.uniform(1.0, 1.15, size=num_of_segments), 3)
+
+    segment_maxspeeds = np.empty(num_of_segments, dtype=object)
+    segment_lanes = np.empty(num_of_segments, dtype=object)
+    oneway = np.zeros(num_of_segments, dtype=bool)
+    flags = {flag: np.zeros(num_of_segments, dtype=bool) for flag in flag_shares}
+    for highway in maxspeeds:
+        index = np.flatnonzero(highways == highway)
+        speeds = draw_values(rng, maxspeeds[highway], len(index))
+        missing = rng.random(len(index)) < missing_maxspeed_share[highway]
+        segment_maxspeeds[index] = [None if gap else speed for speed, gap in zip(speeds, missing)]
+        segment_lanes[index] = draw_values(rng, lanes[highway], len(index))
+        oneway[index] = rng.random(len(index)) < oneway_share[highway]
+        for flag, shares in flag_shares.items():
+            flags[flag][index] = rng.random(len(index)) < shares.get(highway, 0.0)
+
+    # one way segments get a random direction, dual carriageways and two way segments get an edge in each direction
+    dual_carriageway = np.isin(highways, ["motorway", "trunk"])
+    reverse = oneway & ~dual_carriageway & (rng.random(num_of_segments) < 0.5)
+    origins, destinations = np.where(reverse, destinations, origins), np.where(reverse, origins, destinations)
+
+    edges = []
+    for segment in range(num_of_segments):
+        data = {"osmid": segment + 1, "highway": highways[segment], "oneway": bool(oneway[segment]),
+                "reversed": False, "length": float(lengths[segment])}
+        if segment_maxspeeds[segment] is not None:
+            data["maxspeed"] = segment_maxspeeds[segment]
+        if segment_lanes[segment] is not None:
+            data["lanes"] = segment_lanes[segment]
+        for flag, values in flags.items():
+            if values[segment]:
+                data[flag] = True
+        origin = int(origins[segment]) + 1
+        destination = int(destinations[segment]) + 1
+        edges.append((origin, destination, data))
+        if not oneway[segment] or dual_carriageway[segment]:
+            edges.append((destination, origin, dict(data, reversed=not oneway[segment])))
+    graph.add_edges_from(edges)
+
+    graph = ox.truncate.largest_component(graph, strongly=True)
+    graph.remove_nodes_from([node for node, degree in graph.degree() if degree == 0])
+    nx.set_node_attributes(graph, dict(ox.stats.count_streets_per_node(graph)), name="street_count")
+    return graph
+
+
+def synthetic_neighbourhood_map(graph, num_of_neighbourhoods=default_num_of_neighbourhoods, seed=0):
+    """
+    Function that divides the area of a graph into neighbourhoods, the Voronoi cells of random centres
+    @param graph: the road graph
+    @param num_of_neighbourhoods: number of neighbourhoods
+    @param seed: seed of the neighbourhood centres
+    @return: GeoDataFrame with the neighbourhood polygons
+    """
+    rng = np.random.default_rng(seed)
+    lon = np.array([data["x"] for node, data in graph.nodes(data=True)])
+    lat = np.array([data["y"] for node, data in graph.nodes(data=True)])
+    area = shapely.box(lon.min(), lat.min(), lon.max(), lat.max())
+
+    centres = shapely.points(rng.uniform(lon.min(), lon.max(), num_of_neighbourhoods),
+                             rng.uniform(lat.min(), lat.max(), num_of_neighbourhoods))
+    cells = shapely.voronoi_polygons(shapely.multipoints(centres), extend_to=area)
+    polygons = [cell.intersection(area) for cell in shapely.get_parts(cells)]
+
+    return gpd.GeoDataFrame({"id": [f"synthetic/{index + 1}" for index in range(len(polygons))],
+                             "name": [f"Neighbourhood {index + 1}" for index in range(len(polygons))],
+                             "boundary": "administrative", "place": "suburb"},
+                            geometry=polygons, crs="EPSG:4326")
+
+
+def write_synthetic_graph(graph_file_path, neighbourhood_map_file_path, num_of_edges=base_case_num_of_edges,
+                          num_of_neighbourhoods=default_num_of_neighbourhoods, seed=0):
+    """
+    Function that writes a synthetic road graph as GraphML and its neighbourhood map as GeoJSON
+    @param graph_file_path: path of the GraphML file
+    @param neighbourhood_map_file_path: path of the GeoJSON file
+    @param num_of_edges: approximate number of directed edges
+    @param num_of_neighbourhoods: number of neighbourhoods
+    @param seed: seed of the graph and the neighbourhoods
+    @return: the graph
+    """
+    graph = synthetic_road_graph(num_of_edges, seed=seed)
+    for file_path in [graph_file_path, neighbourhood_map_file_path]:
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    ox.save_graphml(graph, graph_file_path)
+    synthetic_neighbourhood_map(graph, num_of_neighbourhoods, seed).to_file(neighbourhood_map_file_path,
+                                                                           driver="GeoJSON")
+    return graph
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic road graph and its neighbourhood map")
+    parser.add_argument("--edges", type=int, default=base_case_num_of_edges,
+                        help="approximate number of directed edges")
+    parser.add_argument("--graph", required=True, help="GraphML file of the graph")
+    parser.add_argument("--neighbourhoods", required=True, help="GeoJSON file of the neighbourhood map")
+    parser.add_argument("--num-of-neighbourhoods", type=int, default=default_num_of_neighbourhoods)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    synthetic = write_synthetic_graph(arguments.graph, arguments.neighbourhoods, arguments.edges,
+                                      arguments.num_of_neighbourhoods, arguments.seed)
+    print(f"{synthetic.number_of_nodes()} nodes and {synthetic.number_of_edges()} edges")
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import networkx as nx
+import numpy as np
+import pytest
+
+# the modules of the model are in the root folder of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiled_graph import compiled_graph  # noqa: E402
+from synthetic_graph import write_synthetic_graph  # noqa: E402
+
+
+@pytest.fixture
+def make_graph():
+    """
+    Fixture that returns a function that builds a small road graph in the format of osmnx
+    @return: function that builds the graph from the node positions and the roads
+    """
+    def make(positions, roads, one_way_roads=()):
+        """
+        Function that builds a MultiDiGraph with a length on every edge
+        @param positions: dictionary with the (column, row) of every node, a column and row are about 100 meters
+        @param roads: list with the (origin, destination, length) of the roads in both directions
+        @param one_way_roads: list with the (origin, destination, length) of the one way roads
+        @return: the graph
+        """
+        graph = nx.MultiDiGraph(crs="epsg:4326")
+        for node, (column, row) in positions.items():
+            graph.add_node(node, x=4.0 + 0.0015 * column, y=52.0 + 0.0009 * row)
+        for origin, destination, length in roads:
+            graph.add_edge(origin, destination, length=float(length))
+            graph.add_edge(destination, origin, length=float(length))
+        for origin, destination, length in one_way_roads:
+            graph.add_edge(origin, destination, length=float(length))
+        return graph
+    return make
+
+
+@pytest.fixture
+def make_compiled_graph():
+    """
+    Fixture that returns a function that compiles a graph with its lengths as weight
+    @return: function that compiles the graph
+    """
+    def make(graph, weight="length"):
+        edge_keys = list(graph.edges(keys=True))
+        compiled = compiled_graph(graph, edge_keys)
+        compiled.set_weights(weight, np.array([graph.edges[edge][weight] for edge in edge_keys]))
+        return compiled
+    return make
+
+
+@pytest.fixture
+def grid_graph(make_graph):
+    """
+    Fixture with a grid of 3 by 4 nodes with roads of equal length, so many paths have the same cost,
+    a parallel road and a one way road
+    @return: the graph
+    """
+    positions = {row * 4 + column + 1: (column, row) for row in range(3) for column in range(4)}
+    roads = [(node, node + 1, 100) for node in positions if positions[node][0] < 3] + \
+            [(node, node + 4, 100) for node in positions if positions[node][1] < 2]
+    # a longer parallel road, routing uses the shortest edge between two nodes
+    roads.append((6, 7, 150))
+    return make_graph(positions, roads, one_way_roads=[(1, 6, 140)])
+
+
+@pytest.fixture(scope="session")
+def synthetic_files(tmp_path_factory):
+    """
+    Fixture that writes a small synthetic road graph and its neighbourhood map for the route model
+    @return: dictionary with the graph_file_path and neighbourhood_map_file_path init arguments of the route model
+    """
+    folder = tmp_path_factory.mktemp("synthetic")
+    files = {"graph_file_path": str(folder / "graph.graphml"),
+             "neighbourhood_map_file_path": str(folder / "neighbourhoods.geojson")}
+    write_synthetic_graph(files["graph_file_path"], files["neighbourhood_map_file_path"], num_of_edges=1500,
+                          num_of_neighbourhoods=6)
+    return files
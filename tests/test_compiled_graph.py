@@ -0,0 +1,169 @@
+import random
+
+import numpy as np
+import osmnx as ox
+import pytest
+
+
+def path_cost(graph, path, weight="length"):
+    """
+    Function that returns the cost of a path, using the shortest edge between two nodes
+    @param graph: the graph
+    @param path: list of node ids
+    @param weight: name of the weight
+    @return: the cost of the path
+    """
+    return sum(min(data[weight] for data in graph[u][v].values()) for u, v in zip(path, path[1:]))
+
+
+def od_pairs(graph):
+    return [(orig, dest) for orig in graph.nodes for dest in graph.nodes if orig != dest]
+
+
+def test_k_shortest_paths_costs_match_osmnx_with_ties(grid_graph, make_compiled_graph):
+    compiled = make_compiled_graph(grid_graph)
+    for orig, dest in od_pairs(grid_graph):
+        expected = list(ox.distance.k_shortest_paths(grid_graph, orig, dest, 5, weight="length"))
+        paths = list(compiled.k_shortest_paths(orig, dest, 5, weight="length"))
+        assert [path_cost(grid_graph, path) for path in paths] == \
+            pytest.approx([path_cost(grid_graph, path) for path in expected])
+
+
+def test_all_simple_paths_match_osmnx_with_ties(grid_graph, make_compiled_graph):
+    # between paths of equal cost another path can be chosen, but all loopless paths are found in the same order
+    compiled = make_compiled_graph(grid_graph)
+    for orig, dest in [(1, 12), (12, 1), (6, 7), (5, 8)]:
+        expected = list(ox.distance.k_shortest_paths(grid_graph, orig, dest, 1000, weight="length"))
+        paths = list(compiled.k_shortest_paths(orig, dest, 1000, weight="length"))
+        assert sorted(map(tuple, paths)) == sorted(map(tuple, expected))
+        assert [path_cost(grid_graph, path) for path in paths] == \
+            pytest.approx([path_cost(grid_graph, path) for path in expected])
+
+
+def test_k_shortest_paths_match_osmnx_without_ties(grid_graph, make_compiled_graph):
+    # without paths of equal cost the node sequences are the same
+    random.seed(1)
+    for u, v, key, data in grid_graph.edges(keys=True, data=True):
+        data["length"] = random.uniform(50, 150)
+    compiled = make_compiled_graph(grid_graph)
+    for orig, dest in od_pairs(grid_graph):
+        expected = list(ox.distance.k_shortest_paths(grid_graph, orig, dest, 5, weight="length"))
+        assert list(compiled.k_shortest_paths(orig, dest, 5, weight="length")) == expected
+
+
+def test_compiled_graph_from_arrays_routes_the_same(grid_graph, make_compiled_graph):
+    compiled = make_compiled_graph(grid_graph)
+    loaded = type(compiled)(arrays=compiled.to_arrays())
+    loaded.set_weights("length", [grid_graph.edges[edge]["length"] for edge in grid_graph.edges(keys=True)])
+    for orig, dest in [(1, 12), (9, 4)]:
+        assert list(loaded.k_shortest_paths(orig, dest, 5, weight="length")) == \
+            list(compiled.k_shortest_paths(orig, dest, 5, weight="length"))
+    assert 6 in loaded.node_index and 13 not in loaded.node_index
+
+
+def k_shortest_path_costs(compiled, graph, orig, dest, k, **options):
+    return [path_cost(graph, path) for path in compiled.k_shortest_paths(orig, dest, k, weight="length", **options)]
+
+
+def test_goal_directed_paths_match_dijkstra_with_ties(grid_graph, make_compiled_graph):
+    compiled = make_compiled_graph(grid_graph)
+    for orig, dest in od_pairs(grid_graph):
+        assert k_shortest_path_costs(compiled, grid_graph, orig, dest, 5, goal_directed=True) == \
+            pytest.approx(k_shortest_path_costs(compiled, grid_graph, orig, dest, 5))
+
+        paths = list(compiled.k_shortest_paths(orig, dest, 1000, weight="length", goal_directed=True))
+        expected = list(compiled.k_shortest_paths(orig, dest, 1000, weight="length"))
+        assert sorted(map(tuple, paths)) == sorted(map(tuple, expected))
+
+
+def test_goal_directed_paths_match_dijkstra_after_weight_update(grid_graph, make_compiled_graph):
+    # edges far below the straight line distance lower the bound factor, the bound must stay a lower bound
+    random.seed(2)
+    compiled = make_compiled_graph(grid_graph)
+    list(compiled.k_shortest_paths(1, 12, 5, weight="length", goal_directed=True))
+
+    edge_keys = list(grid_graph.edges(keys=True))
+    changed_edges = sorted(random.sample(range(len(edge_keys)), 6))
+    for index in changed_edges:
+        grid_graph.edges[edge_keys[index]]["length"] = 5.0
+    compiled.set_weights("length", np.array([grid_graph.edges[edge]["length"] for edge in edge_keys]),
+                         np.array(changed_edges))
+
+    for orig, dest in od_pairs(grid_graph):
+        assert k_shortest_path_costs(compiled, grid_graph, orig, dest, 5, goal_directed=True) == \
+            pytest.approx(k_shortest_path_costs(compiled, grid_graph, orig, dest, 5))
+
+
+def test_goal_directed_search_settles_fewer_nodes(make_graph, make_compiled_graph):
+    random.seed(3)
+    positions = {row * 10 + column: (column, row) for row in range(10) for column in range(10)}
+    roads = [(node, node + 1, random.uniform(100, 130)) for node in positions if positions[node][0] < 9] + \
+            [(node, node + 10, random.uniform(100, 130)) for node in positions if positions[node][1] < 9]
+    graph = make_graph(positions, roads)
+    compiled = make_compiled_graph(graph)
+
+    paths = {}
+    expansions = {}
+    for goal_directed in [False, True]:
+        compiled.expansions = 0
+        paths[goal_directed] = list(compiled.k_shortest_paths(0, 55, 5, weight="length", goal_directed=goal_directed))
+        expansions[goal_directed] = compiled.expansions
+
+    # without ties the same paths are found
+    assert paths[True] == paths[False]
+    assert expansions[True] < expansions[False]
+
+
+def tight_arcs(compiled, tree, reverse=False, weight="length"):
+    """
+    Function that returns the arcs that give a node of a shortest path tree its distance, which are the arcs of
+    the tree and with ties the arcs of other shortest paths
+    @param compiled: the compiled graph
+    @param tree: distances and parents of the tree
+    @param reverse: True for a reverse tree, which relaxes the arcs from their destination to their origin
+    @param weight: name of the weight
+    @return: set with the arc indexes
+    """
+    distances = np.array(tree[0])
+    start, end = (compiled.targets, compiled.arc_origins) if reverse else (compiled.arc_origins, compiled.targets)
+    return set(np.flatnonzero(distances[start] + compiled.weights[weight] <= distances[end]).tolist())
+
+
+@pytest.mark.parametrize("ties", [False, True])
+def test_update_arc_weights_keeps_correct_trees(make_graph, make_compiled_graph, ties):
+    random.seed(9)
+    positions = {row * 6 + column: (column, row) for row in range(6) for column in range(6)}
+    # with lengths of 100 or 130 many paths have the same cost
+    lengths = (lambda: random.choice([100, 100, 130])) if ties else (lambda: random.uniform(100, 130))
+    roads = [(node, node + 1, lengths()) for node in positions if positions[node][0] < 5] + \
+            [(node, node + 6, lengths()) for node in positions if positions[node][1] < 5]
+    compiled = make_compiled_graph(make_graph(positions, roads, one_way_roads=[(0, 35, 2000)]))
+    roots = [(root, reverse) for root in random.sample(range(compiled.num_of_nodes), 3) for reverse in [False, True]]
+    num_of_kept_trees = 0
+
+    for update in range(12):
+        trees = {(root, reverse): compiled.shortest_path_tree(root, "length", reverse) for root, reverse in roots}
+        arcs_on_trees = sorted(set.union(*(tight_arcs(compiled, tree, root[1]) for root, tree in trees.items())))
+        arcs_off_trees = sorted(set(range(compiled.num_of_arcs)) - set(arcs_on_trees))
+
+        # arcs on and off the shortest paths of the trees become longer or shorter, in the first updates only
+        # arcs off these paths become longer and every tree is kept
+        arc_values = compiled.weights["length"].copy()
+        changed_arcs = random.sample(arcs_off_trees, 3)
+        if update < 2:
+            arc_values[changed_arcs] *= random.uniform(1.1, 1.5)
+        else:
+            changed_arcs += random.sample(arcs_on_trees, 3)
+            arc_values[changed_arcs] *= np.array([random.uniform(0.3, 1.7) for _ in changed_arcs])
+        compiled.update_arc_weights("length", arc_values, np.array(sorted(changed_arcs)))
+        if update < 2:
+            assert len(compiled.trees["length"]) == len(roots)
+        num_of_kept_trees += len(compiled.trees["length"])
+
+        fresh = type(compiled)(arrays=compiled.to_arrays())
+        fresh.set_arc_weights("length", arc_values)
+        for root, reverse in roots:
+            assert compiled.shortest_path_tree(root, "length", reverse) == \
+                fresh.shortest_path_tree(root, "length", reverse)
+
+    assert num_of_kept_trees > 2 * len(roots)
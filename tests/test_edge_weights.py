@@ -0,0 +1,200 @@
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import pytest
+
+import route_model
+from edge_weights import edge_weight_engine, undirected_weight_engine, weight_cache
+from graph_cache import snapshot_edge_attributes
+
+scenarios = [dict(CA=1, OA=1, LP=1, RP=1, OW=1, HS=1, TA=1, TA1=2, TA2=1.7, TA3=1.3),
+             dict(zip(["CA", "OA", "LP", "RP", "OW", "HS", "TA", "TA1", "TA2", "TA3"], route_model.strategies[1][:-1])),
+             dict(zip(["CA", "OA", "LP", "RP", "OW", "HS", "TA", "TA1", "TA2", "TA3"], route_model.strategies[2][:-1])),
+             dict(CA=3, OA=1.5, LP=0.5, RP=2, OW=4, HS=0.2, TA=3, TA1=2.5, TA2=1.7, TA3=1.3)]
+
+
+def baseline_calculate_weights(CA, OA, LP, RP, OW, HS, TA, TA1, TA2, TA3, graph):
+    """
+    The edge loop of calculate_weights before the weights were vectorised, the reference of the weight engine
+    """
+    for road_id, (origin_num, destination_num, data) in enumerate(graph.edges(data=True)):
+
+        # speed limits and length
+        if isinstance(data.get('maxspeed'), list):
+            weight_used = data.get('length') / float(data.get('maxspeed')[0])
+            if float(data.get('maxspeed')[0]) > 50:
+                weight_used = weight_used * HS
+        elif isinstance(data.get('maxspeed'), str):
+            weight_used = data.get('length') / float(data.get('maxspeed'))
+            if float(data.get('maxspeed')) > 50:
+                weight_used = weight_used * HS
+        else:
+            weight_used = data.get('length') / 30.0
+
+        # cameras
+        if "camera" in data:
+            weight_used = weight_used * CA
+
+        # obstacle avoidance
+        if "roundabout" in data:
+            weight_used = weight_used * OA
+        if "traffic_light" in data:
+            weight_used = weight_used * OA
+        if "bridge" in data:
+            weight_used = weight_used * OA
+        if "tunnel" in data:
+            weight_used = weight_used * OA
+
+        # Lane preference
+        if "lanes" in data and int(data["lanes"][0]) > 1:
+            weight_used = weight_used * LP
+
+        # residential preference
+        if data["highway"] in ['residential']:
+            weight_used = weight_used * RP
+
+        # One way
+        if data["oneway"]:
+            weight_used = weight_used * OW
+
+        # Traffic avoidance
+        if 'highway' in data:
+            if TA > 1:
+                if data["highway"] in ['motorway', 'motorway_link', 'trunk']:
+                    weight_used = weight_used * TA * TA1
+                elif data["highway"] in ['primary', 'primary_link', 'secondary']:
+                    weight_used = weight_used * TA * TA2
+                elif data["highway"] in ['tertiary']:
+                    weight_used = weight_used * TA * TA3
+
+        nx.set_edge_attributes(graph,
+                               {(origin_num, destination_num, 0): {
+                                   "used_weight": weight_used},
+                                   (origin_num, destination_num, 1): {
+                                       "used_weight": weight_used}})
+
+
+@pytest.fixture
+def attribute_graph():
+    """
+    Fixture with a graph that has every kind of weight relevant edge attribute, parallel edges with other
+    attributes and one way and two way roads
+    @return: the graph
+    """
+    graph = nx.MultiDiGraph(crs="epsg:4326")
+    for node in range(1, 6):
+        graph.add_node(node, x=4.0 + 0.001 * node, y=52.0)
+    roads = [
+        (1, 2, {"length": 120.0, "maxspeed": ["70", "50"], "highway": "motorway", "oneway": True, "lanes": "2"}),
+        (2, 3, {"length": 80.0, "maxspeed": "50", "highway": "primary", "oneway": False, "camera": True}),
+        (3, 2, {"length": 80.0, "maxspeed": "50", "highway": "primary", "oneway": False, "camera": True}),
+        (3, 4, {"length": 60.0, "highway": "residential", "oneway": False, "traffic_light": True, "bridge": True}),
+        (4, 3, {"length": 60.0, "highway": "residential", "oneway": False, "roundabout": True}),
+        # parallel edges with other attributes, every edge of a pair gets the weight of the last edge
+        (4, 5, {"length": 90.0, "maxspeed": "80", "highway": "tertiary", "oneway": True, "tunnel": True}),
+        (4, 5, {"length": 100.0, "maxspeed": "30", "highway": "secondary", "oneway": True, "lanes": "3"}),
+        (5, 1, {"length": 200.0, "maxspeed": "100", "highway": "trunk", "oneway": True, "lanes": "1"}),
+        (1, 5, {"length": 210.0, "maxspeed": "60", "highway": "trunk_link", "oneway": True})
+    ]
+    for origin, destination, data in roads:
+        graph.add_edge(origin, destination, **data)
+    return graph
+
+
+@pytest.mark.parametrize("scenario", scenarios)
+@pytest.mark.parametrize("one_way_possible", [False, True])
+def test_weight_engine_matches_baseline_loop(attribute_graph, scenario, one_way_possible):
+    if one_way_possible:
+        expected_graph = attribute_graph.to_undirected()
+        weight_engine = undirected_weight_engine(attribute_graph, snapshot_edge_attributes)
+    else:
+        expected_graph = attribute_graph.copy()
+        weight_engine = edge_weight_engine(attribute_graph)
+    baseline_calculate_weights(graph=expected_graph, **scenario)
+
+    used_weight, changed_edges = weight_engine.update_weights(**scenario)
+    weight_engine.write_attribute("used_weight", used_weight, changed_edges)
+    for origin, destination, key, data in expected_graph.edges(keys=True, data=True):
+        assert weight_engine.graph[origin][destination][key]["used_weight"] == data["used_weight"]
+
+
+@pytest.mark.parametrize("one_way_possible", [False, True])
+def test_calculate_weights_matches_baseline_loop(synthetic_files, one_way_possible):
+    model = route_model.route_model(routing_backend="osmnx", cache_dir=None, **synthetic_files)
+    expected_graph = ox.load_graphml(synthetic_files["graph_file_path"])
+    if one_way_possible:
+        expected_graph = expected_graph.to_undirected()
+    variant = route_model.get_graph_variant(one_way_possible)
+
+    # the scenarios run one after the other, so the incremental updates of the changed edges are checked as well
+    for scenario in scenarios:
+        baseline_calculate_weights(graph=expected_graph, **scenario)
+        model.calculate_weights(variant=variant, **scenario)
+        graph = model.get_weight_engine(variant).graph
+        for origin, destination, key, data in expected_graph.edges(keys=True, data=True):
+            assert graph[origin][destination][key]["used_weight"] == data["used_weight"]
+
+
+def test_weight_cache_removes_least_recently_used_vectors():
+    vectors = {name: np.full(10, value, dtype=np.float64) for value, name in enumerate("abcd")}
+    cache = weight_cache(3 * vectors["a"].nbytes)
+    for name in "abc":
+        cache.put(name, vectors[name])
+
+    # a lookup marks a vector as most recently used, so b is removed instead of a
+    assert cache.get("a") is vectors["a"]
+    cache.put("d", vectors["d"])
+    assert "b" not in cache and len(cache) == 3
+    assert cache.get("b") is None
+    assert not cache.get("d").flags.writeable
+
+    # a vector larger than the cache is not stored
+    cache.put("e", np.zeros(40))
+    assert "e" not in cache
+    assert cache.statistics() == {"hits": 2, "misses": 1, "num_of_vectors": 3, "num_of_bytes": 3 * 80}
+
+
+def test_calculate_weights_uses_cached_weights(synthetic_files, monkeypatch):
+    model = route_model.route_model(routing_backend="compiled", cache_dir=None, **synthetic_files)
+    first, second = scenarios[1], scenarios[2]
+    weight_engine = model.get_weight_engine("OW_False")
+    compiled = model.get_compiled_graph("OW_False")
+    calls = {"compute_weights": 0, "set_weights": []}
+
+    def compute_weights(*args, **kwargs):
+        calls["compute_weights"] += 1
+        return compute_weights.original(*args, **kwargs)
+
+    def set_weights(name, weights, changed_edges=None):
+        calls["set_weights"].append(changed_edges)
+        return set_weights.original(name, weights, changed_edges)
+
+    compute_weights.original = weight_engine.compute_weights
+    set_weights.original = compiled.set_weights
+    monkeypatch.setattr(weight_engine, "compute_weights", compute_weights)
+    monkeypatch.setattr(compiled, "set_weights", set_weights)
+
+    model.calculate_weights(variant="OW_False", **first)
+    first_weights = compiled.weights["used_weight"].copy()
+    model.calculate_weights(variant="OW_False", **second)
+    assert calls["compute_weights"] == 2 and len(calls["set_weights"]) == 2
+
+    # the weights of the first scenario come from the cache, only the edges that changed are set again
+    model.calculate_weights(variant="OW_False", **first)
+    key = ("OW_False", *first.values())
+    assert calls["compute_weights"] == 2
+    assert weight_engine.used_weight is model.weight_cache.vectors[key]
+    assert not weight_engine.used_weight.flags.writeable
+    assert np.array_equal(compiled.weights["used_weight"], first_weights)
+    assert len(calls["set_weights"]) == 3 and len(calls["set_weights"][-1]) < weight_engine.num_of_edges
+
+    # the graph already has the weights of the same scenario, nothing is set again
+    model.calculate_weights(variant="OW_False", **first)
+    assert calls["compute_weights"] == 2 and len(calls["set_weights"]) == 3
+
+    # a new scenario key misses the cache and its weights are calculated
+    misses = model.weight_cache.misses
+    model.calculate_weights(variant="OW_False", **dict(first, TA=4))
+    assert model.weight_cache.misses == misses + 1
+    assert calls["compute_weights"] == 3 and len(calls["set_weights"]) == 4
+    assert ("OW_False", *dict(first, TA=4).values()) in model.weight_cache
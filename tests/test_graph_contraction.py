@@ -0,0 +1,130 @@
+import random
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from graph_contraction import contracted_graph
+
+protected_nodes = [1, 2, 3, 4, 31]
+
+options = [{}, {"goal_directed": True}, {"use_trees": True}]
+
+
+@pytest.fixture
+def chain_graph(make_graph):
+    """
+    Fixture with a graph of which the chains cover the cases of the contraction: parallel chains and a direct
+    road between the same two nodes, a chain that returns to its first node, a protected node inside a chain
+    and a one way chain. The parallel routes between nodes 1 and 2 all have the same cost.
+    @return: the graph
+    """
+    positions = {1: (0, 0), 2: (3, 0), 3: (3, 3), 4: (0, 3), 10: (1, 1), 11: (2, 1), 12: (1.5, -1),
+                 20: (4, 0), 21: (5, 1), 22: (4, 1), 30: (2.5, 3), 31: (1.5, 3), 32: (0.5, 3),
+                 40: (-1, 2), 41: (-1, 1), 50: (2, 2)}
+    roads = [(1, 10, 100), (10, 11, 100), (11, 2, 100), (1, 12, 150), (12, 2, 150), (1, 2, 300),
+             (2, 20, 100), (20, 21, 100), (21, 22, 100), (22, 2, 100),
+             (3, 30, 100), (30, 31, 100), (31, 32, 100), (32, 4, 100),
+             (2, 3, 300), (3, 50, 200), (50, 1, 200)]
+    one_way_roads = [(4, 40, 100), (40, 41, 100), (41, 1, 100)]
+    return make_graph(positions, roads, one_way_roads)
+
+
+def path_cost(compiled, path, weight="length"):
+    return sum(compiled.arc_weight(compiled.node_index[u], compiled.node_index[v], weight)
+               for u, v in zip(path, path[1:]))
+
+
+def k_shortest_path_costs(routing_graph, compiled, orig, dest, k, **option):
+    return [path_cost(compiled, path) for path in routing_graph.k_shortest_paths(orig, dest, k, weight="length",
+                                                                                  **option)]
+
+
+def od_pairs():
+    return [(orig, dest) for orig in protected_nodes for dest in protected_nodes if orig != dest]
+
+
+def test_contraction_keeps_protected_nodes_and_one_arc_per_pair(chain_graph, make_compiled_graph):
+    compiled = make_compiled_graph(chain_graph)
+    contracted = contracted_graph(compiled, protected_nodes)
+
+    assert all(node in contracted.node_index for node in protected_nodes)
+    # the chain with the protected node is split in two
+    assert 30 not in contracted.node_index and 32 not in contracted.node_index
+    assert contracted.num_of_nodes < compiled.num_of_nodes
+
+    arcs = list(zip(contracted.arc_origins.tolist(), contracted.targets.tolist()))
+    assert len(arcs) == len(set(arcs))
+    assert all(origin != destination for origin, destination in arcs)
+
+
+@pytest.mark.parametrize("option", options)
+def test_contracted_paths_match_compiled_with_ties(chain_graph, make_compiled_graph, option):
+    compiled = make_compiled_graph(chain_graph)
+    contracted = contracted_graph(compiled, protected_nodes)
+
+    for orig, dest in od_pairs():
+        assert k_shortest_path_costs(contracted, compiled, orig, dest, 5, **option) == \
+            pytest.approx(k_shortest_path_costs(compiled, compiled, orig, dest, 5, **option))
+
+        # all loopless paths are found, between paths of equal cost another path can be chosen
+        paths = list(contracted.k_shortest_paths(orig, dest, 1000, weight="length", **option))
+        expected = list(compiled.k_shortest_paths(orig, dest, 1000, weight="length", **option))
+        assert sorted(map(tuple, paths)) == sorted(map(tuple, expected))
+
+
+def test_contracted_paths_match_compiled_without_ties(chain_graph, make_compiled_graph):
+    random.seed(4)
+    for u, v, key, data in chain_graph.edges(keys=True, data=True):
+        data["length"] = random.uniform(50, 150)
+    compiled = make_compiled_graph(chain_graph)
+    contracted = contracted_graph(compiled, protected_nodes)
+
+    for orig, dest in od_pairs():
+        assert list(contracted.k_shortest_paths(orig, dest, 5, weight="length")) == \
+            list(compiled.k_shortest_paths(orig, dest, 5, weight="length"))
+
+
+def test_contracted_paths_follow_weight_updates(chain_graph, make_compiled_graph):
+    compiled = make_compiled_graph(chain_graph)
+    contracted = contracted_graph(compiled, protected_nodes)
+    list(contracted.k_shortest_paths(1, 2, 5, weight="length"))
+
+    # the chain over node 10 becomes the only shortest route between nodes 1 and 2
+    edge_keys = list(chain_graph.edges(keys=True))
+    changed_edges = [index for index, edge in enumerate(edge_keys) if edge[:2] in [(1, 10), (10, 1)]]
+    for index in changed_edges:
+        chain_graph.edges[edge_keys[index]]["length"] = 50.0
+    compiled.set_weights("length", np.array([chain_graph.edges[edge]["length"] for edge in edge_keys]),
+                         np.array(changed_edges))
+
+    assert next(contracted.k_shortest_paths(1, 2, 1, weight="length")) == [1, 10, 11, 2]
+    for orig, dest in od_pairs():
+        assert k_shortest_path_costs(contracted, compiled, orig, dest, 5) == \
+            pytest.approx(k_shortest_path_costs(compiled, compiled, orig, dest, 5))
+
+
+def test_shortest_path_to_from_contracted_nodes(chain_graph, make_compiled_graph):
+    compiled = make_compiled_graph(chain_graph)
+    contracted = contracted_graph(compiled, protected_nodes)
+
+    for orig in chain_graph.nodes:
+        for dest in protected_nodes:
+            if orig == dest:
+                continue
+            path = contracted.shortest_path_to(orig, dest, weight="length")
+            expected = compiled.shortest_path_to(orig, dest, weight="length")
+            assert path[0] == orig and path[-1] == dest
+            assert all(chain_graph.has_edge(u, v) for u, v in zip(path, path[1:]))
+            assert path_cost(compiled, path) == pytest.approx(path_cost(compiled, expected))
+
+
+def test_shortest_path_to_from_detached_cycle_has_no_path(make_graph, make_compiled_graph):
+    # all nodes of the triangle have two neighbours and are contracted, no chain reaches them
+    positions = {1: (0, 0), 2: (1, 0), 60: (3, 0), 61: (4, 0), 62: (3.5, 1)}
+    graph = make_graph(positions, [(1, 2, 100), (60, 61, 100), (61, 62, 100), (62, 60, 100)])
+    contracted = contracted_graph(make_compiled_graph(graph), [1, 2])
+
+    assert 60 not in contracted.node_index
+    with pytest.raises(nx.NetworkXNoPath):
+        contracted.shortest_path_to(60, 2, weight="length")
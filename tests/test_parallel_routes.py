@@ -0,0 +1,30 @@
+import pytest
+
+import route_model
+
+scenarios = [dict(seed=7), dict(seed=7, TA=3), dict(seed=7, one_way_possible=True, OW=5),
+             dict(seed=8, rational=False, start_strategy=1, end_strategy=2, strategy_change_percentage=0.5)]
+
+
+def run_scenarios(synthetic_files, **settings):
+    model = route_model.route_model(routing_backend="compiled", cache_dir=None, **synthetic_files, **settings)
+    try:
+        return [model.run_model(**scenario) for scenario in scenarios]
+    finally:
+        model.close()
+
+
+@pytest.mark.parametrize("settings", [{}, {"shortest_path_trees": True}])
+def test_parallel_results_equal_serial_results(synthetic_files, settings):
+    assert run_scenarios(synthetic_files, n_processes=2, **settings) == run_scenarios(synthetic_files, **settings)
+
+
+def test_unchanged_weights_are_not_shared_again(synthetic_files):
+    model = route_model.route_model(routing_backend="compiled", cache_dir=None, n_processes=2, **synthetic_files)
+    try:
+        results = model.run_model(seed=7, TA=3)
+        weight_versions = dict(model.get_parallel_route_network().weight_versions)
+        assert model.run_model(seed=7, TA=3) == results
+        assert model.get_parallel_route_network().weight_versions == weight_versions
+    finally:
+        model.close()
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from shapely.geometry import Point, Polygon
+
+import route_model
+
+polygons = [
+    # a concave polygon, a thin triangle that accepts few candidates and a polygon with a hole
+    Polygon([(4.0, 52.0), (4.1, 52.0), (4.1, 52.1), (4.05, 52.02), (4.0, 52.1)]),
+    Polygon([(4.0, 52.0), (4.1, 52.001), (4.0, 52.1)]),
+    Polygon([(4.0, 52.0), (4.1, 52.0), (4.1, 52.1), (4.0, 52.1)],
+            holes=[[(4.01, 52.01), (4.09, 52.01), (4.09, 52.09), (4.01, 52.09)]])
+]
+
+
+def baseline_random_points_in_polygon(polygon, number):
+    """
+    The rejection sampler of random_points_in_polygon before the candidates were drawn in batches
+    """
+    points = []
+    minx, miny, maxx, maxy = polygon.bounds
+    while len(points) < number:
+        pnt = Point(np.random.uniform(minx, maxx), np.random.uniform(miny, maxy))
+        if polygon.contains(pnt):
+            points.append(pnt)
+    return points
+
+
+def baseline_bounded_points(polygon, number, bounds):
+    """
+    The loop of generate_points before the bounds were passed to random_points_in_polygon, which draws one point
+    at a time until it lies within the bounds
+    """
+    points = []
+    for _ in range(number):
+        while True:
+            point = baseline_random_points_in_polygon(polygon, 1)[0]
+            if (bounds[3] > point.y > bounds[1]) & (bounds[2] > point.x > bounds[0]):
+                points.append(point)
+                break
+    return points
+
+
+@pytest.mark.parametrize("polygon", polygons)
+@pytest.mark.parametrize("number", [1, 3, 40])
+def test_random_points_in_polygon_match_baseline_sampler(polygon, number):
+    bounds = (4.02, 52.005, 4.08, 52.08)
+    for seed in [0, 1, 42]:
+        np.random.seed(seed)
+        expected = baseline_random_points_in_polygon(polygon, number) + \
+            baseline_bounded_points(polygon, number, bounds)
+        expected_next = np.random.random_sample()
+
+        # the random stream continues at the same position, so the next draws of the model do not change either
+        np.random.seed(seed)
+        points = route_model.random_points_in_polygon(polygon, number) + \
+            route_model.random_points_in_polygon(polygon, number, bounds)
+        assert [(point.x, point.y) for point in points] == [(point.x, point.y) for point in expected]
+        assert np.random.random_sample() == expected_next
+
+
+def test_run_models_matches_scenarios_run_alone(synthetic_files):
+    # the batch returns to seed 11 after seed 12, and seed 12 first follows a scenario on the undirected graph
+    scenarios = [dict(seed=11, RP=0.5), dict(seed=11, one_way_possible=True, OW=5), dict(seed=12, OA=5),
+                 dict(seed=11, TA=3, num_of_paths=2), dict(seed=12, rational=False, start_strategy=1, end_strategy=2,
+                                                           strategy_change_percentage=0.5)]
+
+    def new_model():
+        return route_model.route_model(routing_backend="compiled", cache_dir=None, **synthetic_files)
+
+    alone = []
+    for scenario in scenarios:
+        model = new_model()
+        alone.append((model.run_model(**scenario), model.points, model.path_costs_base_case))
+
+    model = new_model()
+    one_by_one = [model.run_model(**scenario) for scenario in scenarios]
+    batch = new_model().run_models(scenarios)
+
+    assert batch == one_by_one == [results for results, points, path_costs in alone]
+    # the points and path costs of a seed do not depend on the scenario that generated them
+    assert alone[0][1:] == alone[1][1:] == alone[3][1:]
+    assert alone[2][1:] == alone[4][1:]
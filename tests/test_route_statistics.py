@@ -0,0 +1,147 @@
+import random
+import warnings
+
+import numpy as np
+import pytest
+
+from route_statistics import route_connectivity, route_position_frequency, running_statistic, route_network
+
+
+def baseline_connectivity(routes):
+    """
+    The pairwise connectivity loop of generate_route_network before the route incidence matrix
+    """
+    connectivity = []
+    for route in routes:
+        connectivity_route = 0
+        for route_it in routes:
+            if route == route_it:
+                continue
+            connectivity_route += len(list((value for value in list(route) if value in list(route_it))))
+        connectivity.append(connectivity_route)
+    return connectivity
+
+
+def baseline_position_frequency(routes):
+    """
+    The node frequency loop of generate_route_network before the route incidence matrix
+    """
+    node_frequency = {}
+    for route in routes:
+        for i in range(0, len(route) - 1):
+            if i in node_frequency:
+                node_frequency[i] += 1
+            else:
+                node_frequency[i] = 1
+    return list(node_frequency.values())
+
+
+def random_routes(num_of_routes, num_of_nodes, max_length):
+    """
+    Function that builds random routes that revisit nodes, with copies of some of the routes
+    @return: list of routes, every route a list of nodes
+    """
+    routes = [[random.randrange(num_of_nodes) for _ in range(random.randint(1, max_length))]
+              for _ in range(num_of_routes)]
+    routes += [list(route) for route in random.sample(routes, num_of_routes // 4)]
+    random.shuffle(routes)
+    return routes
+
+
+def test_route_connectivity_matches_baseline_loop():
+    # a route that revisits nodes, two copies of a route, a route of one node and a route without overlap
+    routes = [[1, 2, 3, 2, 4], [2, 5, 6], [1, 2, 3, 2, 4], [6, 5, 5, 6], [7], [8, 9], [3, 6, 1]]
+    assert route_connectivity(routes).tolist() == baseline_connectivity(routes)
+
+    random.seed(5)
+    for _ in range(20):
+        routes = random_routes(30, 25, 12)
+        assert route_connectivity(routes).tolist() == baseline_connectivity(routes)
+    assert len(route_connectivity([])) == 0
+
+
+def test_route_position_frequency_matches_baseline_loop():
+    routes = [[1, 2, 3, 2, 4], [2, 5, 6], [1, 2, 3, 2, 4], [7], [8, 9]]
+    assert route_position_frequency(routes).tolist() == baseline_position_frequency(routes)
+
+    random.seed(6)
+    for _ in range(20):
+        routes = random_routes(30, 25, 12)
+        assert route_position_frequency(routes).tolist() == baseline_position_frequency(routes)
+    assert np.array_equal(route_position_frequency([[1], [2]]), baseline_position_frequency([[1], [2]]))
+
+
+def baseline_statistic(values):
+    """
+    The two pass mean and population variance of calculate_scenario_statistics before the accumulators
+    """
+    mean = sum(values) / len(values)
+    return mean, sum((i - mean) ** 2 for i in values) / len(values)
+
+
+def test_merged_source_statistics_match_single_pass_baseline():
+    random.seed(7)
+    num_of_paths = 3
+    merged = {"node_frequency": running_statistic(), "connectivity": running_statistic(),
+              "continuity": running_statistic()}
+    values = {name: [] for name in merged}
+
+    # every source adds its values to its own accumulators, which are merged in source order
+    for source in range(12):
+        routes = random_routes(random.randint(2, 15), 40, 20)
+        source_statistics = {name: running_statistic() for name in merged}
+
+        node_frequency = baseline_position_frequency(routes)
+        source_statistics["node_frequency"].add_values(route_position_frequency(routes) / num_of_paths)
+        values["node_frequency"] += [node_freq / num_of_paths for node_freq in node_frequency]
+
+        route_lengths = np.array([len(route) for route in routes], dtype=np.float64)
+        source_statistics["connectivity"].add_values((route_connectivity(routes) / route_lengths) / num_of_paths)
+        values["connectivity"] += [(connectivity_route / len(route)) / num_of_paths
+                                   for connectivity_route, route in zip(baseline_connectivity(routes), routes)]
+
+        # the continuity values are added one by one, relative to a random base case path cost
+        for route in routes:
+            continuity = len(route) / random.uniform(100, 500)
+            source_statistics["continuity"].add(continuity)
+            values["continuity"].append(continuity)
+        for name in merged:
+            merged[name].merge(source_statistics[name])
+
+    for name, statistic in merged.items():
+        mean, variance = baseline_statistic(values[name])
+        assert statistic.count == len(values[name])
+        assert statistic.mean == pytest.approx(mean, rel=1e-12)
+        assert statistic.variance() == pytest.approx(variance, rel=1e-12)
+
+
+def test_merge_order_and_empty_accumulators_do_not_change_statistics():
+    random.seed(8)
+    values = [random.uniform(0, 10) for _ in range(100)]
+    mean, variance = baseline_statistic(values)
+
+    # parts of different sizes, as the sources of worker processes, merged in another order
+    parts = [values[:1], values[1:40], [], values[40:41], values[41:]]
+    merged = running_statistic()
+    for part in reversed(parts):
+        statistic = running_statistic()
+        statistic.add_values(part)
+        merged.merge(statistic)
+    merged.merge(running_statistic())
+
+    assert merged.count == len(values)
+    assert merged.mean == pytest.approx(mean, rel=1e-12)
+    assert merged.variance() == pytest.approx(variance, rel=1e-12)
+
+
+def test_empty_route_network_statistics():
+    network = route_network()
+    # routes of a single node have no edges
+    network.add_routes([[1], [2]])
+    network.merge(route_network())
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        statistics = network.statistics(betweenness_pivots=10, seed=1)
+    assert statistics["num_of_nodes"] == 0 and statistics["num_of_edges"] == 0
+    assert all(value == 0 for value in statistics.values())
@@ -0,0 +1,304 @@
+"""
+Loader of the NDW traffic speed feed into speed profiles of the edges of the road graph
+
+The DATEX II files are parsed as a stream with iterparse, every element is removed from the tree after it is read,
+so the memory use does not depend on the size of the feed. The measurement sites are snapped in bulk to the closest
+edge with one STR-tree and the speeds are kept per edge and hour of the day in two small arrays.
+
+The speed feed only refers to the measurement sites by id and version, their locations are in the measurement site
+table. Both are published by NDW (Nationaal Dataportaal Wegverkeer) on https://opendata.ndw.nu, the speeds as
+trafficspeed.xml.gz, refreshed every minute, and the site table as measurement_current.xml.gz. The site table is
+not built from other data, it is downloaded as it is. NDW changes the sites over time, so the table has to be
+downloaded on the same day as the speed files, sites of the feed that are not in the table are skipped.
+
+    $ curl -o data/traffic/measurement_current.xml.gz https://opendata.ndw.nu/measurement_current.xml.gz
+    $ python traffic_speeds.py --sites data/traffic/measurement_current.xml.gz \\
+        --speeds "data/traffic/trafficspeed (1).xml.gz" --output graph/traffic_speed_profiles.npz
+"""
+
+import argparse
+import gzip
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import osmnx as ox
+
+from graph_cache import file_hash
+from spatial_index import edge_spatial_index
+
+default_graph_file_path = "graph/graph_base_case.graphml"
+default_site_table_file_path = "data/traffic/measurement_current.xml.gz"
+default_speed_file_paths = ["data/traffic/trafficspeed (1).xml.gz"]
+default_speed_profile_file_path = "graph/traffic_speed_profiles.npz"
+
+datex_namespace = "{http://datex2.eu/schema/2/2_0}"
+
+# the profiles have a time slot per hour of the day, in UTC like the measurement times of the feed
+num_of_time_slots = 24
+
+# the measurement sites of NDW are on the larger roads, so they are only snapped to these road types
+speed_highways = ["motorway", "motorway_link", "trunk", "trunk_link", "primary", "primary_link", "secondary",
+                  "secondary_link"]
+
+# sites further than this distance in degrees (about 35 to 55 meters) from an edge are not used
+max_snap_distance = 0.0005
+
+
+def open_feed(file_path):
+    """
+    Function that opens a feed file, gzip compressed files are decompressed while they are read
+    @param file_path: XML file or gzip compressed XML file
+    @return: binary file object
+    """
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+def iter_elements(file_path, tag):
+    """
+    Function that streams the elements with a tag from a DATEX II file. An element is removed from its parent
+    after it is yielded, so only one element is in memory at a time.
+    @param file_path: XML file or gzip compressed XML file
+    @param tag: tag of the elements without namespace
+    @return: generator of the elements
+    """
+    tag = datex_namespace + tag
+    parents = []
+    with open_feed(file_path) as file:
+        for event, element in ET.iterparse(file, events=("start", "end")):
+            if event == "start":
+                parents.append(element)
+                continue
+
+            parents.pop()
+            if element.tag == tag:
+                yield element
+                if parents:
+                    parents[-1].remove(element)
+
+
+def iter_site_locations(file_path):
+    """
+    Function that streams the locations of the measurement sites from the measurement site table
+    @param file_path: DATEX II measurement site table
+    @return: generator of (site id, latitude, longitude) tuples
+    """
+    for record in iter_elements(file_path, "measurementSiteRecord"):
+        location = record.find(f".//{datex_namespace}locationForDisplay")
+        if location is None:
+            location = record.find(f".//{datex_namespace}pointCoordinates")
+        if location is None:
+            continue
+        yield (record.get("id"), float(location.findtext(datex_namespace + "latitude")),
+               float(location.findtext(datex_namespace + "longitude")))
+
+
+def iter_site_speeds(file_path):
+    """
+    Function that streams the measured speeds from a traffic speed file. The speed of a site is the mean of the
+    speeds of its lanes and vehicle classes weighted by the number of vehicles, lanes without vehicles are skipped.
+    @param file_path: DATEX II traffic speed file
+    @return: generator of (site id, hour of the day, speed, number of vehicles) tuples
+    """
+    for measurements in iter_elements(file_path, "siteMeasurements"):
+        measurement_time = measurements.findtext(datex_namespace + "measurementTimeDefault")
+        if not measurement_time:
+            continue
+
+        speed_total = 0.0
+        num_of_vehicles = 0
+        for average_speed in measurements.iter(datex_namespace + "averageVehicleSpeed"):
+            vehicles = int(average_speed.get("numberOfInputValuesUsed", 0))
+            speed = float(average_speed.findtext(datex_namespace + "speed", -1))
+            # a speed of -1 means that there was no measurement
+            if vehicles > 0 and speed > 0:
+                speed_total += speed * vehicles
+                num_of_vehicles += vehicles
+
+        if num_of_vehicles > 0:
+            site_id = measurements.find(datex_namespace + "measurementSiteReference").get("id")
+            yield site_id, int(measurement_time[11:13]), speed_total / num_of_vehicles, num_of_vehicles
+
+
+class edge_speed_profiles:
+    """
+            Class that contains the observed speeds of the edges of a road graph per hour of the day.
+            Only the edges with a measurement site are stored.
+
+            Attributes
+            ----------
+            edges: array[int]
+                (origin, destination) of every edge with a measurement site
+            speed: array[float]
+                mean observed speed per edge and time slot, nan if there were no vehicles
+            vehicles: array[int]
+                number of vehicles the mean speed is based on per edge and time slot
+            graph_file_hash: str
+                content hash of the graph file the sites were snapped to
+    """
+
+    def __init__(self, edges, speed, vehicles, graph_file_hash=None):
+        """
+            Init method that stores the profile arrays.
+            @param edges: array with the (origin, destination) of every edge
+            @param speed: array with the mean speed per edge and time slot
+            @param vehicles: array with the number of vehicles per edge and time slot
+            @param graph_file_hash: content hash of the graph file the sites were snapped to
+        """
+        self.edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self.speed = np.asarray(speed, dtype=np.float32).reshape(-1, num_of_time_slots)
+        self.vehicles = np.asarray(vehicles, dtype=np.uint32).reshape(-1, num_of_time_slots)
+        self.graph_file_hash = graph_file_hash
+
+    def mean_speeds(self, time_slot=None):
+        """
+        Function that returns the observed speed of every stored edge in a time slot
+        @param time_slot: hour of the day, None gives the mean over the whole day weighted by the vehicles
+        @return: array with the speed of every stored edge, nan if there were no vehicles
+        """
+        if time_slot is not None:
+            return self.speed[:, time_slot].astype(np.float64)
+
+        vehicles = self.vehicles.sum(axis=1, dtype=np.float64)
+        speed_total = np.nansum(self.speed * self.vehicles, axis=1, dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(vehicles > 0, speed_total / vehicles, np.nan)
+
+    def edge_speeds(self, edge_keys, time_slot=None):
+        """
+        Function that returns the observed speed of the edges of a graph, for example of a weight engine.
+        An edge of an undirected graph gets the speed of the first of its two directions that has one.
+        @param edge_keys: (origin, destination, key) of every edge
+        @param time_slot: hour of the day, None gives the mean over the whole day
+        @return: array with the observed speed of every edge, nan if the edge has no observed speed
+        """
+        rows = {edge: row for row, edge in enumerate(map(tuple, self.edges.tolist()))}
+        mean_speeds = self.mean_speeds(time_slot)
+
+        speeds = np.full(len(edge_keys), np.nan)
+        for index, (origin_num, destination_num, key) in enumerate(np.asarray(edge_keys).tolist()):
+            row = rows.get((origin_num, destination_num), rows.get((destination_num, origin_num)))
+            if row is not None:
+                speeds[index] = mean_speeds[row]
+        return speeds
+
+    def save(self, file_path):
+        """
+        Function that saves the profile arrays in a compressed .npz file
+        @param file_path: path of the file
+        """
+        np.savez_compressed(file_path, edges=self.edges, speed=self.speed, vehicles=self.vehicles,
+                            graph_file_hash=np.array(self.graph_file_hash or ""))
+
+
+def load_speed_profiles(file_path):
+    """
+    Function that loads the speed profiles saved by edge_speed_profiles.save
+    @param file_path: path of the .npz file
+    @return: the speed profiles
+    """
+    with np.load(file_path) as arrays:
+        return edge_speed_profiles(arrays["edges"], arrays["speed"], arrays["vehicles"],
+                                   str(arrays["graph_file_hash"]) or None)
+
+
+def snap_sites(graph, site_table_file_path, highways=speed_highways, max_distance=max_snap_distance):
+    """
+    Function that snaps the measurement sites within the bounds of the graph in bulk to their closest edge.
+    A site on a road that can be driven in both directions is used for both directions.
+    @param graph: the osmnx graph
+    @param site_table_file_path: DATEX II measurement site table
+    @param highways: road types the sites are snapped to, None uses all edges
+    @param max_distance: maximum distance in degrees between a site and its edge
+    @return: list with the (origin, destination) of every edge with a site, and a dictionary with the indexes
+    in that list of the edges of every site
+    """
+    x = np.array([data["x"] for node, data in graph.nodes(data=True)])
+    y = np.array([data["y"] for node, data in graph.nodes(data=True)])
+
+    site_ids = []
+    latitude = []
+    longitude = []
+    for site_id, site_latitude, site_longitude in iter_site_locations(site_table_file_path):
+        if x.min() <= site_longitude <= x.max() and y.min() <= site_latitude <= y.max():
+            site_ids.append(site_id)
+            latitude.append(site_latitude)
+            longitude.append(site_longitude)
+
+    edges = []
+    rows = {}
+    site_rows = {}
+    if not site_ids:
+        return edges, site_rows
+
+    edge_index = edge_spatial_index(graph, highways=highways)
+    for site_id, edge in zip(site_ids, edge_index.nearest_edges(longitude, latitude, max_distance)):
+        if edge is None:
+            continue
+        origin_num, destination_num = edge
+        site_edges = [(origin_num, destination_num)]
+        if graph.has_edge(destination_num, origin_num):
+            site_edges.append((destination_num, origin_num))
+
+        for site_edge in site_edges:
+            if site_edge not in rows:
+                rows[site_edge] = len(edges)
+                edges.append(site_edge)
+        site_rows[site_id] = [rows[site_edge] for site_edge in site_edges]
+    return edges, site_rows
+
+
+def build_speed_profiles(graph, site_table_file_path=default_site_table_file_path,
+                         speed_file_paths=default_speed_file_paths, graph_file_hash=None):
+    """
+    Function that builds the speed profiles of the edges of a graph from any number of traffic speed files.
+    The measurements of a file are collected in flat arrays and added to the profiles in one vectorised step.
+    @param graph: the osmnx graph
+    @param site_table_file_path: DATEX II measurement site table
+    @param speed_file_paths: list with the DATEX II traffic speed files, for example one per minute of a day
+    @param graph_file_hash: content hash of the graph file, stored to check the profiles belong to the graph
+    @return: the speed profiles
+    """
+    edges, site_rows = snap_sites(graph, site_table_file_path)
+
+    speed_total = np.zeros((len(edges), num_of_time_slots), dtype=np.float64)
+    vehicles = np.zeros((len(edges), num_of_time_slots), dtype=np.float64)
+    for speed_file_path in speed_file_paths:
+        rows = []
+        slots = []
+        speeds = []
+        counts = []
+        for site_id, hour, speed, num_of_vehicles in iter_site_speeds(speed_file_path):
+            for row in site_rows.get(site_id, []):
+                rows.append(row)
+                slots.append(hour)
+                speeds.append(speed)
+                counts.append(num_of_vehicles)
+
+        counts = np.array(counts, dtype=np.float64)
+        np.add.at(speed_total, (rows, slots), np.array(speeds, dtype=np.float64) * counts)
+        np.add.at(vehicles, (rows, slots), counts)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed = np.where(vehicles > 0, speed_total / vehicles, np.nan)
+    return edge_speed_profiles(edges, speed, vehicles, graph_file_hash)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the observed speed profiles of the edges of the road graph")
+    parser.add_argument("--graph", default=default_graph_file_path, help="GraphML file of the road graph")
+    parser.add_argument("--sites", default=default_site_table_file_path,
+                        help="DATEX II measurement site table, measurement_current.xml.gz of opendata.ndw.nu")
+    parser.add_argument("--speeds", nargs="+", default=default_speed_file_paths, help="DATEX II traffic speed files")
+    parser.add_argument("--output", default=default_speed_profile_file_path, help=".npz file of the profiles")
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    profiles = build_speed_profiles(ox.load_graphml(arguments.graph), arguments.sites, arguments.speeds,
+                                    file_hash(arguments.graph))
+    profiles.save(arguments.output)
+    print(f"{len(profiles.edges)} edges with a measurement site, "
+          f"{int(np.count_nonzero(profiles.vehicles.sum(axis=1)))} with observed speeds")
+    print(f"built {arguments.output} in {time.perf_counter() - start:.1f}s")